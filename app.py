@@ -3,7 +3,7 @@
 # ===============================================================================
 # Name:               02_app
 # Author:             Rodd/Patel
-# Last Edited Date:   11/19/19
+# Last Edited Date:   10/18/26
 # Description:        Loads packages, loads and summarizes data, and defines dash components.
 #  
 #                   
@@ -11,13 +11,22 @@
 #                        pip install dash==1.4.1  # The core dash backend
 #                        pip install dash-daq==0.2.1  # DAQ components (newly open-sourced!)
 #                    Dash code is finnicky on formatting and placement. There is some code that could be made into a function but dash does not like calling a function.
+#                    The recommendation tables are loaded on the first callback that needs them so app import
+#                    and worker boot stay fast. With LAZY_TABLES=0 they are loaded at import instead, and
+#                    gunicorn.conf.py preloads this module in the master so the workers inherit them copy-on-write.
+#                    Each worker checks for a newly published data version every DATA_RELOAD_SECONDS and swaps to it
+#                    without a restart, the layout is rebuilt per page load so the top 10 chart follows the version.
+#                    Filters are evaluated on a thread pool with a deadline, a table showing a partial result
+#                    refreshes itself until the full result is in (see filter_executor.py).
 #                     
 #
 # Warnings:           
 #
 #
 # Outline:            Import packages.
-#                     Load pickles.
+#                     Load (memory-map) the dashboard tables, the recommendation tables on first use.
+#                     Read the table columns from the store schema.
+#                     Watch for new data versions.
 #                     Define dash layout for header (logos and title).
 #                     Define dash layout for top 10 products visual.
 #                     Define dash layout for product and user tabs.
@@ -29,14 +38,27 @@
 # 02.00.02 | Import Packages
 # =============================================================================
 # Import packages
-import pandas as pd
 from pathlib import Path
-from math import trunc
+from math import trunc, ceil
+from functools import partial
 
 # Import modules (other scripts)
 from environment_configuration import working_directory, dash_data_path
 from environment_configuration import product_recs_path, user_recs_path, top_10_products_path
-from environment_configuration import colors, PAGE_SIZE, operators, split_filter_part
+from environment_configuration import product_recs_store_path, user_recs_store_path, top_10_products_store_path
+from environment_configuration import colors, PAGE_SIZE, LAZY_TABLES, FAST_JSON, METRICS_PATH, DATA_RELOAD_SECONDS
+from environment_configuration import PARTIAL_REFRESH_MS, API_PATH
+from environment_configuration import product_key_columns, user_key_columns
+from environment_configuration import text_index_columns, sort_index_columns, bitmap_index_columns
+from data_store import load_table, LazyTable
+from recommendation_etl import product_columns as etl_product_columns, user_columns as etl_user_columns
+from table_index import build_key_indexes
+from data_versions import version_directory, Dataset, VersionWatcher
+from filter_engine import parse_filter_query
+from filter_executor import evaluate_filter, register_client_cookie
+from recommendation_api import register_recommendation_api
+from json_payload import page_payload, json_encoder, install_json_encoder
+from callback_metrics import callback_timer, timed_json_encoder, register_metrics_endpoint
 
 # Dash packages
 import dash
@@ -53,14 +75,58 @@ import dash_table
 # =============================================================================
 # 02.01.01| Import Data
 # =============================================================================
-# Load product recommendations
-product_recs = pd.read_pickle(Path(working_directory + dash_data_path + product_recs_path))
+# tables are memory-mapped from the columnar store so all workers share one copy through the page cache
+# the pickles are only read when the ETL has not written the columnar store yet
+# the store also holds the precomputed sort order of every sortable column
+# the tables are sorted by id so each id maps to one contiguous slice of rows,
+# the key indexes turn equality filters on these columns into a slice instead of a full column scan
+# each ETL run publishes its stores as a data version (see data_versions.py), the tables below are those of one version
+def load_recs(directory, store_path, pickle_path, key_columns):
+    table = load_table(Path(str(directory) + store_path),
+                       Path(working_directory + dash_data_path + pickle_path),
+                       text_index_columns, sort_index_columns, bitmap_index_columns)
+    return table, build_key_indexes(table, key_columns)
 
-# Load user recommendations
-user_recs = pd.read_pickle(Path(working_directory + dash_data_path + user_recs_path))
 
-# Load top 10 producs
-top_10_products = pd.read_pickle(Path(working_directory + dash_data_path + top_10_products_path))
+def load_dataset(version):
+    directory = version_directory(working_directory + dash_data_path, version)
+
+    # the recommendation tables are loaded by the first callback that needs them
+    # (most users never open the user tab), unless LAZY_TABLES is off
+    product_data = LazyTable(partial(load_recs, directory, product_recs_store_path, product_recs_path, product_key_columns))
+    user_data = LazyTable(partial(load_recs, directory, user_recs_store_path, user_recs_path, user_key_columns))
+
+    if not LAZY_TABLES:
+        product_data.get()
+        user_data.get()
+
+    # Load top 10 producs
+    # only ten rows, so it is turned into a regular data frame for the bar chart
+    top_10_products = load_table(Path(str(directory) + top_10_products_store_path),
+                                 Path(working_directory + dash_data_path + top_10_products_path)).to_frame()
+
+    # =============================================================================
+    # 02.01.02| Table Columns
+    # =============================================================================
+    # the DataTable columns are the ones the ETL writes the tables with (columnar store and pickle alike),
+    # so building the layout does not load or even open a table
+    product_columns = list(etl_product_columns)
+    user_columns = list(etl_user_columns)
+
+    return Dataset(version, {'product': product_data, 'user': user_data, 'top_10_products': top_10_products,
+                             'product_columns': product_columns, 'user_columns': user_columns})
+
+
+# a table the current version had loaded is loaded for the new version before the swap,
+# so no request waits on it after a reload
+def warm_dataset(dataset, previous):
+    for name in ('product', 'user'):
+        if previous[name].loaded():
+            dataset[name].get()
+
+
+# the current version, swapped in the background when the ETL publishes a new one (every DATA_RELOAD_SECONDS)
+data = VersionWatcher(working_directory + dash_data_path, load_dataset, DATA_RELOAD_SECONDS, warm_dataset)
 
 ## =============================================================================
 ## 02.02.01| Filter Data
@@ -82,218 +148,303 @@ app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
 server = app.server
 
-app.layout = html.Div(style={'backgroundColor': colors['d_blue_col']}, children=[
+# every dash response goes through this one encoder: orjson with FAST_JSON on and orjson installed
+# (see json_payload.py), wrapped so it times the response encoding of the callbacks (see callback_metrics.py)
+install_json_encoder(timed_json_encoder(json_encoder(FAST_JSON)))
+
+# callback timings (see callback_metrics.py)
+register_metrics_endpoint(server, METRICS_PATH)
+
+# the client id cookie lets a newer filter request supersede an older one of the same browser (see filter_executor.py)
+register_client_cookie(server)
+
+# JSON lookups of the recommendations of one product / reviewer for other services (see recommendation_api.py)
+register_recommendation_api(server, data, API_PATH)
+
+# the layout is built for every page load, so a reloaded data version shows up on the next page load
+def serve_layout():
+    dataset = data.current()
+    top_10_products = dataset['top_10_products']
+    product_columns = dataset['product_columns']
+    user_columns = dataset['user_columns']
+
+    return html.Div(style={'backgroundColor': colors['d_blue_col']}, children=[
         
         
-        html.Div([dbc.Row([
-        # CognoClick Logo
-                dbc.Col(html.Div(children=[html.Img(src=app.get_asset_url("../assets/CognoClick_upscaled_logo.jpg"),
-                                                    id="cognoclick-logo",
-                                                    style={'height':'35px', 
-                                                           'width':'auto', 
-                                                           'margin-top':'10px',
-                                                           'margin-bottom':'10px',
-                                                           'margin-left':'10px'})]),width=3,lg=3), 
-
-        # Title
-                dbc.Col(html.H1(children='Amazon Recommendation Engine',
-                                style={'textAlign': 'center',
-                                       'font-family':'Arial',
-                                       'fontSize':36,
-                                       'color': colors['gray_col']})),
+            html.Div([dbc.Row([
+            # CognoClick Logo
+                    dbc.Col(html.Div(children=[html.Img(src=app.get_asset_url("../assets/CognoClick_upscaled_logo.jpg"),
+                                                        id="cognoclick-logo",
+                                                        style={'height':'35px', 
+                                                               'width':'auto', 
+                                                               'margin-top':'10px',
+                                                               'margin-bottom':'10px',
+                                                               'margin-left':'10px'})]),width=3,lg=3), 
+
+            # Title
+                    dbc.Col(html.H1(children='Amazon Recommendation Engine',
+                                    style={'textAlign': 'center',
+                                           'font-family':'Arial',
+                                           'fontSize':36,
+                                           'color': colors['gray_col']})),
     
-        # Amazon Logo
-                dbc.Col(html.Div(children=[html.Img(src=app.get_asset_url("../assets/Amazon_Logo.png"),
-                                                    id="amazon-logo",
-                                                    style={'background':colors['white_col'],
-                                                           'height':'32px', 
-                                                           'width':'auto', 
-                                                           'margin-top':'10px',
-                                                           'margin-left':'20px',
-                                                           'margin-right':'10px',
-                                                           'margin-bottom':'10px'
-                                                           })]), width=3,lg=2)],align="center")]),
+            # Amazon Logo
+                    dbc.Col(html.Div(children=[html.Img(src=app.get_asset_url("../assets/Amazon_Logo.png"),
+                                                        id="amazon-logo",
+                                                        style={'background':colors['white_col'],
+                                                               'height':'32px', 
+                                                               'width':'auto', 
+                                                               'margin-top':'10px',
+                                                               'margin-left':'20px',
+                                                               'margin-right':'10px',
+                                                               'margin-bottom':'10px'
+                                                               })]), width=3,lg=2)],align="center")]),
     
 
-        # Top 10 Products Bar Chart
-        dcc.Graph(
-            id='top-10-graph',
-            figure={
-                'data': [go.Bar(y=top_10_products['title'],
-                                x=top_10_products['numberReviews'], 
-                                orientation='h',
-                                marker_color=colors['orange_col'],
-                                # adding custom hover info to bar plot
-                                # had to search high and low to discover that this formatting works properly
-                                # <br> is used to create new lines
-                                text=['<b>Number of Reviews: </b>'+'{}'.format(trunc(numberReviews))+ # need this to be integer format
-                                      '<br><b>Price: </b>'+'${:.2f}'.format(price_t)+
-                                      '<br><b>Category 2: </b>'+'{}'.format(category2_t)+
-                                      '<br><b>Category 3: </b>'+'{}'.format(category3_t)
-                                      for numberReviews, price_t, category2_t, category3_t in 
-                                               zip(list(top_10_products['numberReviews']),
-                                               list(top_10_products['price_t']), 
-                                               list(top_10_products['category2_t']),
-                                               list(top_10_products['category3_t']))],
-                                hoverinfo="text",
-                                hoverlabel_align = 'left'
-                                )],
-                'layout': {'title': 'Top 10 Products Overall',
-                           'plot_bgcolor': colors['white_col'],
-                           'paper_bgcolor': colors['white_col'],
-                           'font': {'color': colors['black_col']},
-                           # titles are long so need to add a hefty left margin
-                           'margin': {'l':500, 'pad':4}}}),
+            # Top 10 Products Bar Chart
+            dcc.Graph(
+                id='top-10-graph',
+                figure={
+                    'data': [go.Bar(y=top_10_products['title'],
+                                    x=top_10_products['numberReviews'], 
+                                    orientation='h',
+                                    marker_color=colors['orange_col'],
+                                    # adding custom hover info to bar plot
+                                    # had to search high and low to discover that this formatting works properly
+                                    # <br> is used to create new lines
+                                    text=['<b>Number of Reviews: </b>'+'{}'.format(trunc(numberReviews))+ # need this to be integer format
+                                          '<br><b>Price: </b>'+'${:.2f}'.format(price_t)+
+                                          '<br><b>Category 2: </b>'+'{}'.format(category2_t)+
+                                          '<br><b>Category 3: </b>'+'{}'.format(category3_t)
+                                          for numberReviews, price_t, category2_t, category3_t in 
+                                                   zip(list(top_10_products['numberReviews']),
+                                                   list(top_10_products['price_t']), 
+                                                   list(top_10_products['category2_t']),
+                                                   list(top_10_products['category3_t']))],
+                                    hoverinfo="text",
+                                    hoverlabel_align = 'left'
+                                    )],
+                    'layout': {'title': 'Top 10 Products Overall',
+                               'plot_bgcolor': colors['white_col'],
+                               'paper_bgcolor': colors['white_col'],
+                               'font': {'color': colors['black_col']},
+                               # titles are long so need to add a hefty left margin
+                               'margin': {'l':500, 'pad':4}}}),
                           
 
-        # Creating tabs to use to add in the recommendation components
-        html.Div([dcc.Tabs(id="tabs", 
-                           colors={'border': colors['black_col'],
-                                   'primary': colors['orange_col'],
-                                   'background': "cornsilk"},
-                           children=[
-        # Product Recommendation Tab
-                dcc.Tab(label='Product Recommendations', children=[
-                dash_table.DataTable(
-                        id='product-table',
-                        columns=[{"name": i, "id": i} for i in product_recs.columns],
-                        page_current=0,
-                        page_size=PAGE_SIZE,
-                        page_action='custom',
-                        filter_action='custom',
-                        filter_query='' ,
-                        style_table={'overflowX': 'scroll'},
-                        style_cell={'padding':'5px',
-                                    'font-family':'Arial',
-                                    'fontSize':11,
-                                    'textAlign': 'left',
-                                    'minWidth': '0px', 'maxWidth': '180px',
-                                    'whiteSpace': 'normal'},
-                        style_header={'backgroundColor': colors['d_blue_col'],
-                                      'color': colors['white_col'],
-                                      'fontSize':13,
-                                      'fontWeight': 'bold'},
-                        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': colors['lgray_col']}
-        ]),
-                # To add a new line, just add two spaces at the end of a sentence.
-                # Cheating to get rid of dark background color at the end of text by adding a pad.
-                dcc.Markdown('''
-                             ###### Directions
-                             Each column can be filtered based on user input.  
-                             For string columns, just enter a partial string such as "Nook."  
-                             Exception: For product columns, use quotes around filter, such as "328."  
-                             For numeric columns, filters such as "=5" or ">=200" are valid filters.  
-                             Use "Enter" to initiate and remove filters.  ''',
+            # Creating tabs to use to add in the recommendation components
+            html.Div([dcc.Tabs(id="tabs", 
+                               colors={'border': colors['black_col'],
+                                       'primary': colors['orange_col'],
+                                       'background': "cornsilk"},
+                               children=[
+            # Product Recommendation Tab
+                    dcc.Tab(label='Product Recommendations', children=[
+                    dash_table.DataTable(
+                            id='product-table',
+                            columns=[{"name": i, "id": i} for i in product_columns],
+                            page_current=0,
+                            page_size=PAGE_SIZE,
+                            page_action='custom',
+                            filter_action='custom',
+                            filter_query='' ,
+                            sort_action='custom',
+                            sort_mode='single',
+                            sort_by=[],
+                            style_table={'overflowX': 'scroll'},
+                            style_cell={'padding':'5px',
+                                        'font-family':'Arial',
+                                        'fontSize':11,
+                                        'textAlign': 'left',
+                                        'minWidth': '0px', 'maxWidth': '180px',
+                                        'whiteSpace': 'normal'},
+                            style_header={'backgroundColor': colors['d_blue_col'],
+                                          'color': colors['white_col'],
+                                          'fontSize':13,
+                                          'fontWeight': 'bold'},
+                            style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': colors['lgray_col']}
+            ]),
+                    # number of rows matching the current filter, filled in by the table callback
+                    html.Div(id='product-table-count',
                              style={'backgroundColor': colors['white_col'],
                                     'fontSize':11,
-                                    'padding':'10px'})]),
+                                    'padding':'5px 10px'}),
+                    # re-runs the table callback while it shows a partial result, off otherwise
+                    dcc.Interval(id='product-table-refresh', interval=PARTIAL_REFRESH_MS, disabled=True),
+                    # To add a new line, just add two spaces at the end of a sentence.
+                    # Cheating to get rid of dark background color at the end of text by adding a pad.
+                    dcc.Markdown('''
+                                 ###### Directions
+                                 Each column can be filtered based on user input.  
+                                 For string columns, just enter a partial string such as "Nook."  
+                                 Exception: For product columns, use quotes around filter, such as "328."  
+                                 For numeric columns, filters such as "=5" or ">=200" are valid filters.  
+                                 Use "Enter" to initiate and remove filters.  
+                                 Use the arrows in the column headers to sort the table.  ''',
+                                 style={'backgroundColor': colors['white_col'],
+                                        'fontSize':11,
+                                        'padding':'10px'})]),
     
-          # User Recommendation Tab
-                dcc.Tab(label='User Recommendations', children=[
-                dash_table.DataTable(
-                        id='user-table',
-                        columns=[{"name": i, "id": i} for i in user_recs.columns],
-                        page_current=0,
-                        page_size=PAGE_SIZE,
-                        page_action='custom',
-                        filter_action='custom',
-                        filter_query='' ,
-                        style_table={'overflowX': 'scroll'},
-                        style_cell={'padding':'5px',
-                                    'font-family':'Arial',
-                                    'fontSize':11,
-                                    'textAlign': 'left',
-                                    'minWidth': '0px', 'maxWidth': '180px',
-                                    'whiteSpace': 'normal'},
-                        style_header={'backgroundColor': colors['d_blue_col'],
-                                      'color': colors['white_col'],
-                                      'fontSize':13,
-                                      'fontWeight': 'bold'},
-                        style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': colors['lgray_col']}]),
-                # To add a new line, just add two spaces at the end of a sentence.
-                # Cheating to get rid of dark background color at the end of text by adding a pad.
-                dcc.Markdown('''
-                             ###### Directions
-                             Each column can be filtered based on user input.  
-                             For string columns, just enter a partial string such as "Nook."  
-                             Exception: For product columns, use quotes around filter, such as "328."  
-                             For numeric columns, filters such as "=5" or ">=200" are valid filters.  
-                             Use "Enter" to initiate and remove filters.  ''',
+              # User Recommendation Tab
+                    dcc.Tab(label='User Recommendations', children=[
+                    dash_table.DataTable(
+                            id='user-table',
+                            columns=[{"name": i, "id": i} for i in user_columns],
+                            page_current=0,
+                            page_size=PAGE_SIZE,
+                            page_action='custom',
+                            filter_action='custom',
+                            filter_query='' ,
+                            sort_action='custom',
+                            sort_mode='single',
+                            sort_by=[],
+                            style_table={'overflowX': 'scroll'},
+                            style_cell={'padding':'5px',
+                                        'font-family':'Arial',
+                                        'fontSize':11,
+                                        'textAlign': 'left',
+                                        'minWidth': '0px', 'maxWidth': '180px',
+                                        'whiteSpace': 'normal'},
+                            style_header={'backgroundColor': colors['d_blue_col'],
+                                          'color': colors['white_col'],
+                                          'fontSize':13,
+                                          'fontWeight': 'bold'},
+                            style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': colors['lgray_col']}]),
+                    # number of rows matching the current filter, filled in by the table callback
+                    html.Div(id='user-table-count',
                              style={'backgroundColor': colors['white_col'],
                                     'fontSize':11,
-                                    'padding':'10px'})]),
-        ])]), # ends tabs
+                                    'padding':'5px 10px'}),
+                    # re-runs the table callback while it shows a partial result, off otherwise
+                    dcc.Interval(id='user-table-refresh', interval=PARTIAL_REFRESH_MS, disabled=True),
+                    # To add a new line, just add two spaces at the end of a sentence.
+                    # Cheating to get rid of dark background color at the end of text by adding a pad.
+                    dcc.Markdown('''
+                                 ###### Directions
+                                 Each column can be filtered based on user input.  
+                                 For string columns, just enter a partial string such as "Nook."  
+                                 Exception: For product columns, use quotes around filter, such as "328."  
+                                 For numeric columns, filters such as "=5" or ">=200" are valid filters.  
+                                 Use "Enter" to initiate and remove filters.  
+                                 Use the arrows in the column headers to sort the table.  ''',
+                                 style={'backgroundColor': colors['white_col'],
+                                        'fontSize':11,
+                                        'padding':'10px'})]),
+            ])]), # ends tabs
                         
-        # Disclaimer at the bottom         
-        dcc.Markdown('''
-                     **Disclaimer**: This project was completed as part of the MSDS 498 Capstone Project course within the Northwestern University. This dashboard and data are completely simulated and not in any way connected to or a reﬂection of Amazon. Please do not duplicate or distribute outside of the context of this course.''',
-                     style={'backgroundColor': colors['white_col'],
-                                    'fontSize':8,
-                                    'padding':'10px'})
-    ])
+            # Disclaimer at the bottom         
+            dcc.Markdown('''
+                         **Disclaimer**: This project was completed as part of the MSDS 498 Capstone Project course within the Northwestern University. This dashboard and data are completely simulated and not in any way connected to or a reﬂection of Amazon. Please do not duplicate or distribute outside of the context of this course.''',
+                         style={'backgroundColor': colors['white_col'],
+                                        'fontSize':8,
+                                        'padding':'10px'})
+        ])
+
+
+app.layout = serve_layout
     
     
 # =============================================================================
 # 02.04.01| Dash Reactive Components | Product Table
 # =============================================================================
 @app.callback(
-    Output('product-table', "data"),
+    [Output('product-table', "data"),
+     Output('product-table', "page_count"),
+     Output('product-table-count', "children"),
+     Output('product-table-refresh', "disabled")],
     [Input('product-table', "page_current"),
      Input('product-table', "page_size"),
-     Input('product-table', "filter_query")])
+     Input('product-table', "filter_query"),
+     Input('product-table', "sort_by"),
+     Input('product-table-refresh', "n_intervals")])
 
 # tried to move this to config file and call function but dash doesn't like that
-def update_table(page_current,page_size, filter):
-    print(filter)
-    filtering_expressions = filter.split(' && ')
-    dff = product_recs
-    for filter_part in filtering_expressions:
-        col_name, operator, filter_value = split_filter_part(filter_part)
-
-        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
-            # these operators match pandas series operator method names
-            dff = dff.loc[getattr(dff[col_name], operator)(filter_value)]
-        elif operator == 'contains':
-            dff = dff.loc[dff[col_name].str.contains(filter_value)]
-        elif operator == 'datestartswith':
-            # this is a simplification of the front-end filtering logic,
-            # only works with complete fields in standard format
-            dff = dff.loc[dff[col_name].str.startswith(filter_value)]
-
-    return dff.iloc[
-        page_current*page_size:(page_current+ 1)*page_size
-    ].to_dict('records')
+def update_table(page_current,page_size, filter, sort_by, n_intervals=None):
+    # each phase is timed, the response encoding is timed by the JSON encoder (see callback_metrics.py)
+    with callback_timer('product', filter) as timer:
+        # one version for the whole request, a reload in between does not mix versions
+        dataset = data.current()
+        with timer.phase('load'):
+            product_recs, product_key_indexes = dataset['product'].get()
+
+        # the query is parsed once (cached on the query string), the filter evaluation gets the clauses
+        with timer.phase('parse'):
+            clauses = parse_filter_query(filter)
+
+        # the whole query is evaluated as one mask, only the rows of the current page are taken
+        # the matching positions are cached so changing page does not filter again
+        # sorting walks the precomputed sort order of the column instead of sorting the matches
+        # the evaluation runs on the filter pool, a newer filter from the same browser drops this request;
+        # until it is done the page comes from a block scan that stops once the page (and one more row) is found
+        with timer.phase('filter'):
+            positions, matches, complete = evaluate_filter(dataset.cache_name('product'), product_recs, product_key_indexes, clauses, sort_by,
+                                                           (page_current + 1) * page_size + 1)
+
+        # the number of matches comes with the positions (the full count once the evaluation finished),
+        # nothing is filtered again to count them
+        timer.matched(matches, len(product_recs))
+
+        # the page is built from the column arrays, no data frame or per-cell to_dict
+        with timer.phase('slice'):
+            page = page_payload(dataset.cache_name('product'), product_recs,
+                positions[page_current*page_size:(page_current+ 1)*page_size]
+            )
+
+    if not complete:
+        count = 'At least {:,} matching recommendations, still counting...'.format(matches)
+        return page, max(page_current + 1, ceil(matches / page_size)), count, False
+    return page, max(1, ceil(matches / page_size)), '{:,} matching recommendations'.format(matches), True
     
 
 # =============================================================================
 # 02.04.02| Dash Reactive Components | User Table
 # =============================================================================
 @app.callback(
-    Output('user-table', "data"),
+    [Output('user-table', "data"),
+     Output('user-table', "page_count"),
+     Output('user-table-count', "children"),
+     Output('user-table-refresh', "disabled")],
     [Input('user-table', "page_current"),
      Input('user-table', "page_size"),
-     Input('user-table', "filter_query")])
-
-def update_table2(page_current,page_size, filter):
-    print(filter)
-    filtering_expressions = filter.split(' && ')
-    dff = user_recs
-    for filter_part in filtering_expressions:
-        col_name, operator, filter_value = split_filter_part(filter_part)
-
-        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
-            # these operators match pandas series operator method names
-            dff = dff.loc[getattr(dff[col_name], operator)(filter_value)]
-        elif operator == 'contains':
-            dff = dff.loc[dff[col_name].str.contains(filter_value)]
-        elif operator == 'datestartswith':
-            # this is a simplification of the front-end filtering logic,
-            # only works with complete fields in standard format
-            dff = dff.loc[dff[col_name].str.startswith(filter_value)]
-
-    return dff.iloc[
-        page_current*page_size:(page_current+ 1)*page_size
-    ].to_dict('records')
+     Input('user-table', "filter_query"),
+     Input('user-table', "sort_by"),
+     Input('user-table-refresh', "n_intervals")])
+
+def update_table2(page_current,page_size, filter, sort_by, n_intervals=None):
+    # each phase is timed, the response encoding is timed by the JSON encoder (see callback_metrics.py)
+    with callback_timer('user', filter) as timer:
+        # one version for the whole request, a reload in between does not mix versions
+        dataset = data.current()
+        with timer.phase('load'):
+            user_recs, user_key_indexes = dataset['user'].get()
+
+        # the query is parsed once (cached on the query string), the filter evaluation gets the clauses
+        with timer.phase('parse'):
+            clauses = parse_filter_query(filter)
+
+        # the whole query is evaluated as one mask, only the rows of the current page are taken
+        # the matching positions are cached so changing page does not filter again
+        # sorting walks the precomputed sort order of the column instead of sorting the matches
+        # the evaluation runs on the filter pool, a newer filter from the same browser drops this request;
+        # until it is done the page comes from a block scan that stops once the page (and one more row) is found
+        with timer.phase('filter'):
+            positions, matches, complete = evaluate_filter(dataset.cache_name('user'), user_recs, user_key_indexes, clauses, sort_by,
+                                                           (page_current + 1) * page_size + 1)
+
+        # the number of matches comes with the positions (the full count once the evaluation finished),
+        # nothing is filtered again to count them
+        timer.matched(matches, len(user_recs))
+
+        # the page is built from the column arrays, no data frame or per-cell to_dict
+        with timer.phase('slice'):
+            page = page_payload(dataset.cache_name('user'), user_recs,
+                positions[page_current*page_size:(page_current+ 1)*page_size]
+            )
+
+    if not complete:
+        count = 'At least {:,} matching recommendations, still counting...'.format(matches)
+        return page, max(page_current + 1, ceil(matches / page_size)), count, False
+    return page, max(1, ceil(matches / page_size)), '{:,} matching recommendations'.format(matches), True
     
     
 # =============================================================================
@@ -0,0 +1,113 @@
+# ===============================================================================
+# 12.00.01 | ETL Benchmark | Documentation
+# ===============================================================================
+# Name:               12_benchmark_etl
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Runs the stages of data/data_configuration_oto.py one by one on synthetic inputs
+#                     and reports the time and peak memory of each stage.
+#
+# Notes:              Generate the inputs first (benchmarks/synthetic_data.py), then:
+#                        python benchmarks/benchmark_etl.py --root /tmp/bench --workers 4
+#                     The stages call the same recommendation_etl functions as the full ETL run,
+#                     so the outputs under ROOT/data can be used by benchmarks/benchmark_filters.py.
+#                     The stores are written and published as a new data version, like the ETL script does.
+#                     --chunk-rows, --workers and --top-k override ETL_CHUNK_ROWS, ETL_WORKERS and
+#                     RECOMMENDATIONS_PER_KEY for the run.
+#
+# Warnings:           Overwrites the ETL outputs under ROOT/data.
+#
+# Outline:            Import packages.
+#                     Run and time the ETL stages.
+#                     Print the report.
+#
+#
+# =============================================================================
+# 12.00.02 | Import Packages
+# =============================================================================
+import argparse
+import gc
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmark_report import StageTimer, peak_memory_mb, print_table
+
+
+# =============================================================================
+# 12.01.01 | ETL Stages
+# =============================================================================
+def run_etl(chunk_rows=None, workers=None, top_k=None):
+    # the configuration reads the working directory when it is imported, so these come after the chdir
+    from environment_configuration import working_directory, data_path, dash_data_path
+    from environment_configuration import products_path, product_recs_orig_path, user_recs_orig_path
+    from environment_configuration import top_10_products_path
+    from environment_configuration import product_recs_store_path, user_recs_store_path, top_10_products_store_path
+    from environment_configuration import text_index_columns, sort_index_columns, bitmap_index_columns
+    from environment_configuration import ETL_CHUNK_ROWS, ETL_WORKERS, RECOMMENDATIONS_PER_KEY
+    from environment_configuration import DATA_VERSIONS_KEPT
+    from data_store import write_columnar
+    from data_versions import new_version_id, version_directory, publish_version, prune_versions
+    from recommendation_etl import select_product_columns, MetadataLookup, create_top_10_products
+    from recommendation_etl import stream_all_recommendations
+
+    chunk_rows = chunk_rows or ETL_CHUNK_ROWS
+    workers = workers or ETL_WORKERS
+    top_k = top_k if top_k is not None else RECOMMENDATIONS_PER_KEY
+
+    data_directory = Path(working_directory + dash_data_path)
+    version = new_version_id()
+    version_path = str(version_directory(data_directory, version))
+
+    timer = StageTimer()
+    with timer.stage('load input pickles'):
+        product_data = pd.read_pickle(Path(working_directory + data_path + products_path))
+        product_recs = pd.read_pickle(Path(working_directory + data_path + product_recs_orig_path))
+        user_recs = pd.read_pickle(Path(working_directory + data_path + user_recs_orig_path))
+    rows = {'product predictions': len(product_recs), 'user predictions': len(user_recs)}
+
+    with timer.stage('select columns and metadata lookup'):
+        product_data_sub = select_product_columns(product_data)
+        metadata = MetadataLookup(product_data_sub)
+
+    with timer.stage('enrich, rank and write store ({} workers)'.format(workers)):
+        stream_all_recommendations(product_recs, user_recs, metadata,
+                                   Path(version_path + product_recs_store_path),
+                                   Path(version_path + user_recs_store_path),
+                                   chunk_rows, workers, text_index_columns, top_k,
+                                   sort_index_columns, bitmap_index_columns)
+    del product_recs, user_recs
+    gc.collect()
+
+    with timer.stage('top 10 products'):
+        top_10_products = create_top_10_products(product_data_sub)
+        top_10_products.to_pickle(Path(working_directory + dash_data_path + top_10_products_path))
+        write_columnar(top_10_products, Path(version_path + top_10_products_store_path))
+
+    with timer.stage('publish version'):
+        publish_version(data_directory, version)
+        prune_versions(data_directory, DATA_VERSIONS_KEPT)
+
+    return timer.stages, rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the ETL stages on the inputs under ROOT/data/input_data.')
+    parser.add_argument('--root', required=True, help='directory holding the synthetic inputs')
+    parser.add_argument('--chunk-rows', type=int, help='prediction rows per chunk (default ETL_CHUNK_ROWS)')
+    parser.add_argument('--workers', type=int, help='ranking processes (default ETL_WORKERS)')
+    parser.add_argument('--top-k', type=int, help='recommendations kept per key (default RECOMMENDATIONS_PER_KEY)')
+    args = parser.parse_args()
+
+    os.chdir(args.root)
+    start = time.perf_counter()
+    stages, rows = run_etl(args.chunk_rows, args.workers, args.top_k)
+    seconds = time.perf_counter() - start
+
+    print_table('ETL stages', stages)
+    total_rows = sum(rows.values())
+    self_mb, children_mb = peak_memory_mb()
+    print_table('ETL total', [dict(rows, seconds=seconds, rows_per_second=total_rows / seconds,
+                                   peak_mb=self_mb, peak_child_mb=children_mb)])
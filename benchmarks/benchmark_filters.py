@@ -0,0 +1,162 @@
+# ===============================================================================
+# 13.00.01 | Filter Benchmark | Documentation
+# ===============================================================================
+# Name:               13_benchmark_filters
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Replays a mix of realistic filter_query strings against the update_table and
+#                     update_table2 callbacks of app.py and reports throughput, latency percentiles
+#                     and peak memory.
+#
+# Notes:              Needs the ETL outputs under --root (benchmarks/benchmark_etl.py), then:
+#                        python benchmarks/benchmark_filters.py --root /tmp/bench --requests 2000
+#                     The callbacks are called directly (no HTTP) and their output is JSON encoded the way Dash
+#                     encodes a response, so the latency covers filter, slice and serialise.
+#                     The mix follows what analysts do: look up an id, search titles, filter categories and
+#                     ratings, triage by number of reviews, sort, and page through a result.
+#                     --cold clears the filter result cache before every request to measure uncached filters.
+#
+# Warnings:           Changes the working directory to --root before app.py is imported.
+#
+# Outline:            Import packages.
+#                     Build the query mix from the loaded tables.
+#                     Replay the requests and time them.
+#                     Print the report.
+#
+#
+# =============================================================================
+# 13.00.02 | Import Packages
+# =============================================================================
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmark_report import latency_summary, peak_memory_mb, print_table
+
+# clause templates per query type, filled from values sampled out of the tables
+query_templates = {'unfiltered': [],
+                   'id lookup': ['{{{id}}} = "{id_value}"'],
+                   'title contains': ['{{Recommended Product}} contains "{word}"'],
+                   'category': ['{{Product Category 3}} = "{category3}"'],
+                   'category and rating': ['{{Product Category 2}} = "{category2}"', '{{Average Rating}} >= {rating}'],
+                   'reviews triage': ['{{Number of Reviews}} >= {reviews}'],
+                   'price range': ['{{Price}} >= {price_low}', '{{Price}} < {price_high}'],
+                   'id and rank': ['{{{id}}} = "{id_value}"', '{{Rank Order}} <= 5']}
+
+sort_columns = ['Price', 'Average Rating', 'Number of Reviews', 'Recommended Product']
+
+
+# =============================================================================
+# 13.01.01 | Query Mix
+# =============================================================================
+# one random value of a table column (a random row, so frequent values come up more often)
+def _sample(table, col_name, rng):
+    values = table.column(col_name)
+    value = values[int(rng.integers(0, len(table)))]
+    return value
+
+
+def _sample_word(table, rng):
+    title = _sample(table, 'Recommended Product', rng)
+    words = [word for word in str(title).split() if len(word) >= 3 and not word.isdigit()]
+    return words[int(rng.integers(0, len(words)))] if words else str(title)[:3]
+
+
+# a list of (query type, callback name, page_current, filter_query, sort_by)
+# a quarter of the requests page through the result of the request before them
+def query_mix(tables, id_columns, requests, rng):
+    mix = []
+    types = list(query_templates)
+    for _ in range(requests):
+        if mix and rng.random() < 0.25:
+            query_type, callback, page, query, sort_by = mix[-1]
+            mix.append(('page ' + query_type.replace('page ', ''), callback, page + 1, query, sort_by))
+            continue
+
+        callback = list(tables)[int(rng.integers(0, len(tables)))]
+        table = tables[callback]
+        query_type = types[int(rng.integers(0, len(types)))]
+        values = {'id': id_columns[callback],
+                  'id_value': _sample(table, id_columns[callback], rng),
+                  'word': _sample_word(table, rng),
+                  'category2': _sample(table, 'Product Category 2', rng),
+                  'category3': _sample(table, 'Product Category 3', rng),
+                  'rating': float(rng.choice([3, 3.5, 4, 4.5])),
+                  'reviews': int(rng.choice([50, 200, 1000])),
+                  'price_low': int(rng.choice([5, 10, 20])),
+                  'price_high': int(rng.choice([30, 50, 100]))}
+        query = ' && '.join(template.format(**values) for template in query_templates[query_type])
+
+        sort_by = []
+        if rng.random() < 0.2:
+            sort_by = [{'column_id': sort_columns[int(rng.integers(0, len(sort_columns)))],
+                        'direction': 'asc' if rng.random() < 0.5 else 'desc'}]
+            query_type += ' sorted'
+        mix.append((query_type, callback, 0, query, sort_by))
+    return mix
+
+
+# =============================================================================
+# 13.02.01 | Replay
+# =============================================================================
+def replay(requests, page_size, cold, seed):
+    # app.py reads the working directory through environment_configuration when it is imported
+    import app
+    from json_payload import encode_response
+    from filter_engine import result_cache, result_counts
+
+    load_start = time.perf_counter()
+    dataset = app.data.current()
+    tables = {'product': dataset['product'].get()[0], 'user': dataset['user'].get()[0]}
+    load_seconds = time.perf_counter() - load_start
+
+    # the functions the dash callbacks wrap, called without a request context
+    callbacks = {'product': getattr(app.update_table, '__wrapped__', app.update_table),
+                 'user': getattr(app.update_table2, '__wrapped__', app.update_table2)}
+    id_columns = {'product': 'Original Product Id', 'user': 'Reviewer Id'}
+
+    mix = query_mix(tables, id_columns, requests, np.random.default_rng(seed))
+    results = []
+    start = time.perf_counter()
+    for query_type, callback, page, query, sort_by in mix:
+        if cold:
+            result_cache.clear()
+            result_counts.clear()
+        request_start = time.perf_counter()
+        output = callbacks[callback](page, page_size, query, sort_by)
+        # encoded by the response encoder app.py installed, like Dash does
+        payload = encode_response({'response': output})
+        results.append((query_type, callback, (time.perf_counter() - request_start) * 1000, len(payload)))
+    seconds = time.perf_counter() - start
+    return results, seconds, load_seconds, {name: len(table) for name, table in tables.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay filter queries against the table callbacks.')
+    parser.add_argument('--root', required=True, help='directory holding the ETL outputs (ROOT/data)')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--cold', action='store_true', help='clear the filter result cache before each request')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(args.root)
+    results, seconds, load_seconds, rows = replay(args.requests, args.page_size, args.cold, args.seed)
+
+    by_type = {}
+    for query_type, callback, ms, payload_bytes in results:
+        by_type.setdefault((callback, query_type), []).append(ms)
+    print_table('Latency by query type', [dict({'table': callback, 'query type': query_type},
+                                               **latency_summary(latencies))
+                                          for (callback, query_type), latencies in sorted(by_type.items())])
+
+    self_mb, _ = peak_memory_mb()
+    print_table('Overall', [dict({'rows ' + name: count for name, count in rows.items()},
+                                 load_s=load_seconds, requests=len(results),
+                                 requests_per_second=len(results) / seconds,
+                                 mean_payload_bytes=float(np.mean([result[3] for result in results])),
+                                 peak_mb=self_mb,
+                                 **{key: value for key, value in latency_summary([result[2] for result in results]).items()
+                                    if key != 'count'})])
@@ -0,0 +1,112 @@
+# ===============================================================================
+# 10.00.01 | Benchmark Report | Documentation
+# ===============================================================================
+# Name:               10_benchmark_report
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Shared helpers of the benchmark scripts: stage timers, latency percentiles,
+#                     peak memory and the printed report.
+#
+# Notes:              Peak memory is the maximum resident set size reported by the OS,
+#                     for this process and (separately) for the largest finished child process (ETL pool workers).
+#
+# Warnings:           ru_maxrss only ever grows, so a stage's peak includes every stage before it.
+#                     The resource module does not exist on Windows, peak memory is reported as None there.
+#
+# Outline:            Import packages.
+#                     Make the repository modules importable.
+#                     Measure peak memory.
+#                     Summarize latencies.
+#                     Print report tables.
+#
+#
+# =============================================================================
+# 10.00.02 | Import Packages
+# =============================================================================
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# =============================================================================
+# 10.01.01 | Repository Path
+# =============================================================================
+# the benchmarks import the app modules from the repository root
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+
+# =============================================================================
+# 10.02.01 | Peak Memory
+# =============================================================================
+# peak resident memory in MB of this process and of its largest finished child, None without resource
+def peak_memory_mb():
+    if resource is None:
+        return None, None
+    # linux reports kB, macOS bytes
+    unit = 1024 if sys.platform != 'darwin' else 1024 ** 2
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+# =============================================================================
+# 10.03.01 | Latency Summary
+# =============================================================================
+def latency_summary(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms, dtype=np.float64)
+    if len(latencies_ms) == 0:
+        return {'count': 0}
+    return {'count': len(latencies_ms),
+            'mean_ms': latencies_ms.mean(),
+            'p50_ms': np.percentile(latencies_ms, 50),
+            'p90_ms': np.percentile(latencies_ms, 90),
+            'p99_ms': np.percentile(latencies_ms, 99),
+            'max_ms': latencies_ms.max()}
+
+
+# times named stages and records the peak memory after each one
+class StageTimer:
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self_mb, children_mb = peak_memory_mb()
+        self.stages.append({'stage': name, 'seconds': seconds,
+                            'peak_mb': self_mb, 'peak_child_mb': children_mb})
+        print('{:<40} {:>10.2f}s'.format(name, seconds))
+
+
+# =============================================================================
+# 10.04.01 | Report Tables
+# =============================================================================
+def _cell(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return '' if value is None else str(value)
+
+
+# prints a list of dicts as an aligned table, columns in the order of the first row
+def print_table(title, rows):
+    print('\n' + title)
+    if not rows:
+        print('(no rows)')
+        return
+    columns = list(rows[0])
+    cells = [[_cell(row.get(col_name)) for col_name in columns] for row in rows]
+    widths = [max(len(col_name), *(len(row[i]) for row in cells)) for i, col_name in enumerate(columns)]
+    print('  '.join(col_name.rjust(width) for col_name, width in zip(columns, widths)))
+    for row in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
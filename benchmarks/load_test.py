@@ -0,0 +1,321 @@
+# ===============================================================================
+# 14.00.01 | Load Test | Documentation
+# ===============================================================================
+# Name:               14_load_test
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Simulates many dashboard users paging, filtering and sorting at the same time by posting
+#                     table callback requests to _dash-update-component, and reports requests per second,
+#                     latency percentiles and error rates for each gunicorn worker configuration.
+#
+# Notes:              Runs against a server on this machine only. Either point it at a running server:
+#                        python benchmarks/load_test.py --url http://127.0.0.1:8050 --sessions 50
+#                     or let it launch "gunicorn app:server" once per worker count on data under --root:
+#                        python benchmarks/load_test.py --root /tmp/bench --workers 1,2,4 --sessions 50
+#                     Each session is one simulated analyst with its own keep-alive connection: it opens the
+#                     product table, filters with values seen in the rows it got back, pages, sorts and sometimes
+#                     switches to the user table, waiting a random think time between requests.
+#                     --recording replays recorded requests instead, a JSON lines file of
+#                        {"table": "product", "page_current": 0, "page_size": 10, "filter_query": "", "sort_by": []}
+#                     each session starts at a different line.
+#                     The HTTP client is a small asyncio one (standard library only), so thousands of sessions
+#                     run on one thread without extra packages.
+#
+# Warnings:           The client only speaks plain HTTP/1.1, point it at gunicorn directly and not through TLS.
+#                     The launched servers use port --port, it must be free.
+#
+# Outline:            Import packages.
+#                     Define the asyncio HTTP client.
+#                     Define the dash callback requests.
+#                     Define the simulated sessions (synthetic and recorded).
+#                     Run the load against a server, launching gunicorn per worker count.
+#                     Print the report.
+#
+#
+# =============================================================================
+# 14.00.02 | Import Packages
+# =============================================================================
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from benchmark_report import repo_root, latency_summary, print_table
+
+
+# =============================================================================
+# 14.01.01 | HTTP Client
+# =============================================================================
+# one keep-alive HTTP/1.1 connection, reconnects when the server closes it
+class HttpConnection:
+
+    def __init__(self, host, port, timeout, cookie=None):
+        self.host = host
+        # sent with every request, like the client id cookie a browser gets with the page
+        self.cookie = cookie
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, body=b''):
+        try:
+            return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+        except BaseException:
+            # a half read response leaves the connection unusable
+            await self.close()
+            raise
+
+    async def _request(self, method, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = ('{} {} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/json\r\n'
+                'Content-Length: {}\r\n').format(method, path, self.host, self.port, len(body))
+        if self.cookie:
+            head += 'Cookie: {}\r\n'.format(self.cookie)
+        head += '\r\n'
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            payload = b''.join(chunks)
+        elif 'content-length' in headers:
+            payload = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            payload = await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, payload
+
+
+# =============================================================================
+# 14.02.01 | Dash Callback Requests
+# =============================================================================
+# component ids of each table and the outputs its callback fills
+tables = {'product': 'product-table', 'user': 'user-table'}
+
+
+# request body of one table callback, in the format the dash renderer posts to _dash-update-component
+# (output is the dash 1.x multi output key, outputs and changedPropIds are read by newer dash versions)
+def callback_body(table, page_current, page_size, filter_query, sort_by):
+    table_id = tables[table]
+    outputs = [{'id': table_id, 'property': 'data'},
+               {'id': table_id, 'property': 'page_count'},
+               {'id': table_id + '-count', 'property': 'children'},
+               {'id': table_id + '-refresh', 'property': 'disabled'}]
+    return {'output': '..' + '...'.join('{}.{}'.format(o['id'], o['property']) for o in outputs) + '..',
+            'outputs': outputs,
+            'inputs': [{'id': table_id, 'property': 'page_current', 'value': page_current},
+                       {'id': table_id, 'property': 'page_size', 'value': page_size},
+                       {'id': table_id, 'property': 'filter_query', 'value': filter_query},
+                       {'id': table_id, 'property': 'sort_by', 'value': sort_by},
+                       {'id': table_id + '-refresh', 'property': 'n_intervals', 'value': None}],
+            'changedPropIds': [table_id + '.filter_query'],
+            'state': []}
+
+
+# the table rows of a callback response (empty when the response has another shape)
+def response_rows(payload, table):
+    try:
+        return json.loads(payload)['response'][tables[table]]['data']
+    except (ValueError, KeyError, TypeError):
+        return []
+
+
+# =============================================================================
+# 14.03.01 | Sessions
+# =============================================================================
+# filters an analyst builds from a row they are looking at
+def _synthetic_filter(table, row, rng):
+    id_column = 'Original Product Id' if table == 'product' else 'Reviewer Id'
+    words = [word for word in str(row.get('Recommended Product', '')).split() if len(word) >= 3]
+    choices = ['{{{}}} = "{}"'.format(id_column, row.get(id_column)),
+               '{{Product Category 3}} = "{}"'.format(row.get('Product Category 3')),
+               '{{Product Category 2}} = "{}" && {{Average Rating}} >= {}'.format(
+                   row.get('Product Category 2'), rng.choice([3, 4, 4.5])),
+               '{{Number of Reviews}} >= {}'.format(rng.choice([50, 200, 1000])),
+               '{{Price}} >= {} && {{Price}} < {}'.format(rng.choice([5, 10]), rng.choice([30, 50]))]
+    if words:
+        choices.append('{{Recommended Product}} contains "{}"'.format(rng.choice(words)))
+    return rng.choice(choices)
+
+
+# endless sequence of (table, page_current, page_size, filter_query, sort_by) for one simulated analyst
+# the last response rows are passed back in so filters use values the analyst actually saw
+def synthetic_session(page_size, rng):
+    table = 'product'
+    rows = yield (table, 0, page_size, '', [])
+    while True:
+        if rng.random() < 0.1:
+            table = 'user' if table == 'product' else 'product'
+            rows = (yield (table, 0, page_size, '', [])) or rows
+        query = _synthetic_filter(table, rng.choice(rows), rng) if rows else ''
+        sort_by = []
+        new_rows = yield (table, 0, page_size, query, sort_by)
+        rows = new_rows or rows
+        for page in range(1, rng.randint(1, 4)):
+            yield (table, page, page_size, query, sort_by)
+        if rng.random() < 0.3:
+            sort_by = [{'column_id': rng.choice(['Price', 'Average Rating', 'Number of Reviews']),
+                        'direction': rng.choice(['asc', 'desc'])}]
+            yield (table, 0, page_size, query, sort_by)
+
+
+def recorded_session(recording, start):
+    i = start
+    while True:
+        step = recording[i % len(recording)]
+        yield (step.get('table', 'product'), step.get('page_current', 0), step.get('page_size', 10),
+               step.get('filter_query', ''), step.get('sort_by') or [])
+        i += 1
+
+
+# =============================================================================
+# 14.04.01 | Run Load
+# =============================================================================
+async def run_session(host, port, steps, deadline, think_ms, timeout, results, rng, session):
+    connection = HttpConnection(host, port, timeout, 'filter_client=load-test-{}'.format(session))
+    rows = None
+    try:
+        while time.perf_counter() < deadline:
+            table, page_current, page_size, query, sort_by = steps.send(rows) if rows is not None else next(steps)
+            body = json.dumps(callback_body(table, page_current, page_size, query, sort_by)).encode('utf-8')
+            start = time.perf_counter()
+            try:
+                status, payload = await connection.request('POST', '/_dash-update-component', body)
+                error = None if status == 200 else 'HTTP {}'.format(status)
+            except Exception as exception:
+                status, payload, error = None, b'', type(exception).__name__
+            results.append(((time.perf_counter() - start) * 1000, error))
+            rows = response_rows(payload, table) if error is None else []
+            if think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / think_ms))
+    finally:
+        await connection.close()
+
+
+async def run_load(url, sessions, duration, think_ms, timeout, recording, page_size, seed):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    deadline = time.perf_counter() + duration
+    results = []
+    tasks = []
+    for i in range(sessions):
+        rng = random.Random(seed + i)
+        steps = recorded_session(recording, i * 7) if recording else synthetic_session(page_size, rng)
+        tasks.append(run_session(host, port, steps, deadline, think_ms, timeout, results, rng, i))
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def summarize(label, results, seconds):
+    latencies = [ms for ms, error in results if error is None]
+    errors = {}
+    for _, error in results:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    summary = {'config': label, 'requests': len(results),
+               'requests_per_second': len(results) / seconds if seconds else None,
+               'error_rate': sum(errors.values()) / len(results) if results else None}
+    summary.update({key: value for key, value in latency_summary(latencies).items() if key != 'count'})
+    summary['errors'] = ', '.join('{} x{}'.format(name, count) for name, count in sorted(errors.items()))
+    return summary
+
+
+# starts gunicorn on the data under root and waits until the dash layout is served
+def launch_server(root, port, workers, threads):
+    environment = dict(os.environ, PYTHONPATH=str(repo_root) + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:server',
+                               '--config', str(repo_root / 'gunicorn.conf.py'),
+                               '--bind', '127.0.0.1:{}'.format(port),
+                               '--workers', str(workers), '--threads', str(threads)],
+                              cwd=root, env=environment)
+    ready_by = time.time() + 300
+    while time.time() < ready_by:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited with code {}'.format(server.returncode))
+        try:
+            status, _ = asyncio.run(HttpConnection('127.0.0.1', port, 5).request('GET', '/_dash-layout'))
+            if status == 200:
+                return server
+        except (OSError, asyncio.TimeoutError):
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('gunicorn did not come up on port {}'.format(port))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive concurrent simulated sessions against a local dash server.')
+    parser.add_argument('--url', help='running server to test, e.g. http://127.0.0.1:8050')
+    parser.add_argument('--root', help='data directory to launch gunicorn on (instead of --url)')
+    parser.add_argument('--workers', default='1,2,4', help='gunicorn worker counts to test with --root')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker with --root')
+    parser.add_argument('--port', type=int, default=8765, help='port of the launched servers')
+    parser.add_argument('--sessions', type=int, default=20, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load per configuration')
+    parser.add_argument('--think-ms', type=float, default=200, help='mean pause between requests of a session')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request counts as failed')
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--recording', help='JSON lines file of recorded table requests to replay')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    recording = None
+    if args.recording:
+        with open(args.recording) as recording_file:
+            recording = [json.loads(line) for line in recording_file if line.strip()]
+
+    summaries = []
+    if args.url:
+        results, seconds = asyncio.run(run_load(args.url, args.sessions, args.duration, args.think_ms,
+                                                args.timeout, recording, args.page_size, args.seed))
+        summaries.append(summarize(args.url, results, seconds))
+    elif args.root:
+        for workers in [int(count) for count in args.workers.split(',')]:
+            server = launch_server(args.root, args.port, workers, args.threads)
+            try:
+                results, seconds = asyncio.run(run_load('http://127.0.0.1:{}'.format(args.port), args.sessions,
+                                                        args.duration, args.think_ms, args.timeout, recording,
+                                                        args.page_size, args.seed))
+            finally:
+                server.terminate()
+                server.wait()
+            summaries.append(summarize('{} workers x {} threads'.format(workers, args.threads), results, seconds))
+    else:
+        parser.error('give --url or --root')
+
+    print_table('Load test ({} sessions, {:.0f}s each)'.format(args.sessions, args.duration), summaries)
@@ -0,0 +1,114 @@
+# ===============================================================================
+# 11.00.01 | Synthetic Data | Documentation
+# ===============================================================================
+# Name:               11_synthetic_data
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Generates synthetic product metadata and DNN prediction pickles
+#                     in the layout data/data_configuration_oto.py reads, at any scale.
+#
+# Notes:              Run from anywhere, the files are written under --root:
+#                        python benchmarks/synthetic_data.py --root /tmp/bench --rows 1000000
+#                     --rows is the number of prediction rows of each table (products and users),
+#                     every product and reviewer gets --per-key predictions, like the 20 of the real model.
+#                     Ids are repeated references to one string per product / reviewer, so even 1e8 rows
+#                     only cost a pointer per row (pickle stores each distinct string once).
+#                     The metadata has the columns the ETL selects, with a share of missing prices and
+#                     ratings, and titles built from a small vocabulary so contains filters find matches.
+#
+# Warnings:           The output directory's data/input_data is overwritten.
+#                     1e8 rows need roughly 10 GB of memory for the prediction frames.
+#
+# Outline:            Import packages.
+#                     Generate product metadata.
+#                     Generate product and user predictions.
+#                     Write the input pickles.
+#
+#
+# =============================================================================
+# 11.00.02 | Import Packages
+# =============================================================================
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# words product titles are made of, the first ones are the ones analysts search for
+title_words = ['Nook', 'Kindle', 'Fire', 'HD', 'Simple Touch', 'GlowLight', 'Case', 'Cover', 'Charger',
+               'Screen Protector', 'Stylus', 'Sleeve', 'Black', 'Red', 'Leather', 'Color', 'Tablet', 'eReader']
+category2_values = ['Electronics', 'Books', 'Kindle Store', 'Office Products', 'Cell Phones & Accessories']
+category3_values = ['eBook Readers & Accessories', 'Covers', 'Chargers', 'Screen Protectors', 'Cases',
+                    'Styluses', 'Skins', 'Power Adapters', 'Bundles', 'Lights']
+
+
+# =============================================================================
+# 11.01.01 | Product Metadata
+# =============================================================================
+def product_metadata(products, rng):
+    asins = np.array(['B{:09d}'.format(i) for i in range(products)], dtype=object)
+    words = rng.integers(0, len(title_words), (products, 4))
+    titles = [' '.join(title_words[w] for w in row) + ' {}'.format(i) for i, row in enumerate(words)]
+
+    prices = (rng.lognormal(3, 1, products)).round(2)
+    prices[rng.random(products) < 0.05] = np.nan
+    ratings = rng.integers(2, 11, products) / 2.
+    ratings[rng.random(products) < 0.02] = np.nan
+
+    return pd.DataFrame({'asin': asins,
+                         'title': titles,
+                         'category2_t': rng.choice(category2_values, products),
+                         'category3_t': rng.choice(category3_values, products),
+                         'price_t': prices,
+                         'numberReviews': rng.zipf(1.5, products).clip(1, 50000).astype(float),
+                         'meanStarRating': ratings,
+                         'imUrl': ['http://ecx.images-amazon.com/images/I/{}.jpg'.format(asin) for asin in asins]})
+
+
+# =============================================================================
+# 11.02.01 | Predictions
+# =============================================================================
+# per_key predictions for each key, rows shuffled like the model output
+def predictions(keys, key_column, asins, per_key, rng):
+    key_codes = np.repeat(np.arange(len(keys)), per_key)
+    recommended = rng.integers(0, len(asins), len(key_codes))
+    frame = pd.DataFrame({key_column + '_int': key_codes,
+                          key_column: keys[key_codes],
+                          'recommended_product_id_int': recommended,
+                          'recommended_product_id': asins[recommended],
+                          'predicted_rating': rng.random(len(key_codes)).round(4)})
+    return frame.take(rng.permutation(len(frame))).reset_index(drop=True)
+
+
+# =============================================================================
+# 11.03.01 | Write Input Pickles
+# =============================================================================
+def write_synthetic_inputs(root, rows, per_key=20, seed=1):
+    rng = np.random.default_rng(seed)
+    keys = max(1, rows // per_key)
+    input_directory = Path(root) / 'data' / 'input_data'
+    os.makedirs(input_directory, exist_ok=True)
+
+    metadata = product_metadata(keys, rng)
+    metadata.to_pickle(input_directory / 'product_metadata_dashboard.pkl')
+    asins = metadata['asin'].values
+
+    predictions(asins, 'original_product_id', asins, per_key, rng).to_pickle(
+        input_directory / 'dnn_autoencoder_20_predictions.pkl')
+
+    reviewers = np.array(['A{:013d}'.format(i) for i in range(keys)], dtype=object)
+    predictions(reviewers, 'original_reviewerID', asins, per_key, rng).to_pickle(
+        input_directory / 'dnn_user_prod_dense_20_predictions.pkl')
+    return input_directory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic ETL inputs under ROOT/data/input_data.')
+    parser.add_argument('--root', required=True, help='directory to use as the working directory of the ETL and app')
+    parser.add_argument('--rows', type=float, default=1e5, help='prediction rows per table (1e5 to 1e8)')
+    parser.add_argument('--per-key', type=int, default=20, help='predictions per product / reviewer')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print('Wrote', write_synthetic_inputs(args.root, int(args.rows), args.per_key, args.seed))
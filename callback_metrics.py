@@ -0,0 +1,298 @@
+# ===============================================================================
+# 09.00.01 | Callback Metrics | Documentation
+# ===============================================================================
+# Name:               09_callback_metrics
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Times the table callbacks phase by phase (load, parse, filter, slice, serialise)
+#                     and keeps the timings, the query selectivity and the payload size in histograms.
+#
+# Notes:              Replaces the print(filter) in the callbacks, which wrote to stdout on every request.
+#                     The histograms are served as JSON at METRICS_PATH on the Flask server (local requests only).
+#                     With METRICS_LOG_PATH set every request is also appended to that file as one JSON line,
+#                     written by a background thread so the callback never waits on the disk.
+#                     The serialise phase happens in Dash after the callback returns: the JSON encoder
+#                     is wrapped so it finishes the timing of the callback that ran just before it on the same thread.
+#                     The slowest requests are kept with their filter query, to find the filters behind p99.
+#                     Requests answered with PreventUpdate (replaced by a newer one) are counted as no_updates, not errors.
+#
+# Warnings:           Metrics are per process, each gunicorn worker reports only the requests it served.
+#                     Percentiles are read from the histogram buckets, so they are upper bounds of a bucket.
+#                     JSON lines still queued when a worker is killed are lost.
+#
+# Outline:            Import packages.
+#                     Define histogram.
+#                     Define JSON lines writer.
+#                     Define callback timer and the metrics registry.
+#                     Time the JSON encoding of the callback response.
+#                     Serve the metrics endpoint.
+#
+#
+# =============================================================================
+# 09.00.02 | Import Packages
+# =============================================================================
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import flask
+from dash.exceptions import PreventUpdate
+
+import json_payload
+
+from environment_configuration import METRICS_LOG_PATH, SLOW_QUERY_COUNT
+
+
+# =============================================================================
+# 09.01.01 | Histogram
+# =============================================================================
+# fixed bucket histogram, bucket i counts the values <= bounds[i] (and above the bound before it)
+# the last bucket takes everything above the last bound
+latency_bounds_ms = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+selectivity_bounds = [0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1]
+payload_bounds_bytes = [1024 * 4 ** i for i in range(10)]
+
+
+class Histogram:
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    # upper bound of the bucket holding the given quantile
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.maximum
+        return self.maximum
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99),
+                'max': self.maximum,
+                'buckets': [{'le': bound, 'count': count}
+                            for bound, count in zip(self.bounds + ['inf'], self.counts)]}
+
+
+# =============================================================================
+# 09.02.01 | JSON Lines Writer
+# =============================================================================
+# appends records to a file from a background thread
+# the thread is started by the first write in each process, threads do not survive gunicorn's fork
+class JsonLinesWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.queue = queue.Queue()
+                    threading.Thread(target=self._run, args=(self.queue,), daemon=True).start()
+                    self.pid = os.getpid()
+        self.queue.put(record)
+
+    def _run(self, records):
+        with open(self.path, 'a') as log_file:
+            while True:
+                log_file.write(json.dumps(records.get()) + '\n')
+                # flush once the queue is drained, not after every line
+                if records.empty():
+                    log_file.flush()
+
+
+# =============================================================================
+# 09.03.01 | Callback Timer
+# =============================================================================
+# all histograms of one process, keyed by callback name
+class CallbackMetrics:
+
+    def __init__(self, slow_query_count, log_path=None):
+        self.lock = threading.Lock()
+        self.callbacks = {}
+        self.slow_query_count = slow_query_count
+        # min heap of (total ms, sequence number, record), so the fastest of the slow requests is dropped first
+        self.slowest = []
+        self.sequence = 0
+        self.writer = JsonLinesWriter(log_path) if log_path else None
+
+    def _callback(self, name):
+        if name not in self.callbacks:
+            self.callbacks[name] = {'requests': 0, 'errors': 0, 'no_updates': 0, 'phases': {},
+                                    'selectivity': Histogram(selectivity_bounds),
+                                    'payload_bytes': Histogram(payload_bounds_bytes)}
+        return self.callbacks[name]
+
+    def record(self, record):
+        with self.lock:
+            callback = self._callback(record['callback'])
+            callback['requests'] += 1
+            callback['errors'] += record['error'] is not None
+            callback['no_updates'] += record['no_update']
+            for phase, ms in list(record['phases'].items()) + [('total', record['total_ms'])]:
+                callback['phases'].setdefault(phase, Histogram(latency_bounds_ms)).record(ms)
+            if record['selectivity'] is not None:
+                callback['selectivity'].record(record['selectivity'])
+            if record['payload_bytes'] is not None:
+                callback['payload_bytes'].record(record['payload_bytes'])
+
+            self.sequence += 1
+            entry = (record['total_ms'], self.sequence, record)
+            if len(self.slowest) < self.slow_query_count:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+        if self.writer is not None:
+            self.writer.write(record)
+
+    def snapshot(self):
+        with self.lock:
+            return {'pid': os.getpid(),
+                    'callbacks': {name: {'requests': callback['requests'],
+                                         'errors': callback['errors'],
+                                         'no_updates': callback['no_updates'],
+                                         'phases_ms': {phase: histogram.snapshot()
+                                                       for phase, histogram in callback['phases'].items()},
+                                         'selectivity': callback['selectivity'].snapshot(),
+                                         'payload_bytes': callback['payload_bytes'].snapshot()}
+                                  for name, callback in self.callbacks.items()},
+                    'slowest': [record for _, _, record in sorted(self.slowest, reverse=True)]}
+
+
+metrics = CallbackMetrics(SLOW_QUERY_COUNT, METRICS_LOG_PATH)
+
+# the timer of the callback whose response has not been encoded yet, per thread
+_pending = threading.local()
+
+# timings of one callback request
+class CallbackTimer:
+
+    def __init__(self, callback, query):
+        self.callback = callback
+        self.query = query
+        self.phases = {}
+        self.start = time.perf_counter()
+        self.selectivity = None
+        self.matches = None
+        self.error = None
+        # the callback raised PreventUpdate (a newer request replaced it), not an error
+        self.no_update = False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + (time.perf_counter() - start) * 1000
+
+    # share of the table rows the query matched
+    def matched(self, matches, rows):
+        self.matches = matches
+        self.selectivity = matches / rows if rows else None
+
+    def finish(self, payload_bytes=None):
+        metrics.record({'time': time.time(),
+                        'callback': self.callback,
+                        'query': self.query,
+                        'phases': {name: round(ms, 3) for name, ms in self.phases.items()},
+                        'total_ms': round((time.perf_counter() - self.start) * 1000, 3),
+                        'matches': self.matches,
+                        'selectivity': self.selectivity,
+                        'payload_bytes': payload_bytes,
+                        'error': self.error,
+                        'no_update': self.no_update})
+
+
+# times the body of a callback, the response encoding is added by the wrapped JSON encoder
+@contextmanager
+def callback_timer(callback, query):
+    timer = CallbackTimer(callback, query)
+    # a response that was never encoded (the callback before raised) is recorded without it
+    previous = getattr(_pending, 'timer', None)
+    if previous is not None:
+        _pending.timer = None
+        previous.finish()
+    try:
+        yield timer
+    except PreventUpdate:
+        # Dash answers it with no response body, nothing is encoded after it
+        timer.no_update = True
+        timer.finish()
+        raise
+    except Exception as error:
+        timer.error = type(error).__name__
+        timer.finish()
+        raise
+    # without a timed response encoder the timer is recorded when the callback returns
+    if getattr(json_payload.response_encoder, 'times_callbacks', False):
+        _pending.timer = timer
+    else:
+        timer.finish()
+
+
+# =============================================================================
+# 09.04.01 | Serialise Timing
+# =============================================================================
+# Dash encodes the callback response right after the callback returns, on the same thread;
+# a subclass of the response encoder (plotly's or the fast one) adds the encoding time
+# and the payload size to the pending callback timer, install it with json_payload.install_json_encoder
+def timed_json_encoder(encoder):
+
+    class TimedJSONEncoder(encoder):
+
+        # callback_timer leaves the timer pending for the encoder when this is the response encoder
+        times_callbacks = True
+
+        def encode(self, o):
+            timer = getattr(_pending, 'timer', None)
+            if timer is None:
+                return super().encode(o)
+            _pending.timer = None
+            with timer.phase('serialise'):
+                text = super().encode(o)
+            timer.finish(len(text.encode('utf-8')))
+            return text
+
+    return TimedJSONEncoder
+
+
+# =============================================================================
+# 09.05.01 | Metrics Endpoint
+# =============================================================================
+# serves the histograms of this process as JSON, only to requests from the machine itself
+def register_metrics_endpoint(server, path):
+
+    def metrics_endpoint():
+        if flask.request.remote_addr not in ('127.0.0.1', '::1'):
+            flask.abort(404)
+        return flask.jsonify(metrics.snapshot())
+
+    server.add_url_rule(path, 'callback_metrics', metrics_endpoint)
@@ -3,24 +3,38 @@
 # ===============================================================================
 # Name:               01_data_configuration
 # Author:             Rodd
-# Last Edited Date:   11/19/19
+# Last Edited Date:   10/18/26
 # Description:        Creates relevant pickles to feed into dash app.
 #  
 #                   
 # Notes:             Had to get pickles from Brian from capstone repo to run this file. 
-#                     
+#                    The transformation steps live in recommendation_etl.py.
+#                    Run with --incremental to only apply re-scored ids: the delta prediction pickles
+#                    (same columns as the full ones) are enriched and ranked, and their id groups are spliced
+#                    into the sorted existing output in place of the matching groups (no full re-sort).
+#                    A missing delta file leaves that table as is.
 #
-# Warnings:           
+#                    The columnar stores of each run go into a new version directory, running apps swap to it
+#                    once it is published. Tables the incremental run does not rebuild are hard linked from the previous version.
+#                    The incremental run patches the columnar stores of the published version, the recommendation
+#                    pickles are only read when the data directory has no stores yet (output of earlier ETL runs).
+#
+# Warnings:          A delta must contain every prediction of each id it re-scores, not only the changed rows.
+#                    The recommendation pickles are no longer written, they go stale after the first full run.
 #
 #
 # Outline:           Load packages.
 #                    Import data to prepare.
 #                    Select needed columns from the product data frame and truncate title to first 60 chars.
+#                    Dictionary encode (categorical) the repeated text columns.
 #                    Manipulate product recommendations data to create columns for dashboard.
 #                    Create rank order variable for product recommendations and reorder data.
-#                    Save recommendations via pickle.
 #                    Repeat steps above for user recommendations.
-#                    Create top 10 products data frame and pickle it.    
+#                    (the full run does both tables at once, in chunks on a process pool, writing each chunk to the columnar store)
+#                    Save recommendations as a memory-mappable columnar store.
+#                    Create top 10 products data frame and pickle it (and store it columnar).    
+#                    In incremental mode: patch the existing outputs instead, top 10 products is not rebuilt.
+#                    Publish the columnar stores as a new data version (data/versions/<version>/) for the app to pick up.
 #
 #
 # =============================================================================
@@ -37,6 +51,30 @@ import sys
 from environment_configuration import working_directory, data_path, dash_data_path
 from environment_configuration import products_path, top_10_products_path
 from environment_configuration import product_recs_orig_path, product_recs_path, user_recs_orig_path, user_recs_path
+from environment_configuration import product_recs_delta_path, user_recs_delta_path
+from environment_configuration import product_recs_store_path, user_recs_store_path, top_10_products_store_path
+from environment_configuration import text_index_columns, sort_index_columns, bitmap_index_columns, ETL_CHUNK_ROWS, ETL_WORKERS, RECOMMENDATIONS_PER_KEY
+from environment_configuration import DATA_VERSIONS_KEPT
+from data_store import write_columnar, load_table
+from data_versions import new_version_id, version_directory, read_current_version, unversioned
+from data_versions import publish_version, prune_versions, link_table
+from recommendation_etl import select_product_columns, create_top_10_products, patch_recommendations, MetadataLookup
+from recommendation_etl import enrich_product_recs, rank_product_recs, enrich_user_recs, rank_user_recs
+from recommendation_etl import stream_all_recommendations
+
+# full rebuild by default, --incremental only applies the delta predictions
+incremental = '--incremental' in sys.argv[1:]
+
+if incremental:
+    product_recs_input_path, user_recs_input_path = product_recs_delta_path, user_recs_delta_path
+else:
+    product_recs_input_path, user_recs_input_path = product_recs_orig_path, user_recs_orig_path
+
+# the columnar stores of this run are written into a new version, the app keeps serving the published one until the end
+data_directory = Path(working_directory + dash_data_path)
+version = new_version_id()
+version_path = str(version_directory(data_directory, version))
+previous_version_path = str(version_directory(data_directory, read_current_version(data_directory) or unversioned))
 
 # =============================================================================
 # 01.01.01| Import Data
@@ -48,18 +86,24 @@ with open(Path(working_directory + data_path + products_path), 'rb')  as pickle_
 
 gc.collect()
 
+# in incremental mode a table without a delta file is skipped
+run_products = Path(working_directory + data_path + product_recs_input_path).exists() or not incremental
+run_users = Path(working_directory + data_path + user_recs_input_path).exists() or not incremental
+
 # Load product recommendations
-with open(Path(working_directory + data_path + product_recs_orig_path), 'rb') as pickle_file:
-    product_recs = pickle.load(pickle_file)
-    product_recs = pd.DataFrame(product_recs)
+if run_products:
+    with open(Path(working_directory + data_path + product_recs_input_path), 'rb') as pickle_file:
+        product_recs = pickle.load(pickle_file)
+        product_recs = pd.DataFrame(product_recs)
 
 gc.collect()
 
 
 # Load user recommendations
-with open(Path(working_directory + data_path + user_recs_orig_path), 'rb') as pickle_file:
-    user_recs = pickle.load(pickle_file)
-    user_recs = pd.DataFrame(user_recs)
+if run_users:
+    with open(Path(working_directory + data_path + user_recs_input_path), 'rb') as pickle_file:
+        user_recs = pickle.load(pickle_file)
+        user_recs = pd.DataFrame(user_recs)
 
 gc.collect()
 
@@ -69,156 +113,113 @@ print('Script: 01.01.01 [Import Data] completed')
 # =============================================================================
 # 01.02.01| Select product columns
 # =============================================================================
-product_data_sub = product_data[['asin','title','category2_t','category3_t','price_t','numberReviews','meanStarRating','imUrl']]
-# universally only taking the first 60 characters for the title
-product_data_sub['title'] = product_data_sub['title'].str[:60]
+# also truncates the titles and dictionary encodes (categorical) the repeated text columns
+product_data_sub = select_product_columns(product_data)
+
+# asin -> metadata row, used instead of merging the metadata into the predictions
+metadata = MetadataLookup(product_data_sub)
 
 print('Script: 01.02.01 [Select product columns] completed')
 
 
 # =============================================================================
-# 01.03.01| Add relevant metadata to product predictions
+# 01.03.01| Add relevant metadata to predictions and rank them
 # =============================================================================
-# we have to do two joins to the product data because we have the original and recommended products and need metadata for both
-# recommended products
-product_recs_enhanced1 = pd.merge(product_recs, product_data_sub, how='left', left_on=['recommended_product_id'], right_on=['asin'])
-
-product_recs_enhanced1.rename(columns={'title':'Recommended Product',
-                                       'predicted_rating': 'Predicted Rating'}, inplace=True)
-
-# original products
-product_recs_enhanced2 = pd.merge(product_recs_enhanced1['original_product_id'], product_data_sub[['asin','title']], how='left', left_on=['original_product_id'], right_on=['asin'])
-
-product_recs_enhanced2.rename(columns={'title':'Original Product',
-                                       'asin': 'Original Product Id'}, inplace=True)
-    
-# need to take distinct so as not to duplicate the rows when we join back
-# the number of rows is equal to the number of recs per product
-product_recs_enhanced2.drop_duplicates(inplace=True)
-    
-# put it all together
-product_recs_enhanced = pd.merge(product_recs_enhanced1, product_recs_enhanced2, how='inner', left_on=['original_product_id'], right_on=['Original Product Id'])
-
-# verify no rows were lost
-if(product_recs_enhanced.shape[0]==product_recs.shape[0] is False):
-    sys.exit("Product recommendation data prep lost data")
+# rank 1 is first for each product / reviewer, predicted rating is dropped
+# RECOMMENDATIONS_PER_KEY cuts each product / reviewer to its top k recommendations
+if not incremental:
+    # full run: chunks of whole products / reviewers are enriched, ranked and written straight into the
+    # columnar store, so only a few chunks of intermediates exist at a time (the writer checks that no rows were lost)
+    # both tables are processed at the same time with the chunks spread over ETL_WORKERS processes
+    stream_all_recommendations(product_recs, user_recs, metadata,
+                               Path(version_path + product_recs_store_path),
+                               Path(version_path + user_recs_store_path),
+                               ETL_CHUNK_ROWS, ETL_WORKERS, text_index_columns, RECOMMENDATIONS_PER_KEY,
+                               sort_index_columns, bitmap_index_columns)
+    del product_recs, user_recs
+else:
+    if run_products:
+        product_recs_enhanced = rank_product_recs(enrich_product_recs(product_recs, metadata), RECOMMENDATIONS_PER_KEY)
+    if run_users:
+        user_recs_enhanced = rank_user_recs(enrich_user_recs(user_recs, metadata), RECOMMENDATIONS_PER_KEY)
 
-# remove unnecessary columns
-columns_to_remove = ['recommended_product_id_int','recommended_product_id',
-                     'original_product_id_int','original_product_id_x',
-                     'original_product_id_y','asin']
-product_recs_enhanced = product_recs_enhanced.drop(columns_to_remove, axis=1)
-
-# rename columns
-product_recs_enhanced.rename(columns={'category2_t':'Product Category 2',
-                                      'category3_t':'Product Category 3',
-                                      'price_t':'Price',
-                                      'imUrl':'Product URL',
-                                      'numberReviews':'Number of Reviews',
-                                      'meanStarRating':'Average Rating'}, inplace=True)
+gc.collect()
 
-print('Script: 01.03.01 [Add relevant metadata to product predictions] completed')
+print('Script: 01.03.01 [Add relevant metadata to predictions and rank them] completed')
 
 
 # =============================================================================
-# 01.03.02| Transform Rank Order Column
+# 01.03.02| Store Product Predictions
 # =============================================================================
-product_recs_enhanced["Rank Order"] = product_recs_enhanced.groupby('Original Product Id')["Predicted Rating"].rank("dense", ascending=False)
-
-# have to sort values so that rank 1 is first for each product
-product_recs_enhanced = product_recs_enhanced.sort_values(by=['Original Product Id','Rank Order'], ascending=True)
-
-product_recs_enhanced = product_recs_enhanced.drop('Predicted Rating', axis=1)
-
-# reorder columns
-product_recs_enhanced = product_recs_enhanced[['Original Product Id','Original Product',
-                                               'Rank Order','Recommended Product',
-                                               'Product Category 2','Product Category 3',
-                                               'Price','Number of Reviews',
-                                               'Average Rating','Product URL']]
-
-print('Script: 01.03.02 [Transform rank order column] completed')
-
+# the full run already wrote the columnar store in 01.03.01, nothing is read back
+if incremental and run_products:
+    # only the re-scored products were processed, their groups are spliced into the published table
+    # (memory-mapped, the pickle is only read when there is no columnar store yet)
+    # and the patched table is written chunk by chunk into the new version
+    # the sort indexes and the bitmap indexes of the category and rating columns are built here as well
+    product_recs_current = load_table(previous_version_path + product_recs_store_path,
+                                      Path(working_directory + dash_data_path + product_recs_path))
+    patch_recommendations(product_recs_current, product_recs_enhanced, 'Original Product Id',
+                          Path(version_path + product_recs_store_path), ETL_CHUNK_ROWS,
+                          text_index_columns, sort_index_columns, bitmap_index_columns)
+    product_recs_current = None
+elif incremental:
+    # no delta, the new version shares the current table (hard links, nothing is copied)
+    link_table(previous_version_path + product_recs_store_path, version_path + product_recs_store_path)
 
-# =============================================================================
-# 01.03.03| Pickle Product Predictions
-# =============================================================================
-product_recs_enhanced.to_pickle(Path(working_directory + dash_data_path + product_recs_path))
+product_recs_enhanced = None
+gc.collect()
 
-print('Script: 01.03.03 [Pickle Product Predictions] completed')
+print('Script: 01.03.02 [Store Product Predictions] completed')
 
 
 # =============================================================================
-# 01.04.01| Add relevant metadata to user predictions
+# 01.03.03| Store User Predictions
 # =============================================================================
-user_recs_enhanced = pd.merge(user_recs, product_data_sub, how='left', left_on=['recommended_product_id'], right_on=['asin'])
-
-# rename columns
-user_recs_enhanced.rename(columns={'original_reviewerID':'Reviewer Id',
-                                   'title':'Recommended Product',
-                                   'predicted_rating':'Predicted Rating',
-                                   'category2_t':'Product Category 2',
-                                   'category3_t':'Product Category 3',
-                                   'price_t':'Price',
-                                   'imUrl':'Product URL',
-                                   'numberReviews':'Number of Reviews',
-                                   'meanStarRating':'Average Rating'}, inplace=True)
+if incremental and run_users:
+    user_recs_current = load_table(previous_version_path + user_recs_store_path,
+                                   Path(working_directory + dash_data_path + user_recs_path))
+    patch_recommendations(user_recs_current, user_recs_enhanced, 'Reviewer Id',
+                          Path(version_path + user_recs_store_path), ETL_CHUNK_ROWS,
+                          text_index_columns, sort_index_columns, bitmap_index_columns)
+    user_recs_current = None
+elif incremental:
+    link_table(previous_version_path + user_recs_store_path, version_path + user_recs_store_path)
 
-# remove unnecessary columns
-columns_to_remove = ['original_reviewerID_int','recommended_product_id_int',
-                     'asin','recommended_product_id']
-user_recs_enhanced = user_recs_enhanced.drop(columns_to_remove, axis=1)
-
-# verify no rows were lost
-if(user_recs_enhanced.shape[0]==user_recs.shape[0] is False):
-    sys.exit("User recommendation data prep lost data")
+user_recs_enhanced = None
+gc.collect()
 
-print('Script: 01.04.01 [Add relevant metadata to user predictions] completed')
+print('Script: 01.03.03 [Store User Predictions] completed')
 
 
 # =============================================================================
-# 01.04.02| Transform Rank Order Column
+# 01.04.01| Create Top 10 Products Data Frame
 # =============================================================================
-# this code doesn't work here b/c the predictions are the same so it assigns a rating of 1 to everything
-# set method to "first" from "dense" and it works
-user_recs_enhanced["Rank Order"] = user_recs_enhanced.groupby('Reviewer Id')["Predicted Rating"].rank("first", ascending=False)
-
-# have to sort values so that rank 1 is first for each reviewer
-user_recs_enhanced = user_recs_enhanced.sort_values(by=['Reviewer Id','Rank Order'], ascending=True)
+# top 10 products only depends on the product metadata, so the incremental run keeps the current one
+if not incremental:
+    top_10_products = create_top_10_products(product_data_sub)
 
-user_recs_enhanced = user_recs_enhanced.drop('Predicted Rating', axis=1)
-
-# reorder columns
-user_recs_enhanced = user_recs_enhanced[['Reviewer Id',
-                                         'Rank Order','Recommended Product',
-                                         'Product Category 2','Product Category 3',
-                                         'Price','Number of Reviews',
-                                         'Average Rating','Product URL']]
-
-print('Script: 01.04.02 [Transform rank order column] completed')
+print('Script: 01.04.01 [Create Top 10 Products Data Frame] completed')
 
 
 # =============================================================================
-# 01.03.03| Pickle User Predictions
+# 01.04.02| Pickle Top 10 Products
 # =============================================================================
-user_recs_enhanced.to_pickle(Path(working_directory + dash_data_path + user_recs_path))
-
-print('Script: 01.04.03 [Pickle User Predictions] completed')
+if not incremental:
+    top_10_products.to_pickle(Path(working_directory + dash_data_path + top_10_products_path))
 
+    write_columnar(top_10_products, Path(version_path + top_10_products_store_path))
+else:
+    link_table(previous_version_path + top_10_products_store_path, version_path + top_10_products_store_path)
 
-# =============================================================================
-# 01.05.01| Create Top 10 Products Data Frame
-# =============================================================================
-# top 10 products
-top_10_products = product_data_sub.sort_values('numberReviews', ascending=False).head(10)[['title','numberReviews','price_t','category2_t','category3_t']]
-top_10_products = top_10_products.sort_values('numberReviews', ascending=True) 
-
-print('Script: 01.05.01 [Create Top 10 Products Data Frame] completed')
+print('Script: 01.04.02 [Pickle Top 10 Products] completed')
 
 
 # =============================================================================
-# 01.05.02| Pickle Top 10 Products
+# 01.05.01| Publish Data Version
 # =============================================================================
-top_10_products.to_pickle(Path(working_directory + dash_data_path + top_10_products_path))
+# the version is complete, point the app at it and drop the oldest versions
+publish_version(data_directory, version)
+prune_versions(data_directory, DATA_VERSIONS_KEPT)
 
-print('Script: 01.05.02 [Pickle Top 10 Products] completed')
\ No newline at end of file
+print('Script: 01.05.01 [Publish Data Version {}] completed'.format(version))
\ No newline at end of file
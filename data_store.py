@@ -0,0 +1,307 @@
+# ===============================================================================
+# 05.00.01 | Data Store | Documentation
+# ===============================================================================
+# Name:               05_data_store
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Writes the dashboard tables in a columnar on-disk format and
+#                     loads them back as memory-mapped columns.
+#
+# Notes:              Each table is a directory holding one .npy file per column and a schema.json.
+#                     Text columns are dictionary encoded: the codes are a .npy file and the
+#                     distinct values (the dictionary) are kept in a .json file next to it.
+#                     Loading memory-maps the .npy files read only, so every gunicorn worker
+#                     shares one physical copy of the data through the OS page cache.
+#                     Trigram indexes of text columns, sort indexes (precomputed row orders) and bitmap
+#                     indexes of low cardinality columns are built by the ETL and saved as .npy files too.
+#
+# Warnings:           Memory-mapped columns are read only, take a copy before changing them.
+#                     Directories written by an older version of the ETL must be rebuilt
+#                     when the schema version changes.
+#
+# Outline:            Import packages.
+#                     Define the columnar table.
+#                     Write a table to a columnar directory (whole or chunk by chunk).
+#                     Read a table from a columnar directory (falling back to the old pickles).
+#                     Read only the column names of a table from its schema.
+#                     Load a table lazily, once, on first use.
+#
+#
+# =============================================================================
+# 05.00.02 | Import Packages
+# =============================================================================
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from environment_configuration import BITMAP_MAX_VALUES
+from table_index import TrigramIndex, SortIndex, BitmapIndex
+from table_index import build_text_indexes, build_sort_indexes, build_bitmap_indexes
+
+schema_version = 1
+schema_file = 'schema.json'
+
+
+# =============================================================================
+# 05.01.01 | Columnar Table
+# =============================================================================
+# holds a table as one array per column instead of a data frame
+# pandas would copy memory-mapped columns into one block when building a frame,
+# so only the rows of a page are ever turned into a data frame
+class ColumnarTable:
+
+    def __init__(self, columns, arrays, text_indexes=None, sort_indexes=None, bitmap_indexes=None):
+        self.columns = list(columns)
+        self.arrays = dict(arrays)
+        # trigram indexes of text columns, sort indexes and bitmap indexes, keyed by column name
+        self.text_indexes = dict(text_indexes or {})
+        self.sort_indexes = dict(sort_indexes or {})
+        self.bitmap_indexes = dict(bitmap_indexes or {})
+        self.rows = len(self.arrays[self.columns[0]]) if self.columns else 0
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, col_name):
+        return col_name in self.arrays
+
+    # numpy array for numeric columns, pandas categorical for text columns
+    def column(self, col_name):
+        return self.arrays[col_name]
+
+    def __getitem__(self, col_name):
+        return pd.Series(self.arrays[col_name], name=col_name, copy=False)
+
+    # builds a data frame holding only the given row positions
+    def take(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        return pd.DataFrame({col_name: np.asarray(self.arrays[col_name][positions])
+                             if isinstance(self.arrays[col_name], np.ndarray)
+                             else self.arrays[col_name][positions]
+                             for col_name in self.columns},
+                            columns=self.columns)
+
+    # every row as a data frame, text columns stay categorical
+    def take_all(self):
+        return self.take(np.arange(self.rows))
+
+    # full copy as a regular data frame with plain object text columns, only meant for small tables
+    def to_frame(self):
+        return pd.DataFrame({col_name: np.asarray(self.arrays[col_name])
+                             for col_name in self.columns},
+                            columns=self.columns)
+
+    @classmethod
+    def from_frame(cls, frame):
+        arrays = {}
+        for col_name in frame.columns:
+            values = frame[col_name]
+            if is_text_column(values):
+                # categories no row refers to would only slow down filters on the dictionary
+                arrays[col_name] = pd.Categorical(values).remove_unused_categories()
+            else:
+                arrays[col_name] = values.values
+        return cls(frame.columns, arrays)
+
+
+def is_text_column(values):
+    return values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype) or values.dtype.kind in 'OSU'
+
+
+# =============================================================================
+# 05.02.01 | Write Columnar Table
+# =============================================================================
+# writes a table chunk by chunk straight into memory-mapped .npy files,
+# so the ETL never has to hold the finished table in memory
+# the template table fixes the columns, dtypes and dictionaries; every appended chunk must use them
+# text_indexes are trigram indexes already built over the same dictionaries (keyed by column), they are saved as they are
+# files go into a temporary directory first and are swapped in by close(),
+# so the app never sees a half written table
+class ColumnarWriter:
+
+    def __init__(self, directory, rows, template, text_index_columns=(), sort_index_columns=(),
+                 bitmap_index_columns=(), text_indexes=None):
+        self.directory = Path(directory)
+        self.staging = self.directory.with_name(self.directory.name + '.tmp')
+        if self.staging.exists():
+            shutil.rmtree(self.staging)
+        self.staging.mkdir(parents=True)
+
+        self.rows = rows
+        self.position = 0
+        self.columns = list(template.columns)
+        self.text_index_columns = [col_name for col_name in text_index_columns if col_name in self.columns]
+        self.sort_index_columns = [col_name for col_name in sort_index_columns if col_name in self.columns]
+        self.bitmap_index_columns = [col_name for col_name in bitmap_index_columns if col_name in self.columns]
+        self.text_indexes = dict(text_indexes or {})
+        self.files = {}
+        self.categories = {}
+        self.arrays = {}
+        for i, col_name in enumerate(self.columns):
+            values = template.column(col_name)
+            self.files[col_name] = 'col_{:02d}'.format(i)
+            if isinstance(values, pd.Categorical):
+                # codes keep the integer width pandas picks for the number of categories
+                # so loading them back needs no conversion (and no copy)
+                self.categories[col_name] = values.categories
+                dtype = values.codes.dtype
+            else:
+                dtype = values.dtype
+            self.arrays[col_name] = np.lib.format.open_memmap(
+                str(self.staging / (self.files[col_name] + '.npy')), mode='w+', dtype=dtype, shape=(rows,))
+
+    def append(self, table):
+        stop = self.position + len(table)
+        if stop > self.rows:
+            raise ValueError('{} rows appended to a table of {} rows'.format(stop, self.rows))
+
+        for col_name in self.columns:
+            values = table.column(col_name)
+            if col_name in self.categories:
+                categories = self.categories[col_name]
+                # chunks normally share the template dictionary, anything else is recoded onto it
+                if values.categories is not categories and not values.categories.equals(categories):
+                    values = pd.Categorical(np.asarray(values), categories=categories)
+                values = values.codes
+            self.arrays[col_name][self.position:stop] = values
+        self.position = stop
+
+    def close(self):
+        if self.position != self.rows:
+            raise ValueError('{} of {} rows were written to {}'.format(self.position, self.rows, self.directory))
+
+        schema = {'version': schema_version, 'rows': self.rows, 'columns': []}
+        for col_name in self.columns:
+            file_name = self.files[col_name]
+            self.arrays[col_name].flush()
+            if col_name in self.categories:
+                with open(self.staging / (file_name + '.categories.json'), 'w') as json_file:
+                    json.dump(np.asarray(self.categories[col_name], dtype=object).tolist(), json_file)
+                kind = 'dictionary'
+            else:
+                kind = 'numeric'
+            text_index = col_name in self.text_index_columns and col_name in self.categories
+            if text_index:
+                trigram_index = self.text_indexes.get(col_name)
+                if trigram_index is None:
+                    trigram_index = TrigramIndex.build(self.categories[col_name])
+                trigram_index.save(self.staging / file_name)
+            values = self.arrays[col_name]
+            if col_name in self.categories:
+                values = pd.Categorical.from_codes(values, categories=self.categories[col_name])
+            sort_index = col_name in self.sort_index_columns
+            if sort_index:
+                SortIndex.build(values).save(self.staging / file_name)
+            # columns with too many distinct values get no bitmap index
+            bitmap_index = None
+            if col_name in self.bitmap_index_columns:
+                bitmap_index = BitmapIndex.build(values, BITMAP_MAX_VALUES)
+            if bitmap_index is not None:
+                bitmap_index.save(self.staging / file_name)
+            schema['columns'].append({'name': col_name, 'kind': kind, 'file': file_name,
+                                      'text_index': text_index, 'sort_index': sort_index,
+                                      'bitmap_index': bitmap_index is not None})
+        self.arrays = {}
+
+        with open(self.staging / schema_file, 'w') as json_file:
+            json.dump(schema, json_file, indent=1)
+
+        # keep the previous table until the new one is in place
+        retired = self.directory.with_name(self.directory.name + '.old')
+        if retired.exists():
+            shutil.rmtree(retired)
+        if self.directory.exists():
+            os.rename(self.directory, retired)
+        os.rename(self.staging, self.directory)
+        if retired.exists():
+            shutil.rmtree(retired)
+
+
+# writes a whole data frame in one go
+def write_columnar(frame, directory, text_index_columns=(), sort_index_columns=(), bitmap_index_columns=()):
+    table = ColumnarTable.from_frame(frame)
+    writer = ColumnarWriter(directory, len(table), table, text_index_columns, sort_index_columns,
+                            bitmap_index_columns)
+    writer.append(table)
+    writer.close()
+
+
+# =============================================================================
+# 05.03.01 | Read Columnar Table
+# =============================================================================
+def read_columnar(directory, mmap=True):
+    directory = Path(directory)
+    with open(directory / schema_file) as json_file:
+        schema = json.load(json_file)
+    if schema.get('version') != schema_version:
+        raise ValueError('{} was written with schema version {}, expected {}'.format(
+            directory, schema.get('version'), schema_version))
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {}
+    text_indexes = {}
+    sort_indexes = {}
+    bitmap_indexes = {}
+    for column in schema['columns']:
+        values = np.load(directory / (column['file'] + '.npy'), mmap_mode=mmap_mode)
+        if column['kind'] == 'dictionary':
+            with open(directory / (column['file'] + '.categories.json')) as json_file:
+                categories = json.load(json_file)
+            values = pd.Categorical.from_codes(values, categories=categories)
+        arrays[column['name']] = values
+        if column.get('text_index'):
+            text_indexes[column['name']] = TrigramIndex.load(directory / column['file'], mmap=mmap)
+        if column.get('sort_index'):
+            sort_indexes[column['name']] = SortIndex.load(directory / column['file'], mmap=mmap)
+        if column.get('bitmap_index'):
+            bitmap_indexes[column['name']] = BitmapIndex.load(directory / column['file'], mmap=mmap)
+
+    return ColumnarTable([column['name'] for column in schema['columns']], arrays,
+                         text_indexes, sort_indexes, bitmap_indexes)
+
+
+# loads the columnar directory when the ETL has written one,
+# otherwise falls back to the whole-frame pickle of earlier ETL runs
+# text, sort and bitmap indexes the store does not have yet are built here
+def load_table(directory, pickle_path, text_index_columns=(), sort_index_columns=(), bitmap_index_columns=(),
+               mmap=True):
+    if (Path(directory) / schema_file).exists():
+        table = read_columnar(directory, mmap=mmap)
+    else:
+        table = ColumnarTable.from_frame(pd.read_pickle(pickle_path))
+
+    missing = [col_name for col_name in text_index_columns if col_name not in table.text_indexes]
+    table.text_indexes.update(build_text_indexes(table, missing))
+    missing = [col_name for col_name in sort_index_columns if col_name not in table.sort_indexes]
+    table.sort_indexes.update(build_sort_indexes(table, missing))
+    missing = [col_name for col_name in bitmap_index_columns if col_name not in table.bitmap_indexes]
+    table.bitmap_indexes.update(build_bitmap_indexes(table, missing, BITMAP_MAX_VALUES))
+    return table
+
+
+# =============================================================================
+# 05.04.01 | Lazy Table
+# =============================================================================
+# calls the loader the first time get() is called and keeps what it returns
+# the lock makes sure concurrent first requests (gunicorn threads) load only once
+class LazyTable:
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.value = None
+        self.lock = threading.Lock()
+
+    def loaded(self):
+        return self.value is not None
+
+    def get(self):
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    self.value = self.loader()
+        return self.value
@@ -0,0 +1,167 @@
+# ===============================================================================
+# 15.00.01 | Data Versions | Documentation
+# ===============================================================================
+# Name:               15_data_versions
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Versioned data directories for the dashboard tables and the watcher that swaps
+#                     the app over to a new version without restarting the workers.
+#
+# Notes:              Every ETL run writes its columnar tables into data/versions/<version>/ and, once
+#                     everything is written, points data/current_version at it (an atomic rename),
+#                     so the app never sees a half written version.
+#                     Each app process polls current_version from a background thread. A new version is loaded
+#                     (memory-mapped) next to the old one and swapped in with a single assignment.
+#                     Requests take the current version once and use it to the end, so a swap never mixes versions.
+#                     The old version is released by reference counting once the last request using it finishes.
+#                     Caches are keyed by version, so nothing cached for an old version is ever served for a new one.
+#                     The ETL keeps the newest DATA_VERSIONS_KEPT versions and deletes the rest;
+#                     a worker still mapping a deleted version keeps reading it until it lets go (POSIX unlink).
+#
+# Warnings:           Without data/current_version (data written by an older ETL) the app reads
+#                     the unversioned table directories and there is nothing to watch.
+#                     Deleting versions while they are mapped is only safe on POSIX systems.
+#
+# Outline:            Import packages.
+#                     Name, publish and prune versions.
+#                     Define the dataset of one version.
+#                     Define the version watcher.
+#
+#
+# =============================================================================
+# 15.00.02 | Import Packages
+# =============================================================================
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+versions_directory = 'versions'
+current_version_file = 'current_version'
+# name of the dataset read from the unversioned table directories
+unversioned = 'unversioned'
+
+
+# =============================================================================
+# 15.01.01 | Versions
+# =============================================================================
+# versions sort by time of creation
+def new_version_id():
+    return time.strftime('%Y%m%dT%H%M%S') + '_{:06d}'.format(int(time.time() * 1e6) % 1000000)
+
+
+def version_directory(data_directory, version):
+    if version == unversioned:
+        return Path(data_directory)
+    return Path(data_directory) / versions_directory / version
+
+
+# the published version, None when the ETL has not published one
+def read_current_version(data_directory):
+    try:
+        with open(Path(data_directory) / current_version_file) as version_file:
+            version = version_file.read().strip()
+    except OSError:
+        return None
+    return version or None
+
+
+# points current_version at a fully written version directory
+def publish_version(data_directory, version):
+    path = Path(data_directory) / current_version_file
+    staging = path.with_name(path.name + '.tmp')
+    with open(staging, 'w') as version_file:
+        version_file.write(version + '\n')
+    os.replace(str(staging), str(path))
+
+
+# copies a table directory of an older version into a new one as hard links (no data is copied)
+def link_table(source, destination):
+    if Path(source).exists():
+        shutil.copytree(str(source), str(destination), copy_function=os.link)
+
+
+# deletes all but the newest keep versions (never the published one)
+def prune_versions(data_directory, keep):
+    root = Path(data_directory) / versions_directory
+    if not root.exists():
+        return
+    current = read_current_version(data_directory)
+    versions = sorted(path.name for path in root.iterdir() if path.is_dir())
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version != current:
+            shutil.rmtree(str(root / version), ignore_errors=True)
+
+
+# =============================================================================
+# 15.02.01 | Dataset
+# =============================================================================
+# the tables of one version; the loader is called with the version's directory and returns
+# a dict of table name -> value (LazyTable objects for the big tables, anything else as is)
+class Dataset:
+
+    def __init__(self, version, tables):
+        self.version = version
+        self.tables = tables
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    # cache namespace of a table, so cached results never outlive the version they were computed on
+    def cache_name(self, name):
+        return '{}@{}'.format(name, self.version)
+
+
+# =============================================================================
+# 15.03.01 | Version Watcher
+# =============================================================================
+# holds the current dataset and swaps it when a new version is published
+# the polling thread starts with the first current() call in each process (threads do not survive fork)
+class VersionWatcher:
+
+    def __init__(self, data_directory, loader, interval, warm=None):
+        self.data_directory = data_directory
+        self.loader = loader
+        self.interval = interval
+        # called with the new dataset (and the one it replaces) before the swap, e.g. to load its tables
+        self.warm = warm
+        self.dataset = loader(read_current_version(data_directory) or unversioned)
+        # a version that failed to load is not retried until another one is published
+        self.failed = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        if self.pid != os.getpid() and self.interval:
+            with self.lock:
+                if self.pid != os.getpid():
+                    threading.Thread(target=self._watch, daemon=True).start()
+                    self.pid = os.getpid()
+        return self.dataset
+
+    # loads a version if it differs from the current one, returns True when it was swapped in
+    def refresh(self):
+        version = read_current_version(self.data_directory)
+        if version is None or version in (self.dataset.version, self.failed):
+            return False
+        try:
+            dataset = self.loader(version)
+            if self.warm is not None:
+                self.warm(dataset, self.dataset)
+        except Exception:
+            # loading and warming alike, a broken version is not loaded again every interval
+            self.failed = version
+            raise
+        # one assignment, requests see either the old or the new dataset
+        self.dataset = dataset
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as error:
+                # a broken version is skipped, the current one keeps serving
+                print('Data version refresh failed: {!r}'.format(error))
@@ -3,7 +3,7 @@
 # ===============================================================================
 # Name:               01_environment_configuration
 # Author:             Rodd
-# Last Edited Date:   11/9/19
+# Last Edited Date:   10/18/26
 # Description:        Loads packages, sets working directory, 
 #                     and defines global variables.
 # Notes:              Must set your working directory outside of this script 
@@ -53,6 +53,15 @@ user_recs_orig_path = '/dnn_user_prod_dense_20_predictions.pkl'
 product_recs_path = '/product_recommendations.pkl'
 user_recs_path = '/user_recommendations.pkl'
 
+# re-scored predictions for the incremental ETL run (same columns as the full prediction pickles)
+product_recs_delta_path = '/dnn_autoencoder_20_predictions_delta.pkl'
+user_recs_delta_path = '/dnn_user_prod_dense_20_predictions_delta.pkl'
+
+# columnar (memory-mapped) versions of the dashboard tables, one directory per table
+product_recs_store_path = '/product_recommendations'
+user_recs_store_path = '/user_recommendations'
+top_10_products_store_path = '/top_10_products'
+
 print('Script: 01.01.01 [Set working directory and other paths] completed')
 
 
@@ -72,45 +81,108 @@ colors = {'black_col': '#000000',     # Black
 # defining length of tables
 PAGE_SIZE = 10
 
-# used for controlling filtering of tables
-operators = [['ge ', '>='],
-             ['le ', '<='],
-             ['lt ', '<'],
-             ['gt ', '>'],
-             ['ne ', '!='],
-             ['eq ', '='],
-             ['contains '],
-             ['datestartswith ']]
+# number of distinct filter queries whose parsed form is kept in memory
+FILTER_PARSE_CACHE_SIZE = 1024
 
-print('Script: 01.02.01 [Define Other Global Variables] completed')
+# memory the cached filter results (matching row positions) may use, in bytes
+RESULT_CACHE_BYTES = 256 * 1024 ** 2
 
+# queries whose match count is remembered once evaluated (also when the result was too big to cache)
+RESULT_COUNT_ENTRIES = 100000
+
+# threads per process the filter evaluations run on, 0 evaluates them in the callback itself
+FILTER_WORKERS = int(os.environ.get('FILTER_WORKERS', 2))
+
+# seconds a table callback waits for its filter before answering with a partial result
+FILTER_DEADLINE_SECONDS = float(os.environ.get('FILTER_DEADLINE_SECONDS', 2))
+
+# a partial result holds the matches among this many leading rows of the table
+PARTIAL_SCAN_ROWS = 500000
+
+# milliseconds between the refreshes of a table showing a partial result
+PARTIAL_REFRESH_MS = 1000
+
+# find the rows of the requested page with a block scan that stops once they are found,
+# the full result (and the count) is evaluated in the background
+BLOCK_SCAN = os.environ.get('BLOCK_SCAN', '1') == '1'
+
+# rows per block of the block scan
+FILTER_BLOCK_ROWS = 65536
+
+# encode the Dash responses with orjson (when installed) instead of the plotly JSON encoder
+FAST_JSON = os.environ.get('FAST_JSON', '1') == '1'
+
+# encoded table rows kept for reuse by the fast encoder
+ROW_FRAGMENT_CACHE_ROWS = 100000
+
+# callback timing histograms are served here (local requests only)
+METRICS_PATH = '/metrics'
+
+# file every callback timing is appended to as a JSON line, unset keeps them in memory only
+METRICS_LOG_PATH = os.environ.get('METRICS_LOG_PATH')
+
+# slowest callback requests (with their filter query) kept for the metrics endpoint
+SLOW_QUERY_COUNT = 20
+
+# JSON recommendation lookups for other services are served under this path
+API_PATH = '/api'
+
+# seconds clients and proxies may reuse a lookup response (Cache-Control max-age)
+API_MAX_AGE = 300
+
+# ids a batch lookup resolves and writes out at a time
+BATCH_CHUNK_IDS = 1000
+
+# text columns repeated on every recommendation row, stored dictionary encoded (pandas categorical)
+dictionary_columns = ['Original Product', 'Recommended Product',
+                      'Product Category 2', 'Product Category 3',
+                      'Product URL']
+
+# text columns with a trigram index for contains filters
+text_index_columns = ['Original Product', 'Recommended Product']
+
+# columns the recommendation tables can be sorted by, each gets a precomputed sort order
+sort_index_columns = ['Original Product Id', 'Original Product', 'Reviewer Id',
+                      'Rank Order', 'Recommended Product',
+                      'Product Category 2', 'Product Category 3',
+                      'Price', 'Number of Reviews', 'Average Rating']
+
+# numeric sort indexes double as range indexes, a range filter uses its index only when it matches
+# at most this fraction of the table (beyond that comparing every row is faster)
+RANGE_INDEX_MAX_FRACTION = 0.02
+
+# low cardinality columns with a bitmap index, filters on them are answered by intersecting bitmaps
+bitmap_index_columns = ['Product Category 2', 'Product Category 3', 'Average Rating']
+
+# columns with more distinct values than this get no bitmap index (they are scanned instead)
+BITMAP_MAX_VALUES = 4096
+
+# a filter clause uses its bitmap index only when the values it matches hold at most this fraction of the table
+# (unioning the bitmaps of a broad clause costs more than comparing the dictionary codes of every row)
+BITMAP_INDEX_MAX_FRACTION = 0.1
+
+# rows of predictions the ETL enriches and ranks at a time (whole id groups, so a chunk can be a bit larger)
+ETL_CHUNK_ROWS = 1000000
+
+# processes the ETL ranks chunks on, 1 keeps everything in the script's own process
+ETL_WORKERS = int(os.environ.get('ETL_WORKERS', os.cpu_count() or 1))
+
+# recommendations kept per product / reviewer by the ETL ranking, None keeps all of them
+RECOMMENDATIONS_PER_KEY = None
+
+# load the recommendation tables on the first request that needs them instead of at app import,
+# LAZY_TABLES=0 loads them at import (in the gunicorn master when preloading, so workers share them)
+LAZY_TABLES = os.environ.get('LAZY_TABLES', '1') == '1'
+
+# seconds between the app's checks for a newly published data version, 0 never reloads
+DATA_RELOAD_SECONDS = int(os.environ.get('DATA_RELOAD_SECONDS', 30))
+
+# data versions the ETL keeps on disk (the published one included), older ones are deleted
+DATA_VERSIONS_KEPT = 3
+
+# columns that get a key index so equality filters on them skip the full scan
+product_key_columns = ['Original Product Id']
+user_key_columns = ['Reviewer Id']
+
+print('Script: 01.02.01 [Define Other Global Variables] completed')
 
-# =============================================================================
-# 01.03.01 | Define Functions
-# =============================================================================
-# used to help with filtering
-# found this code here: https://dash.plot.ly/datatable/callbacks
-def split_filter_part(filter_part):
-    for operator_type in operators:
-        for operator in operator_type:
-            if operator in filter_part:
-                name_part, value_part = filter_part.split(operator, 1)
-                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
-
-                value_part = value_part.strip()
-                v0 = value_part[0]
-                if (v0 == value_part[-1] and v0 in ("'", '"', '`')):
-                    value = value_part[1: -1].replace('\\' + v0, v0)
-                else:
-                    try:
-                        value = float(value_part)
-                    except ValueError:
-                        value = value_part
-
-                # word operators need spaces after them in the filter string,
-                # but we don't want these later
-                return name, operator_type[0].strip(), value
-
-    return [None] * 3
-
-print('Script: 01.03.01 [Define Functions] completed')
\ No newline at end of file
@@ -0,0 +1,502 @@
+# ===============================================================================
+# 04.00.01 | Filter Engine | Documentation
+# ===============================================================================
+# Name:               04_filter_engine
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Parses the DataTable filter_query strings and evaluates them
+#                     against the recommendation tables as a single boolean mask.
+#
+# Notes:              Grammar follows the dash DataTable custom filtering docs:
+#                        {column} operator value [&& {column} operator value ...]
+#                     Operators can be written as words (ge, eq, contains, ...) or symbols (>=, =, ...).
+#                     Values can be quoted with ', " or ` (backslash escapes the quote) or left bare.
+#                     Bare values that look like numbers are compared as numbers.
+#
+# Warnings:           Only && is supported between clauses, the same as the original callbacks.
+#                     Clauses that cannot be parsed are ignored.
+#                     Only single column sorting (sort_mode='single') is supported, sorting on a column
+#                     without a sort index leaves the rows in table order.
+#
+# Outline:            Import packages.
+#                     Define operators and the parsed clause type.
+#                     Parse filter queries (cached on the raw query string).
+#                     Evaluate clauses into one mask (after key, bitmap and range index lookups)
+#                     and return the matching row positions.
+#                     Find only the first matches of a query (block by block, for the first pages).
+#                     Cache the matching row positions so paging through a result does not refilter.
+#                     Sort the matching row positions with the precomputed sort indexes.
+#                     (filter_executor.py runs these on a thread pool with a deadline)
+#
+#
+# =============================================================================
+# 04.00.02 | Import Packages
+# =============================================================================
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from environment_configuration import FILTER_PARSE_CACHE_SIZE, RESULT_CACHE_BYTES, RESULT_COUNT_ENTRIES
+from environment_configuration import RANGE_INDEX_MAX_FRACTION, BITMAP_INDEX_MAX_FRACTION
+
+
+# =============================================================================
+# 04.01.01 | Operators and Clauses
+# =============================================================================
+# every spelling of an operator maps to the pandas series method it stands for
+operator_names = {'>=': 'ge', 'ge': 'ge',
+                  '<=': 'le', 'le': 'le',
+                  '<': 'lt', 'lt': 'lt',
+                  '>': 'gt', 'gt': 'gt',
+                  '!=': 'ne', 'ne': 'ne',
+                  '=': 'eq', 'eq': 'eq',
+                  'contains': 'contains',
+                  'datestartswith': 'datestartswith'}
+
+relational_operators = ('eq', 'ne', 'lt', 'le', 'gt', 'ge')
+
+# symbols are tried longest first so ">=" is never read as ">" followed by "="
+# word operators must be followed by white space
+_operator_pattern = re.compile(r'\s*(>=|<=|!=|<|>|=|(?:eq|ne|lt|le|gt|ge|contains|datestartswith)(?=\s))\s*')
+_column_pattern = re.compile(r'\s*\{((?:[^}\\]|\\.)*)\}')
+_separator_pattern = re.compile(r'\s*&&\s*')
+_quotes = ("'", '"', '`')
+
+# value keeps the typed value (number or string), text keeps the value as the user wrote it
+Clause = namedtuple('Clause', ['column', 'operator', 'value', 'text'])
+
+
+# =============================================================================
+# 04.02.01 | Parse Filter Query
+# =============================================================================
+# reads a quoted value starting at position i, returns the unescaped value and the end position
+def _read_quoted(query, i):
+    quote = query[i]
+    chars = []
+    i += 1
+    while i < len(query):
+        char = query[i]
+        if char == '\\' and i + 1 < len(query) and query[i + 1] == quote:
+            chars.append(quote)
+            i += 2
+        elif char == quote:
+            return ''.join(chars), i + 1
+        else:
+            chars.append(char)
+            i += 1
+    # unterminated quote, take everything that is left
+    return ''.join(chars), i
+
+
+# reads a bare value, it runs until the next clause separator or the end of the query
+def _read_bare(query, i):
+    separator = _separator_pattern.search(query, i)
+    end = separator.start() if separator else len(query)
+    return query[i:end].strip(), end
+
+
+def _typed_value(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+# cached on the raw string so repeated and paginated requests do not reparse
+@lru_cache(maxsize=FILTER_PARSE_CACHE_SIZE)
+def parse_filter_query(query):
+    clauses = []
+    i = 0
+    query = query or ''
+
+    while i < len(query):
+        column = _column_pattern.match(query, i)
+        operator = _operator_pattern.match(query, column.end()) if column else None
+
+        if operator is None:
+            # skip the unreadable clause up to the next separator
+            separator = _separator_pattern.search(query, i)
+            if separator is None:
+                break
+            i = separator.end()
+            continue
+
+        i = operator.end()
+        if i < len(query) and query[i] in _quotes:
+            text, i = _read_quoted(query, i)
+            value = text
+        else:
+            text, i = _read_bare(query, i)
+            value = _typed_value(text)
+
+        name = re.sub(r'\\(.)', r'\1', column.group(1))
+        clauses.append(Clause(name, operator_names[operator.group(1)], value, text))
+
+        separator = _separator_pattern.match(query, i)
+        if separator is None:
+            # trailing junk after a value, nothing more can be read reliably
+            break
+        i = separator.end()
+
+    return tuple(clauses)
+
+
+# a query is the raw filter_query string or the clauses parse_filter_query returned for it
+# (the callbacks parse once and pass the clauses on)
+def query_clauses(query):
+    return query if isinstance(query, tuple) else parse_filter_query(query)
+
+
+# clauses are and-ed together so their order does not change the result
+# sorting them lets queries that only differ in clause order share one cache entry
+def normalize_filter_query(query):
+    return tuple(sorted(query_clauses(query), key=repr))
+
+
+# =============================================================================
+# 04.03.01 | Evaluate Filter Query
+# =============================================================================
+# evaluates one clause against a series, returns a boolean numpy array
+def _clause_mask(series, clause):
+    operator = clause.operator
+
+    if operator in relational_operators:
+        try:
+            # these operators match pandas series operator method names
+            return np.asarray(getattr(series, operator)(clause.value), dtype=bool)
+        except TypeError:
+            # comparing text with a number can never match
+            return np.zeros(len(series), dtype=bool)
+
+    if series.dtype != object:
+        series = series.astype(str)
+    if operator == 'contains':
+        # literal match, what users type is a partial title and not a regular expression
+        return np.asarray(series.str.contains(clause.text, regex=False, na=False), dtype=bool)
+    # this is a simplification of the front-end filtering logic,
+    # only works with complete fields in standard format
+    return np.asarray(series.str.startswith(clause.text, na=False), dtype=bool)
+
+
+# evaluates one clause on the distinct values of a dictionary encoded column, returns a boolean mask
+# over the dictionary with one more entry at the end for missing values, so mask[codes] gives the rows
+# (code -1 picks up the missing entry); the work grows with the number of distinct titles instead of rows,
+# contains filters on columns with a trigram index only look at the titles sharing the trigrams
+def _code_mask(values, clause, text_index=None):
+    code_mask = None
+    if clause.operator == 'contains' and text_index is not None:
+        # the trigram index returns the matching dictionary codes directly
+        codes = text_index.search(clause.text, values.categories)
+        if codes is not None:
+            code_mask = np.zeros(len(values.categories) + 1, dtype=bool)
+            code_mask[codes] = True
+    if code_mask is None:
+        dictionary = pd.Series(np.append(np.asarray(values.categories, dtype=object), None))
+        code_mask = _clause_mask(dictionary, clause)
+    return code_mask
+
+
+# the dictionary mask of every clause on a dictionary encoded column (None for the other clauses and for
+# (in)equality, which compares codes), built once per query so a block by block scan does not redo the dictionary work
+def _code_masks(table, clauses):
+    return [_code_mask(table.column(clause.column), clause, table.text_indexes.get(clause.column))
+            if isinstance(table.column(clause.column), pd.Categorical) and clause.operator not in ('eq', 'ne')
+            else None
+            for clause in clauses]
+
+
+# evaluates one clause against the column values of a table
+# dictionary encoded columns go through the mask of their dictionary (built here unless it is given)
+def _column_mask(values, clause, text_index=None, code_mask=None):
+    if isinstance(values, pd.Categorical):
+        if clause.operator in ('eq', 'ne'):
+            # (in)equality only needs the code of the value, the rows are compared as integers
+            code = values.categories.get_indexer([clause.value])[0]
+            if clause.operator == 'eq':
+                return values.codes == code if code >= 0 else np.zeros(len(values), dtype=bool)
+            return values.codes != code if code >= 0 else np.ones(len(values), dtype=bool)
+        if code_mask is None:
+            code_mask = _code_mask(values, clause, text_index)
+        return code_mask[values.codes]
+    return _clause_mask(pd.Series(values, copy=False), clause)
+
+
+# rows matching one clause on a column with a bitmap index, as a roaring bitmap
+# the clause is evaluated on the distinct values and the bitmaps of the matching values are unioned,
+# None when they hold more than max_rows rows (building a big union costs more than scanning the codes)
+def _bitmap_match(index, values, clause, max_rows):
+    key_positions = np.flatnonzero(_clause_mask(pd.Series(index.key_values(values)), clause))
+    if index.key_rows()[key_positions].sum() > max_rows:
+        return None
+    return index.union(key_positions)
+
+
+# the most selective numeric comparison a range index can answer, as (clause, start, stop, index)
+# None when no clause qualifies or even the best one matches too many rows
+# (collecting and sorting a big slice of row ids costs more than comparing every row)
+def _best_range(table, clauses):
+    best = None
+    for clause in clauses:
+        index = table.sort_indexes.get(clause.column)
+        if index is None or not isinstance(clause.value, float):
+            continue
+        bounds = index.range(clause.operator, clause.value)
+        if bounds is not None and (best is None or bounds[1] - bounds[0] < best[2] - best[1]):
+            best = (clause, bounds[0], bounds[1], index)
+    if best is None or best[2] - best[1] > RANGE_INDEX_MAX_FRACTION * len(table):
+        return None
+    return best
+
+
+# the clauses of a query on columns of the table (clauses on other columns are ignored)
+def table_clauses(table, query):
+    return [clause for clause in query_clauses(query) if clause.column in table.columns]
+
+
+# index lookups of a query, returns the candidate rows (in table order, None for every row)
+# and the clauses the indexes did not answer
+# an equality clause on an indexed column narrows the rows first, otherwise the clauses on columns
+# with a bitmap index (that match few enough rows) are intersected as bitmaps and the most selective
+# numeric range clause is looked up in its range index
+def _index_candidates(table, key_indexes, query):
+    clauses = table_clauses(table, query)
+
+    rows = None
+    for clause in clauses:
+        if clause.operator == 'eq' and clause.column in key_indexes:
+            rows = key_indexes[clause.column].lookup(clause.value)
+            clauses = [other for other in clauses if other is not clause]
+            break
+
+    # after a key lookup only a few rows are left, scanning them is cheaper than reading bitmaps
+    if rows is None:
+        bitmap = None
+        for clause in [clause for clause in clauses if clause.column in table.bitmap_indexes]:
+            clause_bitmap = _bitmap_match(table.bitmap_indexes[clause.column], table.column(clause.column), clause,
+                                          BITMAP_INDEX_MAX_FRACTION * len(table))
+            if clause_bitmap is None:
+                # a broad clause is left to the scan of the remaining rows
+                continue
+            bitmap = clause_bitmap if bitmap is None else bitmap & clause_bitmap
+            clauses = [other for other in clauses if other is not clause]
+        if bitmap is not None:
+            rows = bitmap.positions()
+
+        best = _best_range(table, clauses)
+        if best is not None and (rows is None or best[2] - best[1] < len(rows)):
+            clause, start, stop, index = best
+            range_rows = index.range_positions(start, stop)
+            rows = range_rows if rows is None else np.intersect1d(rows, range_rows, assume_unique=True)
+            clauses = [other for other in clauses if other is not clause]
+
+    return rows, clauses
+
+
+# evaluates the clauses on some rows of the table, rows is a slice (a block of rows, read without a copy)
+# or an array of row positions; every clause is combined into one mask so no intermediate frames are built
+# code_masks are the dictionary masks of the clauses (see _code_masks), built here when not given
+def _match(table, clauses, rows, code_masks=None):
+    positions = np.arange(rows.start, rows.stop, dtype=np.int64) if isinstance(rows, slice) else rows
+    if code_masks is None and len(positions):
+        code_masks = _code_masks(table, clauses)
+    mask = None
+    for clause, code_mask in zip(clauses, code_masks or ()):
+        if len(positions) == 0:
+            break
+        clause_mask = _column_mask(table.column(clause.column)[rows], clause, code_mask=code_mask)
+        mask = clause_mask if mask is None else mask & clause_mask
+
+    if mask is None or len(positions) == 0:
+        return positions
+    return positions[mask]
+
+
+# returns the positions of the rows matching the query, in table order
+# the index lookups narrow the rows first, every other clause is evaluated only on the rows left
+# with row_limit only the first row_limit rows are looked at (a partial result, see filter_executor.py)
+def filter_positions(table, key_indexes, query, row_limit=None):
+    rows, clauses = _index_candidates(table, key_indexes, query)
+    if rows is None:
+        rows = slice(0, len(table) if row_limit is None else min(row_limit, len(table)))
+    elif row_limit is not None:
+        rows = rows[rows < row_limit]
+    return _match(table, clauses, rows)
+
+
+# the first count matches of the query in the requested order, found by scanning block_rows rows at a time
+# and stopping at the block that completes them, so the first pages of a broad filter cost a few blocks
+# instead of the whole table; sorted requests walk the precomputed sort order block by block
+# returns (positions, complete), complete when every row was looked at (positions are then all the matches)
+# stop is called between blocks (deadline or a newer request), True ends the scan with what was found
+def first_positions(table, key_indexes, query, sort_by, count, block_rows, stop=None):
+    rows, clauses = _index_candidates(table, key_indexes, query)
+    order = sort_order(table, sort_by)
+    if rows is not None:
+        # the indexes already narrowed the rows, evaluating all of them is cheap
+        positions = _match(table, clauses, rows)
+        return (positions if order is None else sort_positions(table, positions, order)), True
+
+    if order is not None:
+        col_name, descending = order
+        index = table.sort_indexes[col_name]
+        walk = index.descending if descending else index.ascending
+
+    # the dictionary work of the clauses is done once, every block only looks up its codes
+    code_masks = _code_masks(table, clauses)
+    found = []
+    matches = 0
+    for start in range(0, len(table), block_rows):
+        block = slice(start, min(start + block_rows, len(table)))
+        found.append(_match(table, clauses, block if order is None else np.asarray(walk[block], dtype=np.int64),
+                            code_masks))
+        matches += len(found[-1])
+        if block.stop < len(table) and (matches >= count or (stop is not None and stop())):
+            return np.concatenate(found), False
+    return (np.concatenate(found) if found else np.zeros(0, dtype=np.int64)), True
+
+
+# =============================================================================
+# 04.04.01 | Result Cache
+# =============================================================================
+# least recently used cache of matching row positions, bounded by the bytes held
+# rather than the number of entries because one broad filter can match millions of rows
+class ResultCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            positions = self.entries.get(key)
+            if positions is not None:
+                self.entries.move_to_end(key)
+            return positions
+
+    def put(self, key, positions):
+        # results bigger than the whole cache would only evict everything else
+        if positions.nbytes > self.max_bytes:
+            return
+        # cached arrays are shared between requests so nobody may change them
+        positions.flags.writeable = False
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self.entries[key] = positions
+            self.bytes += positions.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+result_cache = ResultCache(RESULT_CACHE_BYTES)
+
+
+# number of matches of every query evaluated to the end, least recently used dropped first
+# kept apart from the result cache, which skips results bigger than itself: a finished evaluation
+# is known as finished (and its count as well) even when its positions could not be cached
+class ResultCounts:
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            count = self.entries.get(key)
+            if count is not None:
+                self.entries.move_to_end(key)
+            return count
+
+    def put(self, key, count):
+        with self.lock:
+            self.entries[key] = count
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+result_counts = ResultCounts(RESULT_COUNT_ENTRIES)
+
+
+# same as filter_positions, but page 2..N of a query reuse the positions found for page 1
+# sorted results are cached as well, under the query plus the sort column and direction
+def cached_filter_positions(table_name, table, key_indexes, query, sort_by=None):
+    key = (table_name, normalize_filter_query(query))
+    positions = result_cache.get(key)
+    if positions is None:
+        positions = filter_positions(table, key_indexes, query)
+        result_cache.put(key, positions)
+        result_counts.put(key, len(positions))
+
+    order = sort_order(table, sort_by)
+    if order is None:
+        return positions
+
+    sorted_key = key + order
+    sorted_positions = result_cache.get(sorted_key)
+    if sorted_positions is None:
+        sorted_positions = sort_positions(table, positions, order)
+        result_cache.put(sorted_key, sorted_positions)
+    return sorted_positions
+
+
+# the number of matches of a query evaluated to the end (sorted or not), None when it has not been
+def finished_count(table_name, query):
+    return result_counts.get((table_name, normalize_filter_query(query)))
+
+
+# the cached result of a query, None when it has not been evaluated yet (nothing is filtered here)
+def cached_positions(table_name, table, key_indexes, query, sort_by=None):
+    if result_cache.get((table_name, normalize_filter_query(query))) is None:
+        return None
+    return cached_filter_positions(table_name, table, key_indexes, query, sort_by)
+
+
+# caches the complete result of a query found another way (a first_positions scan that reached the end)
+def cache_positions(table_name, table, query, sort_by, positions):
+    key = (table_name, normalize_filter_query(query))
+    result_counts.put(key, len(positions))
+    order = sort_order(table, sort_by)
+    if order is None:
+        result_cache.put(key, positions)
+    else:
+        result_cache.put(key + order, positions)
+        result_cache.put(key, np.sort(positions))
+
+
+# =============================================================================
+# 04.05.01 | Sort Filter Results
+# =============================================================================
+# reads the DataTable sort_by property ([{'column_id': ..., 'direction': 'asc' or 'desc'}])
+# returns (column, descending) or None when there is nothing the table can sort by
+def sort_order(table, sort_by):
+    if not sort_by:
+        return None
+    col_name = sort_by[0].get('column_id')
+    if col_name not in table.sort_indexes:
+        return None
+    return col_name, sort_by[0].get('direction') == 'desc'
+
+
+# the matching positions in the order of the precomputed sort index, no rows are sorted here
+def sort_positions(table, positions, order):
+    col_name, descending = order
+    return table.sort_indexes[col_name].sort(positions, descending)
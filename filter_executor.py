@@ -0,0 +1,267 @@
+# ===============================================================================
+# 16.00.01 | Filter Executor | Documentation
+# ===============================================================================
+# Name:               16_filter_executor
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Runs the filter evaluation of the table callbacks on a bounded thread pool,
+#                     drops requests a newer filter from the same browser has replaced
+#                     and answers with a partial result when the full one misses its deadline.
+#
+# Notes:              Typing in a filter box fires one request per key stroke. Each browser gets a client id
+#                     cookie, and a new request of a client for a table supersedes its older one: the older
+#                     evaluation is cancelled if it has not started, and the older callback returns no update.
+#                     Requests for the same query (and sort) share one evaluation instead of running it twice.
+#                     A thread pool and not a process pool: the tables are memory-mapped in this process and
+#                     the numpy work releases the GIL, a process would have to send the matching positions back.
+#                     When the evaluation misses FILTER_DEADLINE_SECONDS the callback answers with the matches
+#                     among the first PARTIAL_SCAN_ROWS rows, the evaluation goes on and caches its result,
+#                     which the table picks up on its next poll (see the refresh interval in app.py).
+#                     With BLOCK_SCAN on the callback does not wait for the full evaluation: it scans the table
+#                     FILTER_BLOCK_ROWS rows at a time (in the requested sort order) and stops once the rows of the
+#                     requested page are found, the full evaluation runs on the pool and brings the count
+#                     with the next refresh. The first pages of broad filters on big tables then cost a few blocks.
+#                     FILTER_WORKERS=0 evaluates in the callback like before.
+#
+# Warnings:           An evaluation that has started is not interrupted, a superseded one runs to the end
+#                     (its result is cached, typing back to the same filter gets it for free).
+#                     The pool is per process, each gunicorn worker has its own.
+#
+# Outline:            Import packages.
+#                     Identify the browser of a request.
+#                     Define the filter executor.
+#                     Evaluate a table filter with a deadline (or a block scan for the requested page).
+#
+#
+# =============================================================================
+# 16.00.02 | Import Packages
+# =============================================================================
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError
+from functools import partial
+
+import flask
+from dash.exceptions import PreventUpdate
+
+from environment_configuration import FILTER_WORKERS, FILTER_DEADLINE_SECONDS, PARTIAL_SCAN_ROWS
+from environment_configuration import BLOCK_SCAN, FILTER_BLOCK_ROWS
+from filter_engine import cached_filter_positions, filter_positions, normalize_filter_query
+from filter_engine import first_positions, cached_positions, cache_positions, finished_count, table_clauses
+from filter_engine import sort_order, sort_positions
+
+client_cookie = 'filter_client'
+
+# how often a waiting callback checks whether a newer request replaced it
+supersede_check_seconds = 0.05
+
+# (client, table) pairs whose newest request is remembered
+max_clients = 10000
+
+
+# =============================================================================
+# 16.01.01 | Client Id
+# =============================================================================
+# the client id cookie of the request, None without one (requests of clients without the cookie never supersede
+# each other, many users behind one proxy share an address) or outside a request (the benchmarks call the callbacks)
+def client_id():
+    if not flask.has_request_context():
+        return None
+    return flask.request.cookies.get(client_cookie)
+
+
+# gives every browser a client id cookie with the page load, the callback requests send it back
+# (only pages get it, a cookie on the cacheable API responses would keep proxies from caching them)
+def register_client_cookie(server):
+
+    def set_client_cookie(response):
+        if response.mimetype == 'text/html' and client_cookie not in flask.request.cookies:
+            response.set_cookie(client_cookie, uuid.uuid4().hex, httponly=True, samesite='Lax')
+        return response
+
+    server.after_request(set_client_cookie)
+
+
+# =============================================================================
+# 16.02.01 | Filter Executor
+# =============================================================================
+class FilterExecutor:
+
+    def __init__(self, workers, max_clients):
+        self.workers = workers
+        self.max_clients = max_clients
+        self.lock = threading.RLock()
+        self.pool = None
+        self.pid = None
+        self.generation = 0
+        # (table name, normalized query, sort order) -> future of the evaluation running for it
+        self.in_flight = {}
+        # (client, table name) -> generation of the client's newest request, the least recent clients are dropped
+        self.latest = OrderedDict()
+        # (client, table name) -> future of the evaluation the client's newest request started or joined
+        self.client_futures = {}
+        # future -> the (client, table name) pairs waiting for it, cancelled when none is left
+        self.waiting = {}
+
+    # the pool is created by the first request in each process, threads do not survive gunicorn's fork
+    def _pool(self):
+        if self.pid != os.getpid():
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='filter')
+            self.in_flight, self.client_futures, self.waiting = {}, {}, {}
+            self.pid = os.getpid()
+        return self.pool
+
+    # registers a new request of a client for a table (superseding its older ones), returns its generation
+    def start(self, client, table_name):
+        with self.lock:
+            self.generation += 1
+            if client is not None:
+                self.latest[(client, table_name)] = self.generation
+                self.latest.move_to_end((client, table_name))
+                while len(self.latest) > self.max_clients:
+                    self.latest.popitem(last=False)
+            return self.generation
+
+    # starts (or joins) the evaluation of a query on the pool, returns its future
+    def submit(self, client, table_name, table, key_indexes, query, sort_by):
+        key = (table_name, normalize_filter_query(query), sort_order(table, sort_by))
+        with self.lock:
+            pool = self._pool()
+            future = self.in_flight.get(key)
+            started = future is None
+            if started:
+                future = pool.submit(cached_filter_positions, table_name, table, key_indexes, query, sort_by)
+                self.in_flight[key] = future
+                self.waiting[future] = set()
+
+            # requests without a client never give up their evaluation
+            self.waiting[future].add((client, table_name))
+            if client is not None:
+                previous = self.client_futures.get((client, table_name))
+                self.client_futures[(client, table_name)] = future
+                if previous is not None and previous is not future:
+                    self._release(previous, (client, table_name))
+
+            # added last: an evaluation that already finished runs _done right here (the lock is reentrant),
+            # which then finds everything registered above and removes it again
+            if started:
+                future.add_done_callback(lambda done, key=key: self._done(key, done))
+            return future
+
+    # a future nobody waits for any more is cancelled (only works if it has not started)
+    def _release(self, future, client_table):
+        waiting = self.waiting.get(future)
+        if waiting is not None:
+            waiting.discard(client_table)
+            if not waiting:
+                future.cancel()
+
+    # finished evaluations (and their results) are not referenced any more, the result cache has them
+    def _done(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+            for client_table in self.waiting.pop(future, ()):
+                if self.client_futures.get(client_table) is future:
+                    del self.client_futures[client_table]
+
+    def superseded(self, client, table_name, generation):
+        if client is None:
+            return False
+        with self.lock:
+            latest = self.latest.get((client, table_name))
+        return latest is not None and latest != generation
+
+    # waits up to the deadline, returns the positions or None when the deadline passed
+    # raises PreventUpdate when a newer request of the same client replaced this one
+    def result(self, client, table_name, generation, future, deadline):
+        end = time.monotonic() + deadline
+        while True:
+            if self.superseded(client, table_name, generation):
+                raise PreventUpdate
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return future.result(timeout=min(remaining, supersede_check_seconds))
+            except CancelledError:
+                raise PreventUpdate
+            except TimeoutError:
+                continue
+
+
+filter_executor = FilterExecutor(FILTER_WORKERS, max_clients)
+
+
+# =============================================================================
+# 16.03.01 | Evaluate With Deadline
+# =============================================================================
+# the matches among the first row_limit rows, in the requested order
+def partial_filter_positions(table, key_indexes, query, sort_by, row_limit):
+    positions = filter_positions(table, key_indexes, query, row_limit)
+    order = sort_order(table, sort_by)
+    return positions if order is None else sort_positions(table, positions, order)
+
+
+# ends a block scan between blocks: at the deadline, or right away when a newer request replaced this one
+def _scan_stop(client, table_name, generation, end):
+    if filter_executor.superseded(client, table_name, generation):
+        raise PreventUpdate
+    return time.monotonic() > end
+
+
+# returns (positions, matches, complete); complete is False for a partial result: the first needed matches
+# of a block scan (or whatever was found by the deadline) or, without a block scan, the matches among the first rows,
+# matches is then the number found so far; a complete result may hold only the first needed positions
+# (a finished evaluation too big for the result cache), matches is always the full count
+# positions is an array of row positions, or a range for a query without filters (both slice to the page)
+# query is the filter_query string or the clauses parse_filter_query returned for it
+def evaluate_filter(table_name, table, key_indexes, query, sort_by=None, needed=None):
+    order = sort_order(table, sort_by)
+    if not table_clauses(table, query):
+        # nothing to filter: every row, in table order or the precomputed sort order, without allocating
+        # a position per row (a range slices lazily to the page, the sort order is memory-mapped)
+        if order is None:
+            return range(len(table)), len(table), True
+        index = table.sort_indexes[order[0]]
+        return (index.descending if order[1] else index.ascending), len(table), True
+
+    if not filter_executor.workers:
+        positions = cached_filter_positions(table_name, table, key_indexes, query, sort_by)
+        return positions, len(positions), True
+
+    positions = cached_positions(table_name, table, key_indexes, query, sort_by)
+    if positions is not None:
+        return positions, len(positions), True
+
+    matches = finished_count(table_name, query)
+    if matches is not None:
+        # evaluated to the end before but too big for the result cache: the count is known,
+        # only the rows up to the page are found again (no new evaluation is submitted)
+        positions, _ = first_positions(table, key_indexes, query, sort_by, needed or matches, FILTER_BLOCK_ROWS)
+        return positions, matches, True
+
+    client = client_id()
+    generation = filter_executor.start(client, table_name)
+
+    if needed is None or not BLOCK_SCAN:
+        future = filter_executor.submit(client, table_name, table, key_indexes, query, sort_by)
+        positions = filter_executor.result(client, table_name, generation, future, FILTER_DEADLINE_SECONDS)
+        if positions is not None:
+            return positions, len(positions), True
+        positions = partial_filter_positions(table, key_indexes, query, sort_by, PARTIAL_SCAN_ROWS)
+        return positions, len(positions), False
+
+    # the rows of the page come from a block scan that stops once they are found, the full result
+    # (the count and the later pages) is evaluated on the pool and picked up by the next refresh of the table
+    end = time.monotonic() + FILTER_DEADLINE_SECONDS
+    positions, complete = first_positions(table, key_indexes, query, sort_by, needed, FILTER_BLOCK_ROWS,
+                                          partial(_scan_stop, client, table_name, generation, end))
+    if complete:
+        cache_positions(table_name, table, query, sort_by, positions)
+        return positions, len(positions), True
+    filter_executor.submit(client, table_name, table, key_indexes, query, sort_by)
+    return positions, len(positions), False
@@ -0,0 +1,93 @@
+# ===============================================================================
+# 06.00.01 | Gunicorn Configuration | Documentation
+# ===============================================================================
+# Name:               06_gunicorn_configuration
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Server settings for "gunicorn app:server" (see Procfile).
+#
+# Notes:              With PRELOAD_APP=1 (the default) app.py is imported once in the gunicorn master.
+#                     The recommendation tables are loaded lazily by default (fast boot for the autoscaler),
+#                     each worker loads them on its first request. With LAZY_TABLES=0 they are loaded at
+#                     import instead, so the tables and their indexes are loaded before the workers fork
+#                     and every worker inherits them copy-on-write instead of loading its own copy.
+#                     The big columns are numpy arrays (memory-mapped when the columnar store exists),
+#                     their buffers carry no python refcounts, so reading them never dirties shared pages.
+#                     gc.freeze() moves everything loaded in the master out of the garbage collector's
+#                     reach so collections in the workers do not write to those pages either.
+#                     Each worker logs its memory use once it has booted.
+#                     Each worker serves GUNICORN_THREADS requests at a time, the filters run on a separate bounded pool.
+#                     New data does not need a restart: each worker swaps to a newly published data version
+#                     on its own (see data_versions.py), memory-mapping it from the shared page cache.
+#
+# Warnings:           Preloading means a code change needs a full restart, not just a worker reload.
+#                     The memory report reads /proc and is skipped on systems without it.
+#
+# Outline:            Import packages.
+#                     Define server settings.
+#                     Define memory report.
+#                     Define server hooks.
+#
+#
+# =============================================================================
+# 06.00.02 | Import Packages
+# =============================================================================
+import gc
+import os
+
+
+# =============================================================================
+# 06.01.01 | Server Settings
+# =============================================================================
+# bind and workers keep gunicorn's defaults, which already follow the PORT and WEB_CONCURRENCY variables
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+
+# threads per worker (gthread workers): a request waiting on a slow filter (see filter_executor.py)
+# no longer holds up every other request of its worker
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+
+# =============================================================================
+# 06.02.01 | Memory Report
+# =============================================================================
+# resident memory of this process split into the part shared with other processes
+# (pages inherited from the master or mapped from the columnar store) and the private part
+def memory_report():
+    fields = {}
+    for file_name in ('/proc/self/smaps_rollup', '/proc/self/status'):
+        try:
+            with open(file_name) as proc_file:
+                for line in proc_file:
+                    name, _, value = line.partition(':')
+                    if value.strip().endswith('kB'):
+                        fields.setdefault(name.strip(), int(value.split()[0]))
+        except OSError:
+            continue
+
+    if 'Rss' not in fields and 'VmRSS' not in fields:
+        return None
+    shared = fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return 'rss={:.1f}MB pss={:.1f}MB shared={:.1f}MB private={:.1f}MB'.format(
+        fields.get('Rss', fields.get('VmRSS', 0)) / 1024, fields.get('Pss', 0) / 1024,
+        shared / 1024, private / 1024)
+
+
+# =============================================================================
+# 06.03.01 | Server Hooks
+# =============================================================================
+# runs in the master once, after app.py has been imported (when preloading) and before the first fork
+def when_ready(server):
+    if preload_app and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    report = memory_report()
+    if report:
+        server.log.info('Master memory (preload_app=%s): %s', preload_app, report)
+
+
+def post_worker_init(worker):
+    report = memory_report()
+    if report:
+        worker.log.info('Worker %s memory: %s', worker.pid, report)
@@ -0,0 +1,175 @@
+# ===============================================================================
+# 08.00.01 | JSON Payload | Documentation
+# ===============================================================================
+# Name:               08_json_payload
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Builds the DataTable page payload straight from the column arrays
+#                     and makes Dash encode its responses with orjson.
+#
+# Notes:              A page used to go table -> data frame -> to_dict('records') -> PlotlyJSONEncoder,
+#                     which builds python objects cell by cell and then encodes the response twice
+#                     (PlotlyJSONEncoder re-encodes everything to clean up NaN values).
+#                     Here each column of the page is turned into a python list in one call and zipped into rows.
+#                     With FAST_JSON on (and orjson installed) Dash encodes with one that runs orjson,
+#                     and every row is encoded once and kept as a JSON fragment, so hot rows
+#                     (the first pages of popular filters) are never encoded again.
+#                     Missing values are sent as null, the same as PlotlyJSONEncoder did.
+#
+# Warnings:           Row fragments are only returned when the fast encoder is installed,
+#                     PlotlyJSONEncoder cannot encode them.
+#                     install_json_encoder replaces Dash's encoding for the whole process, call it once.
+#                     Fragments are cached by table name and row position, clear the cache when a table changes.
+#
+# Outline:            Import packages.
+#                     Build page records from the column arrays.
+#                     Cache encoded rows.
+#                     Define the fast JSON encoder.
+#                     Install the one encoder of the Dash responses.
+#
+#
+# =============================================================================
+# 08.00.02 | Import Packages
+# =============================================================================
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly
+from plotly.utils import PlotlyJSONEncoder
+
+# orjson is optional, without it Dash keeps its own encoder and pages are sent as plain records
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from environment_configuration import ROW_FRAGMENT_CACHE_ROWS
+
+
+# =============================================================================
+# 08.01.01 | Page Records
+# =============================================================================
+# the values of one column as a python list, missing values as None
+def column_values(values):
+    if isinstance(values, pd.Categorical):
+        # only the dictionary entries of the page's codes are read, the dictionary itself is never copied
+        # (its strings are shared copy-on-write between the gunicorn workers), code -1 (missing) becomes None
+        codes = np.asarray(values.codes)
+        missing = codes < 0
+        if missing.all():
+            return [None] * len(codes)
+        page = np.asarray(values.categories.take(np.where(missing, 0, codes)), dtype=object)
+        page[missing] = None
+        return page.tolist()
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        missing = np.isnan(values)
+        if missing.any():
+            values = values.astype(object)
+            values[missing] = None
+    return values.tolist()
+
+
+# the rows at the given positions as DataTable records (one dict per row)
+def page_records(table, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    columns = [column_values(table.column(col_name)[positions]) for col_name in table.columns]
+    return [dict(zip(table.columns, row)) for row in zip(*columns)]
+
+
+# =============================================================================
+# 08.02.01 | Row Fragment Cache
+# =============================================================================
+# least recently used cache of encoded rows (orjson fragments), keyed by table name and row position
+class RowFragmentCache:
+
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def page(self, table_name, table, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        fragments = [None] * len(positions)
+        with self.lock:
+            for i, position in enumerate(positions.tolist()):
+                fragment = self.entries.get((table_name, position))
+                if fragment is not None:
+                    self.entries.move_to_end((table_name, position))
+                    fragments[i] = fragment
+
+        # only the rows that are not cached yet are read and encoded
+        missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+        if missing:
+            records = page_records(table, positions[missing])
+            with self.lock:
+                for i, record in zip(missing, records):
+                    fragments[i] = orjson.Fragment(orjson.dumps(record))
+                    self.entries[(table_name, int(positions[i]))] = fragments[i]
+                while len(self.entries) > self.max_rows:
+                    self.entries.popitem(last=False)
+        return fragments
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+row_cache = RowFragmentCache(ROW_FRAGMENT_CACHE_ROWS)
+
+
+# the DataTable data of a page: cached row fragments with the fast encoder, plain records without it
+def page_payload(table_name, table, positions):
+    if fast_json_installed and hasattr(orjson, 'Fragment'):
+        return row_cache.page(table_name, table, positions)
+    return page_records(table, positions)
+
+
+# =============================================================================
+# 08.03.01 | Fast JSON Encoder
+# =============================================================================
+# this subclass keeps PlotlyJSONEncoder's handling of plotly figures, pandas and numpy objects (default)
+# but lets orjson do the encoding, orjson writes NaN and infinity as null like PlotlyJSONEncoder does
+if orjson is not None:
+
+    class FastJSONEncoder(PlotlyJSONEncoder):
+
+        def encode(self, o):
+            return orjson.dumps(o, default=self.default,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+
+# the fast encoder when asked for and orjson is installed, plotly's encoder otherwise
+def json_encoder(fast):
+    return FastJSONEncoder if fast and orjson is not None else PlotlyJSONEncoder
+
+
+# =============================================================================
+# 08.04.01 | Response Encoder
+# =============================================================================
+# the one encoder every Dash callback response goes through, set by install_json_encoder (once, in app.py)
+response_encoder = PlotlyJSONEncoder
+fast_json_installed = False
+
+
+# Dash 2 calls this instead of plotly's to_json for the callback responses
+def encode_response(value):
+    return response_encoder(separators=(',', ':')).encode(value)
+
+
+# points Dash at the encoder, whichever way the installed Dash version encodes its responses:
+# Dash 1 with json.dumps(..., cls=plotly.utils.PlotlyJSONEncoder), Dash 2 with the to_json function
+# its callback module imported from dash._utils
+def install_json_encoder(encoder):
+    global response_encoder, fast_json_installed
+    response_encoder = encoder
+    fast_json_installed = orjson is not None and issubclass(encoder, FastJSONEncoder)
+    plotly.utils.PlotlyJSONEncoder = encoder
+    try:
+        from dash import _callback as dash_callback
+    except ImportError:
+        dash_callback = None
+    if dash_callback is not None and hasattr(dash_callback, 'to_json'):
+        dash_callback.to_json = encode_response
@@ -0,0 +1,264 @@
+# ===============================================================================
+# 17.00.01 | Recommendation API | Documentation
+# ===============================================================================
+# Name:               17_recommendation_api
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        JSON endpoints on the Flask server that return the recommendations of one product
+#                     or one reviewer, for other services (instead of scraping the dashboard).
+#
+# Notes:              GET API_PATH/products/<Original Product Id>/recommendations
+#                     GET API_PATH/users/<Reviewer Id>/recommendations
+#                     Optional query parameters: top_k (number of recommendations, best first),
+#                     category2 and category3 (only recommendations in that Product Category 2 / 3).
+#                     The rows of an id come from the key index of the table (one contiguous slice, already
+#                     in rank order), no filter query is parsed and nothing of the Dash callback machinery runs.
+#                     Responses carry an ETag derived from the data version and the request, so a client
+#                     revalidating with If-None-Match gets a 304 without any lookup, and Cache-Control
+#                     lets clients and proxies reuse a response for API_MAX_AGE seconds.
+#                     Each endpoint is timed in the callback metrics (see callback_metrics.py).
+#
+#                     POST API_PATH/products/recommendations/batch and API_PATH/users/recommendations/batch take many ids
+#                     (one per line in the body or an uploaded file, or JSON {"ids": [...]}) with the same parameters
+#                     and stream the answer as JSON lines (one per id) or, with format=csv, one CSV row per recommendation.
+#                     The ids are resolved BATCH_CHUNK_IDS at a time with one vectorized key index lookup per chunk,
+#                     each chunk is written out before the next is read, so memory does not grow with the batch.
+#
+# Warnings:           Ids are matched exactly (as text). An unknown id returns 404.
+#                     In a batch an unknown id gets "found": false (JSON lines) or no rows (CSV).
+#                     A newly published data version changes every ETag, cached responses expire with API_MAX_AGE.
+#
+# Outline:            Import packages.
+#                     Build the response of one id.
+#                     Stream the responses of a batch of ids.
+#                     Register the endpoints.
+#
+#
+# =============================================================================
+# 17.00.02 | Import Packages
+# =============================================================================
+import csv
+import hashlib
+import io
+import json
+from itertools import islice
+
+import flask
+import numpy as np
+
+from environment_configuration import API_MAX_AGE, BATCH_CHUNK_IDS, product_key_columns, user_key_columns
+from json_payload import page_records, column_values
+from callback_metrics import CallbackTimer
+
+# orjson is optional, the standard library encoder is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# query parameter -> column it filters on
+category_parameters = {'category2': 'Product Category 2', 'category3': 'Product Category 3'}
+
+
+# =============================================================================
+# 17.01.01 | Lookup Response
+# =============================================================================
+def json_response(body, status=200):
+    text = orjson.dumps(body) if orjson is not None else json.dumps(body)
+    return flask.Response(text, status=status, mimetype='application/json')
+
+
+# same data version and same request give the same response
+def request_etag(version):
+    request = flask.request
+    arguments = sorted(request.args.items(multi=True))
+    return hashlib.sha1('{}|{}|{}'.format(version, request.path, arguments).encode('utf-8')).hexdigest()[:32]
+
+
+# rows of one id (in rank order) narrowed by the category parameters and cut to top_k
+def lookup_positions(table, key_index, key, arguments):
+    positions = key_index.lookup(key)
+    for parameter, col_name in category_parameters.items():
+        value = arguments.get(parameter)
+        if value is not None and len(positions):
+            positions = positions[np.asarray(table.column(col_name)[positions] == value, dtype=bool)]
+    top_k = arguments.get('top_k')
+    return positions[:int(top_k)] if top_k is not None else positions
+
+
+def recommendations_response(data, table_name, key_column, key):
+    timer = CallbackTimer('api ' + table_name, key)
+    dataset = data.current()
+
+    etag = request_etag(dataset.version)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        top_k = flask.request.args.get('top_k')
+        if top_k is not None and not (top_k.isdigit() and int(top_k) > 0):
+            timer.finish()
+            return json_response({'error': 'top_k must be a positive integer'}, 400)
+
+        with timer.phase('load'):
+            table, key_indexes = dataset[table_name].get()
+        with timer.phase('lookup'):
+            index = key_indexes[key_column]
+            if key not in index:
+                timer.finish()
+                return json_response({'error': '{} {} not found'.format(key_column, key)}, 404)
+            positions = lookup_positions(table, index, key, flask.request.args)
+            timer.matched(len(positions), len(table))
+        with timer.phase('serialise'):
+            response = json_response({key_column: key,
+                                      'version': dataset.version,
+                                      'recommendations': page_records(table, positions)})
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(API_MAX_AGE)
+    timer.finish(response.content_length)
+    return response
+
+
+# =============================================================================
+# 17.02.01 | Batch Lookups
+# =============================================================================
+# the ids of a batch request, read lazily: one id per line of an uploaded file (form field "file")
+# or of the request body, or a JSON body {"ids": [...]} (parsed at once, meant for smaller batches)
+def request_ids():
+    request = flask.request
+    if request.mimetype == 'multipart/form-data':
+        lines = request.files['file'].stream if 'file' in request.files else ()
+    elif request.is_json:
+        lines = [str(key) for key in (request.get_json(silent=True) or {}).get('ids', [])]
+    else:
+        lines = request.stream
+    for line in lines:
+        key = (line.decode('utf-8') if isinstance(line, bytes) else line).strip()
+        if key:
+            yield key
+
+
+# rows of a chunk of ids (grouped by id, each in rank order) narrowed by the category parameters and cut
+# to top_k per id, returns the positions, the rows of each id and whether each id is present at all
+def batch_positions(table, key_index, keys, arguments):
+    positions, counts = key_index.lookup_many(keys)
+    found = counts > 0
+    key_rows = np.repeat(np.arange(len(keys)), counts)
+
+    keep = np.ones(len(positions), dtype=bool)
+    for parameter, col_name in category_parameters.items():
+        value = arguments.get(parameter)
+        if value is not None:
+            keep &= np.asarray(table.column(col_name)[positions] == value, dtype=bool)
+    top_k = arguments.get('top_k')
+    if top_k is not None:
+        # rank of each row within its id after the category filters
+        kept_counts = np.bincount(key_rows[keep], minlength=len(keys))
+        kept_offsets = np.cumsum(kept_counts) - kept_counts
+        rank = np.cumsum(keep) - 1 - kept_offsets[key_rows]
+        keep &= rank < int(top_k)
+
+    return positions[keep], np.bincount(key_rows[keep], minlength=len(keys)), found
+
+
+# one JSON line per id: {key column: id, "found": ..., "recommendations": [...]}
+def ndjson_lines(key_column, keys, records, counts, found):
+    lines = []
+    offset = 0
+    for key, count, present in zip(keys, counts.tolist(), found.tolist()):
+        line = {key_column: key, 'found': present, 'recommendations': records[offset:offset + count]}
+        lines.append(orjson.dumps(line) if orjson is not None else json.dumps(line).encode('utf-8'))
+        offset += count
+    return b'\n'.join(lines) + b'\n' if lines else b''
+
+
+# the CSV header row
+def text_row(values):
+    text = io.StringIO()
+    csv.writer(text).writerow(values)
+    return text.getvalue().encode('utf-8')
+
+
+# one CSV row per recommendation (the key column is the first table column), missing values are empty
+def csv_rows(table, positions):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerows(zip(*[column_values(table.column(col_name)[positions]) for col_name in table.columns]))
+    return text.getvalue().encode('utf-8')
+
+
+# streams the recommendations of every id in the request, BATCH_CHUNK_IDS ids at a time,
+# so memory stays the same however many ids are sent; the whole batch reads one data version
+def batch_response(data, table_name, key_column):
+    output_format = flask.request.args.get('format', 'ndjson')
+    top_k = flask.request.args.get('top_k')
+    if output_format not in ('ndjson', 'csv'):
+        return json_response({'error': 'format must be ndjson or csv'}, 400)
+    if top_k is not None and not (top_k.isdigit() and int(top_k) > 0):
+        return json_response({'error': 'top_k must be a positive integer'}, 400)
+
+    dataset = data.current()
+    arguments = flask.request.args.to_dict()
+
+    def generate():
+        timer = CallbackTimer('api ' + table_name + ' batch', None)
+        sent = 0
+        try:
+            table, key_indexes = dataset[table_name].get()
+            if output_format == 'csv':
+                header = text_row(table.columns)
+                sent += len(header)
+                yield header
+            ids = request_ids()
+            while True:
+                keys = list(islice(ids, BATCH_CHUNK_IDS))
+                if not keys:
+                    break
+                with timer.phase('lookup'):
+                    positions, counts, found = batch_positions(table, key_indexes[key_column], keys, arguments)
+                with timer.phase('serialise'):
+                    if output_format == 'csv':
+                        chunk = csv_rows(table, positions)
+                    else:
+                        chunk = ndjson_lines(key_column, keys, page_records(table, positions), counts, found)
+                sent += len(chunk)
+                yield chunk
+        except Exception as error:
+            timer.error = type(error).__name__
+            raise
+        finally:
+            timer.finish(sent)
+
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    response = flask.Response(flask.stream_with_context(generate()), mimetype=mimetype)
+    response.headers['X-Data-Version'] = dataset.version
+    return response
+
+
+# =============================================================================
+# 17.03.01 | Endpoints
+# =============================================================================
+# data is the app's VersionWatcher, every request reads the version that is current when it starts
+def register_recommendation_api(server, data, path):
+
+    def product_recommendations(product_id):
+        return recommendations_response(data, 'product', product_key_columns[0], product_id)
+
+    def user_recommendations(reviewer_id):
+        return recommendations_response(data, 'user', user_key_columns[0], reviewer_id)
+
+    server.add_url_rule(path + '/products/<product_id>/recommendations',
+                        'product_recommendations', product_recommendations)
+    server.add_url_rule(path + '/users/<reviewer_id>/recommendations',
+                        'user_recommendations', user_recommendations)
+
+    def product_recommendations_batch():
+        return batch_response(data, 'product', product_key_columns[0])
+
+    def user_recommendations_batch():
+        return batch_response(data, 'user', user_key_columns[0])
+
+    server.add_url_rule(path + '/products/recommendations/batch', 'product_recommendations_batch',
+                        product_recommendations_batch, methods=['POST'])
+    server.add_url_rule(path + '/users/recommendations/batch', 'user_recommendations_batch',
+                        user_recommendations_batch, methods=['POST'])
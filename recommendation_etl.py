@@ -0,0 +1,465 @@
+# ===============================================================================
+# 07.00.01 | Recommendation ETL | Documentation
+# ===============================================================================
+# Name:               07_recommendation_etl
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Functions behind data/data_configuration_oto.py that turn the DNN
+#                     predictions and the product metadata into the dashboard tables.
+#
+# Notes:              Kept in a module (instead of inline in the script) so the full run,
+#                     the incremental run and any other caller share exactly the same steps.
+#                     Metadata is looked up through an asin -> row index instead of merged in,
+#                     so no full size merge intermediates are created.
+#                     The full run streams the predictions: rows are processed in bounded chunks of whole
+#                     id groups (so ranking stays correct) and written straight into the columnar store.
+#                     The chunks of both pipelines are ranked in parallel on a process pool (ETL_WORKERS).
+#                     Ranking is one lexsort per chunk and can keep only the top k rows per id.
+#
+# Warnings:           The product metadata passed in must come from select_product_columns.
+#                     The pool needs the fork start method, elsewhere (Windows) the chunks run in one process.
+#                     Integer metadata columns come back as floats (missing products become NaN).
+#
+# Outline:            Import packages.
+#                     Select product columns.
+#                     Define the metadata lookup (asin -> row).
+#                     Define the top-k ranking kernel.
+#                     Add metadata to product predictions and rank them.
+#                     Add metadata to user predictions and rank them.
+#                     Stream predictions in chunks (in parallel) into the columnar store.
+#                     Create top 10 products.
+#                     Patch an existing table with re-scored ids (incremental mode).
+#
+#
+# =============================================================================
+# 07.00.02 | Import Packages
+# =============================================================================
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from environment_configuration import dictionary_columns
+from data_store import ColumnarTable, ColumnarWriter
+
+product_columns = ['Original Product Id','Original Product',
+                   'Rank Order','Recommended Product',
+                   'Product Category 2','Product Category 3',
+                   'Price','Number of Reviews',
+                   'Average Rating','Product URL']
+
+user_columns = ['Reviewer Id',
+                'Rank Order','Recommended Product',
+                'Product Category 2','Product Category 3',
+                'Price','Number of Reviews',
+                'Average Rating','Product URL']
+
+metadata_names = {'category2_t':'Product Category 2',
+                  'category3_t':'Product Category 3',
+                  'price_t':'Price',
+                  'imUrl':'Product URL',
+                  'numberReviews':'Number of Reviews',
+                  'meanStarRating':'Average Rating'}
+
+
+# =============================================================================
+# 07.01.01 | Select Product Columns
+# =============================================================================
+def select_product_columns(product_data):
+    product_data_sub = product_data[['asin','title','category2_t','category3_t','price_t','numberReviews','meanStarRating','imUrl']].copy()
+    # universally only taking the first 60 characters for the title
+    product_data_sub['title'] = product_data_sub['title'].str[:60]
+
+    # every product appears once per recommendation (20 times) after the merges,
+    # as categoricals each title / category / url string is stored once and the rows only hold a small code
+    product_text_columns = ['title','category2_t','category3_t','imUrl']
+    product_data_sub[product_text_columns] = product_data_sub[product_text_columns].astype('category')
+    return product_data_sub
+
+
+# makes sure every configured text column ends up dictionary encoded
+def encode_dictionary_columns(frame):
+    return frame.astype({col_name: 'category' for col_name in dictionary_columns
+                         if col_name in frame.columns})
+
+
+# =============================================================================
+# 07.01.02 | Metadata Lookup
+# =============================================================================
+# asin -> metadata row, replaces the left joins to the product data
+# taking rows through codes keeps the text columns categorical with the metadata dictionaries
+class MetadataLookup:
+
+    def __init__(self, product_data_sub):
+        # a left join would duplicate rows for a repeated asin, the lookup uses its first row
+        first = ~product_data_sub['asin'].duplicated().values
+        self.index = pd.Index(product_data_sub['asin'].values[first])
+        self.columns = {}
+        for col_name in product_data_sub.columns:
+            values = product_data_sub[col_name].values[first]
+            if not isinstance(values, pd.Categorical) and values.dtype.kind in 'iub':
+                values = values.astype(np.float64)
+            self.columns[col_name] = values
+
+    # row of each asin, -1 when the product has no metadata
+    def positions(self, asins):
+        return self.index.get_indexer(np.asarray(asins))
+
+    # column values of the given rows, missing (-1) rows become NaN like in a left join
+    def take(self, col_name, positions):
+        values = self.columns[col_name]
+        found = positions >= 0
+        if isinstance(values, pd.Categorical):
+            return pd.Categorical.from_codes(np.where(found, values.codes[positions], -1), dtype=values.dtype)
+        return np.where(found, values[positions], np.nan)
+
+    # the recommended product columns shared by both tables, already renamed for the dashboard
+    def recommended_columns(self, positions):
+        columns = {'Recommended Product': self.take('title', positions)}
+        for col_name, name in metadata_names.items():
+            columns[name] = self.take(col_name, positions)
+        return columns
+
+
+# =============================================================================
+# 07.01.03 | Top-K Ranking
+# =============================================================================
+# ranks the predictions within each key from the highest rating down with one stable lexsort,
+# replacing groupby(...).rank followed by a sort of the whole table by key and rank
+# returns the row order (sorted by key, then rank) and the rank of each row in that order, as floats like pandas
+# "first" numbers ties in input order, "dense" gives ties the same rank and the next rating the next rank
+# with top_k only the first top_k rows of each key are kept (ties at the cut are broken in input order)
+# missing ratings get no rank and go last within their key, rows with a missing key get no rank
+# and go last in input order (groupby leaves them out of the ranking, the sort by key and rank puts them last)
+def rank_within_groups(keys, ratings, method='first', top_k=None):
+    key_codes, uniques = pd.factorize(keys, sort=True)
+    missing_keys = key_codes < 0
+    key_codes = np.where(missing_keys, len(uniques), key_codes)
+    ratings = np.asarray(ratings, dtype=np.float64)
+
+    # lexsort is stable and sorts NaN last, so equal ratings keep their input order
+    order = np.lexsort((np.where(missing_keys, 0, -ratings), key_codes))
+    sorted_codes = key_codes[order]
+    sorted_ratings = ratings[order]
+
+    rows = np.arange(len(order))
+    group_start = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]] if len(order) else np.zeros(0, dtype=bool)
+    starts = np.maximum.accumulate(np.where(group_start, rows, 0)) if len(order) else rows
+
+    if method == 'dense':
+        new_rating = group_start | np.r_[True, sorted_ratings[1:] != sorted_ratings[:-1]]
+        counter = np.cumsum(new_rating)
+        rank_order = (counter - counter[starts] + 1).astype(np.float64)
+    elif method == 'first':
+        rank_order = (rows - starts + 1).astype(np.float64)
+    else:
+        raise ValueError('unknown rank method {}'.format(method))
+
+    unranked = np.isnan(sorted_ratings) | (sorted_codes == len(uniques))
+    rank_order[unranked] = np.nan
+
+    if top_k is not None:
+        keep = rows - starts < top_k
+        order, rank_order = order[keep], rank_order[keep]
+    return order, rank_order
+
+
+# number of rows left per table after keeping top_k rows of each key
+# (rows with a missing key count as one more key, like rank_within_groups cuts them)
+def ranked_rows(keys, top_k=None):
+    if top_k is None:
+        return len(keys)
+    _, counts = np.unique(pd.factorize(keys)[0], return_counts=True)
+    return int(np.minimum(counts, top_k).sum())
+
+
+# =============================================================================
+# 07.02.01 | Product Predictions
+# =============================================================================
+def enrich_product_recs(product_recs, metadata):
+    # we need metadata for both the original and the recommended products
+    recommended = metadata.positions(product_recs['recommended_product_id'])
+    original = metadata.positions(product_recs['original_product_id'])
+
+    # the original product was an inner join, predictions for originals without metadata are dropped
+    keep = original >= 0
+    recommended, original = recommended[keep], original[keep]
+
+    columns = {'Original Product Id': metadata.take('asin', original),
+               'Original Product': metadata.take('title', original)}
+    columns.update(metadata.recommended_columns(recommended))
+    columns['Predicted Rating'] = product_recs['predicted_rating'].values[keep]
+
+    return encode_dictionary_columns(pd.DataFrame(columns))
+
+
+def rank_product_recs(product_recs_enhanced, top_k=None):
+    # rank 1 is first for each product, tied ratings share a rank ("dense")
+    order, rank_order = rank_within_groups(product_recs_enhanced['Original Product Id'].values,
+                                           product_recs_enhanced['Predicted Rating'].values, 'dense', top_k)
+
+    product_recs_enhanced = product_recs_enhanced.take(order)
+    product_recs_enhanced['Rank Order'] = rank_order
+
+    # reorder columns (this drops predicted rating)
+    return product_recs_enhanced[product_columns]
+
+
+# =============================================================================
+# 07.03.01 | User Predictions
+# =============================================================================
+def enrich_user_recs(user_recs, metadata):
+    recommended = metadata.positions(user_recs['recommended_product_id'])
+
+    columns = {'Reviewer Id': user_recs['original_reviewerID'].values}
+    columns.update(metadata.recommended_columns(recommended))
+    columns['Predicted Rating'] = user_recs['predicted_rating'].values
+
+    return encode_dictionary_columns(pd.DataFrame(columns))
+
+
+def rank_user_recs(user_recs_enhanced, top_k=None):
+    # dense ranking doesn't work here b/c the predictions are the same so it assigns a rating of 1 to everything
+    # "first" numbers tied ratings in the order the predictions came in
+    order, rank_order = rank_within_groups(user_recs_enhanced['Reviewer Id'].values,
+                                           user_recs_enhanced['Predicted Rating'].values, 'first', top_k)
+
+    user_recs_enhanced = user_recs_enhanced.take(order)
+    user_recs_enhanced['Rank Order'] = rank_order
+
+    # reorder columns (this drops predicted rating)
+    return user_recs_enhanced[user_columns]
+
+
+# =============================================================================
+# 07.04.01 | Top 10 Products
+# =============================================================================
+def create_top_10_products(product_data_sub):
+    top_10_products = product_data_sub.sort_values('numberReviews', ascending=False).head(10)[['title','numberReviews','price_t','category2_t','category3_t']]
+    top_10_products = top_10_products.sort_values('numberReviews', ascending=True)
+
+    # plain text again, otherwise the ten rows would drag the full categories of every product along
+    top_10_products[['title','category2_t','category3_t']] = top_10_products[['title','category2_t','category3_t']].astype(object)
+    return top_10_products
+
+
+# =============================================================================
+# 07.05.01 | Patch Existing Table
+# =============================================================================
+# replaces every id group of the delta in the existing (ranked) table and writes the result to a columnar store
+# the delta must hold all recommendations of each id it contains, not just the changed rows,
+# because the groups are swapped as a whole and not re-ranked against the old rows
+# both tables are sorted by id (missing ids last), so the delta rows are spliced in between the kept rows
+# with one searchsorted instead of sorting the whole table again, and the result is written chunk by chunk
+# dictionaries only grow: new values of a text column are appended so the existing codes stay valid,
+# the id dictionary is kept sorted so its codes stay in id order (the existing codes are looked up in the new one)
+# a trigram index whose dictionary did not change is copied over instead of rebuilt
+def patch_recommendations(existing, delta, key_column, directory, chunk_rows, text_index_columns=(),
+                          sort_index_columns=(), bitmap_index_columns=()):
+    # dictionary of each text column in the patched table, and for the id column the lookup
+    # from existing codes to patched codes (code -1 reads the last entry and stays -1)
+    dtypes = {}
+    recode = None
+    text_indexes = {}
+    delta_columns = {}
+    for col_name in existing.columns:
+        values = existing.column(col_name)
+        if not isinstance(values, pd.Categorical):
+            delta_columns[col_name] = delta[col_name].to_numpy()
+            continue
+        delta_values = pd.Index(pd.unique(np.asarray(delta[col_name], dtype=object))).dropna()
+        categories = values.categories.append(delta_values.difference(values.categories))
+        if col_name == key_column:
+            categories = categories.sort_values()
+            if not categories.equals(values.categories):
+                recode = np.append(categories.get_indexer(values.categories), -1)
+        elif col_name in existing.text_indexes and len(categories) == len(values.categories):
+            text_indexes[col_name] = existing.text_indexes[col_name]
+        dtypes[col_name] = pd.CategoricalDtype(categories)
+        delta_columns[col_name] = np.asarray(pd.Categorical(delta[col_name], dtype=dtypes[col_name]).codes)
+
+    def existing_codes(col_name, positions):
+        codes = np.asarray(existing.column(col_name).codes)[positions]
+        return recode[codes] if col_name == key_column and recode is not None else codes
+
+    # ids in sort order with the missing id as the largest
+    missing_key = len(dtypes[key_column].categories)
+    existing_keys = existing_codes(key_column, slice(None))
+    existing_keys = np.where(existing_keys < 0, missing_key, existing_keys)
+    delta_keys = np.where(delta_columns[key_column] < 0, missing_key, delta_columns[key_column])
+    for name, keys in (('existing', existing_keys), ('delta', delta_keys)):
+        if np.any(keys[1:] < keys[:-1]):
+            raise ValueError('the {} table is not sorted by {}'.format(name, key_column))
+
+    replaced = np.zeros(missing_key + 1, dtype=bool)
+    replaced[delta_keys] = True
+    kept = np.flatnonzero(~replaced[existing_keys])
+    # no kept row has a delta id, so each delta row goes in front of the first kept row with a larger id
+    # (the rows of the delta before it moved it along by its own position)
+    delta_slots = np.searchsorted(existing_keys[kept], delta_keys) + np.arange(len(delta_keys))
+    rows = len(kept) + len(delta_keys)
+
+    # the rows [start, stop) of the patched table
+    def patched_chunk(start, stop):
+        first, end = np.searchsorted(delta_slots, [start, stop])
+        from_delta = np.zeros(stop - start, dtype=bool)
+        from_delta[delta_slots[first:end] - start] = True
+        kept_rows = kept[start - first:stop - end]
+        arrays = {}
+        for col_name in existing.columns:
+            if col_name in dtypes:
+                values = np.empty(stop - start, dtype=np.int64)
+                values[~from_delta] = existing_codes(col_name, kept_rows)
+                values[from_delta] = delta_columns[col_name][first:end]
+                values = pd.Categorical.from_codes(values, dtype=dtypes[col_name])
+            else:
+                values = np.empty(stop - start, dtype=existing.column(col_name).dtype)
+                values[~from_delta] = existing.column(col_name)[kept_rows]
+                values[from_delta] = delta_columns[col_name][first:end]
+            arrays[col_name] = values
+        return ColumnarTable(existing.columns, arrays)
+
+    writer = ColumnarWriter(directory, rows, patched_chunk(0, 0), text_index_columns, sort_index_columns,
+                            bitmap_index_columns, text_indexes)
+    for start in range(0, rows, chunk_rows):
+        writer.append(patched_chunk(start, min(start + chunk_rows, rows)))
+    writer.close()
+
+
+# =============================================================================
+# 07.06.01 | Stream Predictions
+# =============================================================================
+# chunks of whole id groups holding about chunk_rows rows (a larger group gets a chunk of its own)
+# yields (first group, end group, row positions) with the row positions into the predictions
+# rows without an id come last as one chunk of their own (groups, groups, row positions in input order),
+# the same place the ranking puts them
+def id_chunks(id_codes, groups, chunk_rows):
+    order = np.argsort(id_codes, kind='mergesort')
+    # rows without an id sort to the front
+    missing = np.count_nonzero(id_codes < 0)
+    order, missing_positions = order[missing:], order[:missing]
+
+    group_rows = np.bincount(id_codes[id_codes >= 0], minlength=groups)
+    group_ends = np.cumsum(group_rows)
+    group_starts = group_ends - group_rows
+
+    group = 0
+    while group < groups:
+        end_group = max(int(np.searchsorted(group_ends, group_starts[group] + chunk_rows, side='right')), group + 1)
+        yield group, end_group, order[group_starts[group]:group_ends[end_group - 1]]
+        group = end_group
+
+    if missing:
+        yield groups, groups, missing_positions
+
+
+# the two pipelines: prediction id column, dashboard key column, enrich step, rank step
+pipelines = {'product': ('original_product_id', 'Original Product Id', enrich_product_recs, rank_product_recs),
+             'user': ('original_reviewerID', 'Reviewer Id', enrich_user_recs, rank_user_recs)}
+
+# predictions and metadata the chunk workers read from, keyed by pipeline name (plus 'metadata' and 'top_k')
+# set before the pool forks, so the workers inherit them copy-on-write instead of receiving copies
+chunk_inputs = {}
+
+
+def set_chunk_inputs(inputs):
+    chunk_inputs.clear()
+    chunk_inputs.update(inputs)
+
+
+# enriches and ranks one chunk, runs in a pool worker (or inline without a pool)
+# returns one array per column, categoricals travel back as their codes because
+# pickling them would send the whole dictionary back with every chunk
+def rank_chunk(task):
+    pipeline, positions = task
+    id_column, key_column, enrich, rank = pipelines[pipeline]
+    ranked = rank(enrich(chunk_inputs[pipeline].take(positions), chunk_inputs['metadata']), chunk_inputs['top_k'])
+    return [np.asarray(ranked[col_name].cat.codes) if isinstance(ranked[col_name].dtype, pd.CategoricalDtype)
+            else ranked[col_name].values
+            for col_name in ranked.columns]
+
+
+# ranked chunks in id order as (first group, end group, ranked frame)
+# with a pool, up to in_flight chunks are submitted ahead so the workers stay busy while this process writes,
+# and results can not pile up faster than they are written
+def ranked_chunks(pipeline, id_codes, groups, chunk_rows, pool=None, in_flight=2):
+    pending = deque()
+    for group, end_group, positions in id_chunks(id_codes, groups, chunk_rows):
+        if pool is None:
+            yield group, end_group, rank_chunk((pipeline, positions))
+            continue
+        pending.append((group, end_group, pool.apply_async(rank_chunk, ((pipeline, positions),))))
+        if len(pending) >= in_flight:
+            first, end, result = pending.popleft()
+            yield first, end, result.get()
+
+    while pending:
+        first, end, result = pending.popleft()
+        yield first, end, result.get()
+
+
+# enriches and ranks the predictions chunk by chunk and writes each ranked chunk to the columnar store
+# the ids are sorted once up front, so the chunks are contiguous id ranges and are written in id order
+def stream_recommendations(pipeline, rows, directory, chunk_rows, text_index_columns=(), sort_index_columns=(),
+                           bitmap_index_columns=(), pool=None, in_flight=2):
+    id_column, key_column, enrich, rank = pipelines[pipeline]
+    predictions = chunk_inputs[pipeline]
+    id_codes, ids = pd.factorize(predictions[id_column].values, sort=True)
+    id_dtype = pd.CategoricalDtype(ids)
+
+    # an empty chunk gives the column order and the dictionaries to rebuild the categoricals with
+    template = rank(enrich(predictions.iloc[:0], chunk_inputs['metadata']), chunk_inputs['top_k'])
+
+    writer = None
+    for group, end_group, columns in ranked_chunks(pipeline, id_codes, len(ids), chunk_rows, pool, in_flight):
+        arrays = {}
+        for col_name, values in zip(template.columns, columns):
+            if col_name == key_column:
+                # the key becomes a dictionary column over all ids, looking codes up only among this chunk's ids
+                # (a missing id stays missing, code -1)
+                key_codes = pd.Index(ids[group:end_group]).get_indexer(np.asarray(values, dtype=object))
+                key_codes = np.where(key_codes >= 0, group + key_codes, -1)
+                values = pd.Categorical.from_codes(key_codes, dtype=id_dtype)
+            elif isinstance(template[col_name].dtype, pd.CategoricalDtype):
+                values = pd.Categorical.from_codes(values, dtype=template[col_name].dtype)
+            arrays[col_name] = values
+        chunk = ColumnarTable(template.columns, arrays)
+
+        if writer is None:
+            writer = ColumnarWriter(directory, rows, chunk, text_index_columns, sort_index_columns,
+                                    bitmap_index_columns)
+        writer.append(chunk)
+
+    if writer is not None:
+        writer.close()
+
+
+# runs the product and the user pipeline at the same time, each spreading its chunks over one shared process pool
+# workers <= 1 (or a platform without fork) runs everything in this process
+def stream_all_recommendations(product_recs, user_recs, metadata, product_directory, user_directory,
+                               chunk_rows, workers, text_index_columns=(), top_k=None, sort_index_columns=(),
+                               bitmap_index_columns=()):
+    set_chunk_inputs({'product': product_recs, 'user': user_recs, 'metadata': metadata, 'top_k': top_k})
+    # predictions for original products without metadata are dropped by the enrichment
+    known = metadata.positions(product_recs['original_product_id']) >= 0
+    product_rows = ranked_rows(product_recs['original_product_id'].values[known], top_k)
+    user_rows = ranked_rows(user_recs['original_reviewerID'].values, top_k)
+    jobs = [('product', product_rows, product_directory), ('user', user_rows, user_directory)]
+
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for pipeline, rows, directory in jobs:
+            stream_recommendations(pipeline, rows, directory, chunk_rows, text_index_columns, sort_index_columns,
+                                   bitmap_index_columns)
+        return
+
+    # the pool has to fork before any thread is started
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [executor.submit(stream_recommendations, pipeline, rows, directory, chunk_rows,
+                                       text_index_columns, sort_index_columns, bitmap_index_columns,
+                                       pool, 2 * workers)
+                       for pipeline, rows, directory in jobs]
+            for future in futures:
+                future.result()
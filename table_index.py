@@ -0,0 +1,558 @@
+# ===============================================================================
+# 03.00.01 | Table Index | Documentation
+# ===============================================================================
+# Name:               03_table_index
+# Author:             Rodd
+# Last Edited Date:   10/18/26
+# Description:        Defines indexes over the recommendation tables so the dash
+#                     callbacks can answer common filters without scanning every row.
+#
+# Notes:              Indexes are built once when the tables are loaded and are read only afterwards.
+#                     The recommendation pickles are sorted by id and rank order, so every
+#                     Original Product Id / Reviewer Id already sits in one contiguous block of rows.
+#
+# Warnings:           An index is only valid for the exact frame it was built from.
+#                     Rebuild it whenever the underlying table is reloaded.
+#
+# Outline:            Import packages.
+#                     Define key index (id -> contiguous row range).
+#                     Define trigram index (substring search over the distinct titles).
+#                     Define sort index (precomputed sort order of a column).
+#                     Define roaring bitmaps and bitmap indexes (low cardinality columns).
+#
+#
+# =============================================================================
+# 03.00.02 | Import Packages
+# =============================================================================
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_hashable
+
+
+# =============================================================================
+# 03.01.01 | Key Index
+# =============================================================================
+# maps each distinct value of a column to the range of rows holding it
+# if the rows of a key are not contiguous we keep a stable sort order of the table
+# and the ranges point into that order instead of into the table itself
+class KeyIndex:
+
+    def __init__(self, keys):
+        # dictionary encoded columns already carry their codes, anything else is factorized
+        if isinstance(keys, pd.Categorical):
+            codes, uniques = np.asarray(keys.codes), keys.categories
+        else:
+            codes, uniques = pd.factorize(np.asarray(keys), sort=False)
+
+        self.starts = np.zeros(len(uniques), dtype=np.int64)
+        self.stops = np.zeros(len(uniques), dtype=np.int64)
+
+        # a table grouped by key has exactly one run of rows per key
+        run_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else codes
+        run_codes = codes[run_starts]
+        if len(codes) == 0 or (run_codes.min() >= 0 and len(np.unique(run_codes)) == len(run_codes)):
+            self.order = None
+            self.starts[run_codes] = run_starts
+            self.stops[run_codes] = np.r_[run_starts[1:], len(codes)]
+        else:
+            # rows with a missing key (code -1) are sorted to the front of the order
+            self.order = np.argsort(codes, kind='mergesort')
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            base = len(codes) - int(counts.sum())
+            self.stops[:] = base + np.cumsum(counts)
+            self.starts[:] = self.stops - counts
+
+        # the distinct values as an index (the dictionary itself for categorical columns), its hash table
+        # answers single and vectorized lookups, the keys are not held a second time in a dictionary
+        self.keys = uniques if isinstance(uniques, pd.Index) else pd.Index(uniques)
+
+    # position of a key among the distinct values, None if the key is not present
+    def code(self, key):
+        # unhashable filter values can never be a key
+        if not is_hashable(key):
+            return None
+        try:
+            return self.keys.get_loc(key)
+        except KeyError:
+            return None
+
+    def __contains__(self, key):
+        return self.code(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    # returns the (start, stop) range of a key, an empty range if the key is not present
+    def range(self, key):
+        code = self.code(key)
+        if code is None:
+            return 0, 0
+        return int(self.starts[code]), int(self.stops[code])
+
+    # returns the row positions of a key in table order
+    def lookup(self, key):
+        start, stop = self.range(key)
+        if self.order is None:
+            return np.arange(start, stop, dtype=np.int64)
+        return np.sort(self.order[start:stop])
+
+    # row positions of many keys in one vectorized lookup, grouped by key in the order of the keys
+    # (each key's rows in table order), and the number of rows of each key (0 for a key that is not present)
+    def lookup_many(self, keys):
+        if len(self.keys) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(len(keys), dtype=np.int64)
+        # code -1 (not present) reads the last range, np.where drops it again
+        codes = self.keys.get_indexer(keys)
+        found = codes >= 0
+        starts = np.where(found, self.starts[codes], 0)
+        counts = np.where(found, self.stops[codes], 0) - starts
+        # one run of consecutive positions per key, built without a python loop
+        offsets = np.cumsum(counts) - counts
+        positions = np.arange(counts.sum(), dtype=np.int64) + np.repeat(starts - offsets, counts)
+        if self.order is not None:
+            # the order is a stable sort, so the rows of a key are already in table order
+            positions = np.asarray(self.order[positions], dtype=np.int64)
+        return positions, counts
+
+
+# builds a key index for each of the given columns that exists in the table
+def build_key_indexes(table, columns):
+    return {col_name: KeyIndex(table.column(col_name))
+            for col_name in columns if col_name in table.columns}
+
+
+# =============================================================================
+# 03.02.01 | Trigram Index
+# =============================================================================
+# inverted index from every 3 character substring to the dictionary codes of the values containing it
+# built over the distinct values of a dictionary encoded column, not over the rows,
+# a contains filter intersects the posting lists of its trigrams and checks the few candidates left
+# stored as three flat arrays (sorted trigram keys, offsets into the postings, postings)
+# so it can be saved next to the columnar table and memory-mapped like the columns
+class TrigramIndex:
+
+    files = ('keys', 'offsets', 'postings')
+
+    def __init__(self, keys, offsets, postings):
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def build(cls, values):
+        pair_keys = []
+        pair_codes = []
+        for code, text in enumerate(values):
+            if not isinstance(text, str):
+                continue
+            grams = {trigram_key(text[i:i + 3]) for i in range(len(text) - 2)}
+            pair_keys.extend(grams)
+            pair_codes.extend([code] * len(grams))
+
+        keys = np.array(pair_keys, dtype=np.int64)
+        codes = np.array(pair_codes, dtype=np.int32)
+        order = np.lexsort((codes, keys))
+        keys, codes = keys[order], codes[order]
+
+        unique_keys, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys)).astype(np.int64)
+        return cls(unique_keys, offsets, codes)
+
+    def save(self, path_prefix):
+        for name in self.files:
+            np.save(str(path_prefix) + '.trigram_' + name + '.npy', getattr(self, name))
+
+    @classmethod
+    def load(cls, path_prefix, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(str(path_prefix) + '.trigram_' + name + '.npy', mmap_mode=mmap_mode)
+                     for name in cls.files])
+
+    @classmethod
+    def exists(cls, path_prefix):
+        return all(Path(str(path_prefix) + '.trigram_' + name + '.npy').exists() for name in cls.files)
+
+    # sorted dictionary codes that contain every trigram of the needle,
+    # None when the needle is too short to have a trigram
+    def candidates(self, needle):
+        if len(needle) < 3:
+            return None
+        postings = []
+        for key in {trigram_key(needle[i:i + 3]) for i in range(len(needle) - 2)}:
+            i = np.searchsorted(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                return np.zeros(0, dtype=np.int32)
+            postings.append(self.postings[self.offsets[i]:self.offsets[i + 1]])
+
+        # start with the shortest list so every intersection stays small
+        postings.sort(key=len)
+        codes = np.asarray(postings[0])
+        for posting in postings[1:]:
+            codes = np.intersect1d(codes, posting, assume_unique=True)
+        return codes
+
+    # dictionary codes whose value contains the needle as a literal substring
+    def search(self, needle, dictionary):
+        codes = self.candidates(needle)
+        if codes is None:
+            return None
+        # sharing every trigram does not guarantee the substring, so verify the candidates
+        return np.array([code for code in codes if needle in dictionary[code]], dtype=np.int64)
+
+
+# three unicode code points (21 bits each) packed into one integer
+def trigram_key(gram):
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+
+# builds a trigram index for each of the given dictionary encoded columns of the table
+def build_text_indexes(table, columns):
+    return {col_name: TrigramIndex.build(table.column(col_name).categories)
+            for col_name in columns
+            if col_name in table.columns and isinstance(table.column(col_name), pd.Categorical)}
+
+
+# =============================================================================
+# 03.03.01 | Sort Index
+# =============================================================================
+# the ascending and descending row order of one column, computed once so sorting a request never sorts rows
+# a filtered result is sorted by marking its rows in a mask and walking the precomputed order:
+#   order[mask[order]] gives the matching rows in sorted order with one gather and one compress
+# both orders are stable (ties keep table order) and put missing values last
+# numeric columns also keep their values in ascending order, which makes the index a range index:
+# a range filter is two binary searches into the sorted values and a slice of the ascending order
+# saved next to the columnar table and memory-mapped like the columns
+class SortIndex:
+
+    files = ('ascending', 'descending', 'values')
+
+    def __init__(self, ascending, descending, values=None):
+        self.ascending = ascending
+        self.descending = descending
+        # sorted column values (NaN last), None for dictionary encoded columns
+        self.values = values
+
+    @classmethod
+    def build(cls, values):
+        key = sort_key(values)
+        dtype = np.int32 if len(key) < np.iinfo(np.int32).max else np.int64
+        # NaN sorts last either way, so negating the key keeps missing values at the end
+        ascending = np.argsort(key, kind='mergesort').astype(dtype)
+        descending = np.argsort(-key, kind='mergesort').astype(dtype)
+        sorted_values = None if isinstance(values, pd.Categorical) else np.asarray(values)[ascending]
+        return cls(ascending, descending, sorted_values)
+
+    def save(self, path_prefix):
+        for name in self.files:
+            if getattr(self, name) is not None:
+                np.save(str(path_prefix) + '.sort_' + name + '.npy', getattr(self, name))
+
+    @classmethod
+    def load(cls, path_prefix, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(str(path_prefix) + '.sort_' + name + '.npy', mmap_mode=mmap_mode)
+                     if Path(str(path_prefix) + '.sort_' + name + '.npy').exists() else None
+                     for name in cls.files])
+
+    # the given row positions (any order, no duplicates) in sorted order
+    def sort(self, positions, descending=False):
+        order = self.descending if descending else self.ascending
+        if len(positions) == len(order):
+            # an unfiltered table is the precomputed order itself
+            return np.asarray(order, dtype=np.int64)
+        mask = np.zeros(len(order), dtype=bool)
+        mask[positions] = True
+        return np.asarray(order[mask[order]], dtype=np.int64)
+
+    # the (start, stop) slice of the ascending order holding the rows that satisfy "column operator value",
+    # None when the index cannot answer it (no sorted values, or an operator that is not a range)
+    def range(self, operator, value):
+        if self.values is None or np.isnan(value):
+            return None
+        # missing values sit after the last valid value and never match a comparison
+        valid = int(np.searchsorted(self.values, np.nan, side='left'))
+        left = int(np.searchsorted(self.values[:valid], value, side='left'))
+        right = int(np.searchsorted(self.values[:valid], value, side='right'))
+        bounds = {'eq': (left, right), 'ge': (left, valid), 'gt': (right, valid),
+                  'le': (0, right), 'lt': (0, left)}
+        return bounds.get(operator)
+
+    # row positions in a range of the ascending order, in table order
+    def range_positions(self, start, stop):
+        return np.sort(np.asarray(self.ascending[start:stop], dtype=np.int64))
+
+
+# float sort key of a column, dictionary encoded columns sort by the position of their value
+# in the sorted dictionary (the dictionary itself is not always sorted), missing values become NaN
+def sort_key(values):
+    if isinstance(values, pd.Categorical):
+        value_rank = np.empty(len(values.categories) + 1, dtype=np.float64)
+        value_rank[values.categories.argsort()] = np.arange(len(values.categories))
+        # code -1 (missing) picks up the NaN at the end
+        value_rank[-1] = np.nan
+        return value_rank[values.codes]
+    return np.asarray(values, dtype=np.float64)
+
+
+# builds a sort index for each of the given columns that exists in the table
+def build_sort_indexes(table, columns):
+    return {col_name: SortIndex.build(table.column(col_name))
+            for col_name in columns if col_name in table.columns}
+
+
+# =============================================================================
+# 03.04.01 | Roaring Bitmap
+# =============================================================================
+# compressed set of row positions in the style of roaring bitmaps:
+# rows are split into chunks of 65536 (the high bits), each chunk keeps its low bits in a container,
+# a sorted uint16 array while the chunk holds few rows and a bitmap of 1024 uint64 words once it holds many
+# intersections and unions work container by container, so sparse and dense sets both stay cheap
+class RoaringBitmap:
+
+    chunk_bits = 16
+    # an array container of more than 4096 uint16 values takes more space than the 8 KB bitmap
+    array_limit = 4096
+
+    def __init__(self, containers=None):
+        # chunk number -> container
+        self.containers = dict(containers or {})
+
+    @classmethod
+    def from_positions(cls, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        chunks = positions >> cls.chunk_bits
+        lows = (positions & 0xFFFF).astype(np.uint16)
+        starts = np.flatnonzero(np.r_[True, chunks[1:] != chunks[:-1]]) if len(positions) else positions
+        stops = np.r_[starts[1:], len(positions)]
+        return cls({int(chunks[start]): _container(np.sort(lows[start:stop]))
+                    for start, stop in zip(starts, stops)})
+
+    def __len__(self):
+        return sum(_cardinality(container) for container in self.containers.values())
+
+    def __and__(self, other):
+        containers = {}
+        for chunk in self.containers.keys() & other.containers.keys():
+            container = _intersect(self.containers[chunk], other.containers[chunk])
+            if len(container):
+                containers[chunk] = container
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for chunk, container in other.containers.items():
+            containers[chunk] = _union(containers[chunk], container) if chunk in containers else container
+        return RoaringBitmap(containers)
+
+    # the row positions in the set, sorted
+    def positions(self):
+        if not self.containers:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([(chunk << self.chunk_bits) + _lows(self.containers[chunk]).astype(np.int64)
+                               for chunk in sorted(self.containers)])
+
+
+def _is_dense(container):
+    return container.dtype == np.uint64
+
+
+# 65536 booleans, one per low value
+def _bits(container):
+    return np.unpackbits(container.view(np.uint8), bitorder='little').view(bool)
+
+
+def _words(bits):
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def _lows(container):
+    return np.flatnonzero(_bits(container)).astype(np.uint16) if _is_dense(container) else container
+
+
+def _cardinality(container):
+    return int(np.count_nonzero(_bits(container))) if _is_dense(container) else len(container)
+
+
+# picks the cheaper container for a sorted array of low values
+def _container(lows):
+    if len(lows) <= RoaringBitmap.array_limit:
+        return lows
+    bits = np.zeros(1 << RoaringBitmap.chunk_bits, dtype=bool)
+    bits[lows] = True
+    return _words(bits)
+
+
+def _intersect(left, right):
+    if _is_dense(left) and _is_dense(right):
+        words = left & right
+        return _container(_lows(words)) if _cardinality(words) <= RoaringBitmap.array_limit else words
+    if _is_dense(left):
+        left, right = right, left
+    if _is_dense(right):
+        return left[_bits(right)[left]]
+    return np.intersect1d(left, right, assume_unique=True)
+
+
+def _union(left, right):
+    if _is_dense(left) or _is_dense(right):
+        if not _is_dense(left):
+            left, right = right, left
+        if _is_dense(right):
+            return left | right
+        bits = _bits(left).copy()
+        bits[right] = True
+        return _words(bits)
+    return _container(np.union1d(left, right))
+
+
+# =============================================================================
+# 03.04.02 | Bitmap Index
+# =============================================================================
+# one roaring bitmap of row positions per distinct value of a low cardinality column
+# a filter clause is evaluated on the distinct values only, the bitmaps of the matching values are unioned,
+# and the clauses of a query are combined by intersecting bitmaps before any row data is read
+# keys are the distinct values (numeric columns) or dictionary codes (dictionary encoded columns),
+# missing values get a key too (NaN / code -1) so != filters still match them like a scan does
+# stored as flat arrays so it can be saved next to the columnar table and memory-mapped:
+#   keys, key_offsets (containers of each key), and per container its chunk, whether it is dense,
+#   and where it starts and how long it is in lows (array containers) or words (bitmap containers)
+class BitmapIndex:
+
+    files = ('keys', 'key_offsets', 'chunks', 'dense', 'starts', 'sizes', 'lows', 'words')
+
+    def __init__(self, keys, key_offsets, chunks, dense, starts, sizes, lows, words):
+        self.keys = keys
+        self.key_offsets = key_offsets
+        self.chunks = chunks
+        self.dense = dense
+        self.starts = starts
+        self.sizes = sizes
+        self.lows = lows
+        self.words = words
+        # rows holding each key, counted on first use
+        self._key_rows = None
+
+    # None when the column has more than max_values distinct values
+    @classmethod
+    def build(cls, values, max_values):
+        if isinstance(values, pd.Categorical):
+            row_keys = np.asarray(values.codes, dtype=np.float64)
+        else:
+            row_keys = np.asarray(values, dtype=np.float64)
+        # NaN sorts last, so missing values are the last key
+        order = np.argsort(row_keys, kind='mergesort')
+        sorted_keys = row_keys[order]
+        starts = np.flatnonzero(np.r_[True, ~((sorted_keys[1:] == sorted_keys[:-1]) |
+                                              (np.isnan(sorted_keys[1:]) & np.isnan(sorted_keys[:-1])))]) \
+            if len(order) else order
+        if len(starts) > max_values:
+            return None
+        stops = np.r_[starts[1:], len(order)]
+
+        key_offsets = [0]
+        chunks, dense, container_starts, sizes, lows, words = [], [], [], [], [], []
+        used = {False: 0, True: 0}
+        for start, stop in zip(starts, stops):
+            bitmap = RoaringBitmap.from_positions(np.sort(order[start:stop]))
+            for chunk in sorted(bitmap.containers):
+                container = bitmap.containers[chunk]
+                is_dense = _is_dense(container)
+                chunks.append(chunk)
+                dense.append(is_dense)
+                container_starts.append(used[is_dense])
+                sizes.append(len(container))
+                used[is_dense] += len(container)
+                (words if is_dense else lows).append(container)
+            key_offsets.append(len(chunks))
+
+        return cls(sorted_keys[starts].copy(), np.array(key_offsets, dtype=np.int64),
+                   np.array(chunks, dtype=np.int64), np.array(dense, dtype=bool),
+                   np.array(container_starts, dtype=np.int64), np.array(sizes, dtype=np.int64),
+                   np.concatenate(lows).astype(np.uint16) if lows else np.zeros(0, dtype=np.uint16),
+                   np.concatenate(words) if words else np.zeros(0, dtype=np.uint64))
+
+    def save(self, path_prefix):
+        for name in self.files:
+            np.save(str(path_prefix) + '.bitmap_' + name + '.npy', getattr(self, name))
+
+    @classmethod
+    def load(cls, path_prefix, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(str(path_prefix) + '.bitmap_' + name + '.npy', mmap_mode=mmap_mode)
+                     for name in cls.files])
+
+    # the distinct values of the column in key order, dictionary codes are decoded (missing becomes None)
+    def key_values(self, values):
+        if isinstance(values, pd.Categorical):
+            dictionary = np.append(np.asarray(values.categories, dtype=object), None)
+            return dictionary[np.asarray(self.keys, dtype=np.int64)]
+        return np.asarray(self.keys)
+
+    # number of rows holding each key (in key order), tells the cost of a union before it is built
+    def key_rows(self):
+        if self._key_rows is None:
+            container_rows = np.asarray(self.sizes, dtype=np.int64).copy()
+            for c in np.flatnonzero(self.dense):
+                container_rows[c] = _cardinality(np.asarray(self.words[self.starts[c]:self.starts[c] + self.sizes[c]]))
+            self._key_rows = np.add.reduceat(container_rows, np.asarray(self.key_offsets[:-1], dtype=np.int64)) \
+                if len(container_rows) else np.zeros(len(self.keys), dtype=np.int64)
+        return self._key_rows
+
+    # rows holding the key at position i
+    def bitmap(self, i):
+        containers = {}
+        for c in range(self.key_offsets[i], self.key_offsets[i + 1]):
+            data = self.words if self.dense[c] else self.lows
+            containers[int(self.chunks[c])] = np.asarray(data[self.starts[c]:self.starts[c] + self.sizes[c]])
+        return RoaringBitmap(containers)
+
+    # rows holding any of the keys at the given positions, in one pass over all their containers
+    # (folding one bitmap at a time would copy the growing union once per key):
+    # the low values of every array container are marked in one row mask and the bitmap containers are or-ed
+    # into it, no sort is needed as the low values of a chunk are bounded; each chunk of the mask becomes a container
+    def union(self, key_positions):
+        key_positions = np.asarray(key_positions, dtype=np.int64)
+        first = np.asarray(self.key_offsets[key_positions], dtype=np.int64)
+        containers = _ranges(first, np.asarray(self.key_offsets[key_positions + 1], dtype=np.int64) - first)
+        if not len(containers):
+            return RoaringBitmap()
+        chunks = np.asarray(self.chunks[containers], dtype=np.int64)
+        dense = np.asarray(self.dense[containers], dtype=bool)
+        starts = np.asarray(self.starts[containers], dtype=np.int64)
+        sizes = np.asarray(self.sizes[containers], dtype=np.int64)
+
+        chunk_rows = 1 << RoaringBitmap.chunk_bits
+        used_chunks = np.unique(chunks)
+        # chunk number -> its slot in the mask
+        slots = np.zeros(int(used_chunks[-1]) + 1, dtype=np.int64)
+        slots[used_chunks] = np.arange(len(used_chunks))
+        mask = np.zeros(len(used_chunks) * chunk_rows, dtype=bool)
+
+        lows = np.asarray(self.lows[_ranges(starts[~dense], sizes[~dense])], dtype=np.int64)
+        mask[np.repeat(slots[chunks[~dense]] * chunk_rows, sizes[~dense]) + lows] = True
+        for chunk, start, size in zip(chunks[dense].tolist(), starts[dense].tolist(), sizes[dense].tolist()):
+            chunk_mask = mask[slots[chunk] * chunk_rows:(slots[chunk] + 1) * chunk_rows]
+            chunk_mask |= _bits(np.asarray(self.words[start:start + size]))
+
+        return RoaringBitmap({chunk: _container(np.flatnonzero(mask[slot * chunk_rows:(slot + 1) * chunk_rows])
+                                                .astype(np.uint16))
+                              for slot, chunk in enumerate(used_chunks.tolist())})
+
+
+# the positions start .. start + size of every (start, size) pair, concatenated
+def _ranges(starts, sizes):
+    offsets = np.cumsum(sizes) - sizes
+    return np.repeat(starts - offsets, sizes) + np.arange(int(sizes.sum()), dtype=np.int64)
+
+
+# builds a bitmap index for each of the given columns with few enough distinct values
+def build_bitmap_indexes(table, columns, max_values):
+    indexes = {}
+    for col_name in columns:
+        if col_name in table.columns:
+            index = BitmapIndex.build(table.column(col_name), max_values)
+            if index is not None:
+                indexes[col_name] = index
+    return indexes
@@ -0,0 +1,18 @@
+import pytest
+from dash.exceptions import PreventUpdate
+
+from callback_metrics import callback_timer, metrics
+
+
+def test_prevent_update_is_not_an_error():
+    with pytest.raises(PreventUpdate):
+        with callback_timer('superseded table', '{Price} > 1'):
+            raise PreventUpdate
+    with pytest.raises(ValueError):
+        with callback_timer('superseded table', '{Price} > 1'):
+            raise ValueError
+
+    callback = metrics.snapshot()['callbacks']['superseded table']
+    assert callback['requests'] == 2
+    assert callback['no_updates'] == 1
+    assert callback['errors'] == 1
@@ -0,0 +1,25 @@
+import pytest
+
+from data_versions import Dataset, VersionWatcher, publish_version
+
+
+# a version whose warm-up fails is skipped like one that fails to load, until another version is published
+def test_failed_warm_is_not_retried(tmp_path):
+    warmed = []
+
+    def warm(dataset, previous):
+        warmed.append(dataset.version)
+        if dataset.version == 'broken':
+            raise OSError('table missing')
+
+    watcher = VersionWatcher(tmp_path, lambda version: Dataset(version, {}), 0, warm)
+    publish_version(tmp_path, 'broken')
+    with pytest.raises(OSError):
+        watcher.refresh()
+    assert not watcher.refresh()
+    assert watcher.current().version != 'broken'
+    assert warmed == ['broken']
+
+    publish_version(tmp_path, 'fixed')
+    assert watcher.refresh()
+    assert watcher.current().version == 'fixed'
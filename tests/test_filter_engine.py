@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from data_store import ColumnarTable
+from filter_engine import filter_positions, first_positions, normalize_filter_query, parse_filter_query
+from filter_engine import sort_order, sort_positions
+from table_index import build_sort_indexes, build_text_indexes
+
+
+def title_table(rows=50000):
+    rng = np.random.default_rng(0)
+    titles = np.array(['title {}'.format(i) for i in range(5000)], dtype=object)
+    codes = rng.integers(-1, len(titles), rows)
+    table = ColumnarTable(['Original Product', 'Price'],
+                          {'Original Product': pd.Categorical.from_codes(codes, categories=titles),
+                           'Price': rng.random(rows) * 100})
+    table.text_indexes = build_text_indexes(table, ['Original Product'])
+    table.sort_indexes = build_sort_indexes(table, ['Price'])
+    return table
+
+
+# the block scan (dictionary masks built once per query) finds the same rows as the full evaluation
+def test_block_scan_matches_full_evaluation():
+    table = title_table()
+    for query in ('{Original Product} contains 12', '{Original Product} > "title 4"',
+                  '{Original Product} != "title 7" && {Price} < 50', '{Original Product} = "title 3"',
+                  '{Original Product} contains zz'):
+        for sort_by in ([], [{'column_id': 'Price', 'direction': 'desc'}]):
+            expected = filter_positions(table, {}, query)
+            order = sort_order(table, sort_by)
+            if order is not None:
+                expected = sort_positions(table, expected, order)
+            positions, complete = first_positions(table, {}, query, sort_by, len(table), 4096)
+            assert complete
+            np.testing.assert_array_equal(positions, expected)
+            positions, _ = first_positions(table, {}, query, sort_by, 11, 4096)
+            np.testing.assert_array_equal(positions[:11], expected[:11])
+
+
+# the callbacks parse the query once and pass the clauses on, they are evaluated and cached like the string
+def test_parsed_clauses_are_the_query():
+    table = title_table(5000)
+    query = '{Price} < 50 && {Original Product} contains 12'
+    clauses = parse_filter_query(query)
+    assert normalize_filter_query(clauses) == normalize_filter_query(query)
+    np.testing.assert_array_equal(filter_positions(table, {}, clauses), filter_positions(table, {}, query))
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+import filter_engine
+import filter_executor
+from data_store import ColumnarTable
+from filter_engine import ResultCache, ResultCounts, filter_positions, sort_positions, sort_order
+from table_index import build_sort_indexes
+
+
+def price_table(rows=200000):
+    frame = pd.DataFrame({'Original Product Id': ['p{}'.format(row % 5000) for row in range(rows)],
+                          'Price': np.arange(rows, dtype=np.float64) % 100})
+    table = ColumnarTable.from_frame(frame)
+    table.sort_indexes = build_sort_indexes(table, ['Price'])
+    return table
+
+
+# a result too big for the result cache still counts as finished, the table stops polling
+# and the evaluation is not submitted again
+def test_finished_result_bigger_than_the_cache(monkeypatch):
+    monkeypatch.setattr(filter_engine, 'result_cache', ResultCache(1024))
+    monkeypatch.setattr(filter_engine, 'result_counts', ResultCounts(100))
+    monkeypatch.setattr(filter_executor, 'BLOCK_SCAN', True)
+    monkeypatch.setattr(filter_executor, 'FILTER_BLOCK_ROWS', 4096)
+
+    table = price_table()
+    query = '{Price} >= 10'
+    sort_by = [{'column_id': 'Price', 'direction': 'desc'}]
+    expected = sort_positions(table, filter_positions(table, {}, query), sort_order(table, sort_by))
+
+    positions, matches, complete = filter_executor.evaluate_filter('prices', table, {}, query, sort_by, 31)
+    assert not complete
+    for future in list(filter_executor.filter_executor.in_flight.values()):
+        future.result()
+
+    submitted = []
+    monkeypatch.setattr(filter_executor.filter_executor, 'submit', lambda *arguments: submitted.append(arguments))
+    for _ in range(3):
+        positions, matches, complete = filter_executor.evaluate_filter('prices', table, {}, query, sort_by, 31)
+        assert complete
+        assert matches == len(expected)
+        np.testing.assert_array_equal(positions[:31], expected[:31])
+    assert not submitted
+
+
+def test_empty_query_is_every_row():
+    table = price_table(1000)
+    positions, matches, complete = filter_executor.evaluate_filter('prices', table, {}, '', None, 11)
+    assert complete and matches == 1000
+    # no position per row is allocated, the page is sliced out of a range
+    assert isinstance(positions, range)
+    np.testing.assert_array_equal(positions[20:30], np.arange(20, 30))
+
+    sort_by = [{'column_id': 'Price', 'direction': 'asc'}]
+    positions, matches, complete = filter_executor.evaluate_filter('prices', table, {}, '', sort_by, 11)
+    assert complete and matches == 1000
+    np.testing.assert_array_equal(positions, table.sort_indexes['Price'].ascending)
+
+
+# evaluations that finish before their done callback is added leave nothing behind in the executor
+def test_finished_evaluations_are_not_kept(monkeypatch):
+    monkeypatch.setattr(filter_engine, 'result_cache', ResultCache(1024 ** 2))
+    executor = filter_executor.FilterExecutor(2, 100)
+    table = price_table(1000)
+    futures = [executor.submit('client {}'.format(i % 7), 'prices', table, {}, '{{Price}} >= {}'.format(i % 50), None)
+               for i in range(3000)]
+    # a newer request of the same client cancels an older evaluation that has not started yet
+    executor.pool.shutdown(wait=True)
+    assert any(future.done() and not future.cancelled() for future in futures)
+    assert not executor.waiting
+    assert not executor.in_flight
+    assert not executor.client_futures
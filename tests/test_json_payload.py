@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.utils
+import pytest
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Input, Output
+
+import json_payload
+from callback_metrics import callback_timer, metrics, timed_json_encoder
+from data_store import ColumnarTable
+from json_payload import column_values, install_json_encoder, json_encoder, page_payload
+
+
+@pytest.fixture
+def restore_encoder(monkeypatch):
+    # install_json_encoder changes the encoding of the whole process, the previous encoder is installed again after
+    encoder = json_payload.response_encoder
+    monkeypatch.setattr(plotly.utils, 'PlotlyJSONEncoder', plotly.utils.PlotlyJSONEncoder)
+    yield
+    install_json_encoder(encoder)
+
+
+# a real callback request goes through the installed encoder: the page comes back as the row fragments
+# only the fast encoder can write, and the response encoding is timed for the callback
+@pytest.mark.parametrize('fast', [True, False])
+def test_callback_response_uses_installed_encoder(restore_encoder, fast):
+    install_json_encoder(timed_json_encoder(json_encoder(fast)))
+    table = ColumnarTable.from_frame(pd.DataFrame({'Product': ['a', 'b', None], 'Price': [1.5, np.nan, 3.0]}))
+    callback_name = 'encoder test {}'.format(fast)
+
+    app = dash.Dash(__name__)
+    app.layout = html.Div([dcc.Input(id='page'), html.Div(id='rows')])
+
+    @app.callback(Output('rows', 'children'), [Input('page', 'value')])
+    def rows(page):
+        with callback_timer(callback_name, None):
+            return page_payload('encoder test', table, np.arange(len(table)))
+
+    response = app.server.test_client().post('/_dash-update-component', json={
+        'output': 'rows.children', 'outputs': {'id': 'rows', 'property': 'children'},
+        'inputs': [{'id': 'page', 'property': 'value', 'value': '0'}],
+        'changedPropIds': ['page.value'], 'state': []})
+
+    assert response.status_code == 200
+    # Dash 1 answers a single output as {"props": {property: value}}, Dash 2 as {component id: {property: value}}
+    body = json.loads(response.data)['response']
+    assert (body['props'] if 'props' in body else body['rows'])['children'] == [
+        {'Product': 'a', 'Price': 1.5}, {'Product': 'b', 'Price': None}, {'Product': None, 'Price': 3.0}]
+    assert json_payload.fast_json_installed == (fast and json_payload.orjson is not None)
+    callback = metrics.snapshot()['callbacks'][callback_name]
+    assert callback['requests'] == 1
+    assert callback['phases_ms']['serialise']['count'] == 1
+    assert callback['payload_bytes']['count'] == 1
+
+
+# dictionary columns give the page's values (missing as None) without reading the rest of the dictionary
+def test_column_values_of_dictionary_column():
+    values = pd.Categorical.from_codes(np.array([2, -1, 0]), categories=['a', 'b', 'c'])
+    assert column_values(values) == ['c', None, 'a']
+    assert column_values(values[1:2]) == [None]
+    assert column_values(values[:0]) == []
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from data_store import read_columnar, write_columnar
+from recommendation_etl import MetadataLookup, select_product_columns, stream_all_recommendations, patch_recommendations
+from recommendation_etl import enrich_user_recs, rank_user_recs
+
+
+def product_data():
+    return pd.DataFrame({'asin': ['a', 'b', 'c'], 'title': ['Alpha', 'Beta', 'Gamma'],
+                         'category2_t': ['x', 'x', 'y'], 'category3_t': ['u', 'v', 'v'],
+                         'price_t': [1.0, 2.0, 3.0], 'numberReviews': [10, 20, 30],
+                         'meanStarRating': [4.0, 4.5, 5.0], 'imUrl': ['ua', 'ub', 'uc']})
+
+
+# rows with a missing reviewer id are streamed like the baseline ranks them:
+# last, without a rank, in input order (and the row count the writer checks still adds up)
+def test_missing_reviewer_id(tmp_path):
+    metadata = MetadataLookup(select_product_columns(product_data()))
+    product_recs = pd.DataFrame({'original_product_id': ['a', 'a', 'b', None],
+                                 'recommended_product_id': ['b', 'c', 'a', 'a'],
+                                 'predicted_rating': [4.0, 5.0, 3.0, 1.0]})
+    user_recs = pd.DataFrame({'original_reviewerID': ['r2', None, 'r1', np.nan, 'r2', None, 'r1'],
+                              'recommended_product_id': ['a', 'b', 'c', 'a', 'b', 'c', 'a'],
+                              'predicted_rating': [3.0, 5.0, 4.0, 2.0, 4.5, 1.0, 4.0]})
+
+    stream_all_recommendations(product_recs, user_recs, metadata, tmp_path / 'product', tmp_path / 'user',
+                               chunk_rows=2, workers=1)
+    streamed = read_columnar(tmp_path / 'user', mmap=False).to_frame()
+
+    expected = rank_user_recs(enrich_user_recs(user_recs, metadata)).reset_index(drop=True)
+    assert streamed['Reviewer Id'].tolist()[:4] == ['r1', 'r1', 'r2', 'r2']
+    assert streamed['Reviewer Id'].isna().tolist() == [False] * 4 + [True] * 3
+    np.testing.assert_array_equal(streamed['Rank Order'].values, expected['Rank Order'].values)
+    assert streamed['Recommended Product'].tolist() == expected['Recommended Product'].astype(object).tolist()
+
+    # the baseline: groupby rank, then a sort by reviewer and rank
+    baseline = enrich_user_recs(user_recs, metadata)
+    baseline['Rank Order'] = baseline.groupby('Reviewer Id')['Predicted Rating'].rank('first', ascending=False)
+    baseline = baseline.sort_values(by=['Reviewer Id', 'Rank Order'], ascending=True)
+    assert streamed['Recommended Product'].tolist() == baseline['Recommended Product'].astype(object).tolist()
+    np.testing.assert_array_equal(streamed['Rank Order'].values, baseline['Rank Order'].values)
+
+    assert len(read_columnar(tmp_path / 'product', mmap=False)) == 3
+
+
+# the splice gives the table the old patch built with a concat and a stable sort by id and rank:
+# new ids (before, between and after the existing ones), a replaced group of missing ids,
+# new dictionary values, and groups split over the chunks
+def test_patch_recommendations(tmp_path):
+    existing = pd.DataFrame({'Reviewer Id': pd.Categorical(['r2', 'r2', 'r4', 'r6', 'r6', None],
+                                                           categories=['r2', 'r4', 'r6']),
+                             'Recommended Product': pd.Categorical(['Alpha', 'Beta', 'Beta', 'Gamma', 'Alpha',
+                                                                    'Beta']),
+                             'Rank Order': [1.0, 2.0, 1.0, 1.0, 2.0, np.nan]})
+    delta = pd.DataFrame({'Reviewer Id': ['r1', 'r4', 'r4', 'r5', 'r7', None],
+                          'Recommended Product': pd.Categorical(['Delta', 'Alpha', 'Gamma', 'Beta', 'Delta',
+                                                                 'Alpha']),
+                          'Rank Order': [1.0, 1.0, 2.0, 1.0, 1.0, np.nan]})
+    write_columnar(existing, tmp_path / 'existing', text_index_columns=['Recommended Product'])
+
+    patch_recommendations(read_columnar(tmp_path / 'existing'), delta, 'Reviewer Id', tmp_path / 'patched',
+                          chunk_rows=4, text_index_columns=['Recommended Product'],
+                          sort_index_columns=['Rank Order'])
+    patched = read_columnar(tmp_path / 'patched', mmap=False)
+
+    keep = ~existing['Reviewer Id'].isin(delta['Reviewer Id'].unique())
+    expected = pd.concat([existing.loc[keep].astype(object), delta.astype(object)], ignore_index=True)
+    expected = expected.sort_values(by=['Reviewer Id', 'Rank Order'], kind='mergesort').reset_index(drop=True)
+    pd.testing.assert_frame_equal(patched.to_frame().astype(object), expected, check_dtype=False)
+
+    # the id dictionary stays sorted and the title dictionary got the new title (and a new trigram index)
+    assert list(patched.column('Reviewer Id').categories) == ['r1', 'r2', 'r4', 'r5', 'r6', 'r7']
+    assert patched.text_indexes['Recommended Product'].search('elt', patched.column('Recommended Product')
+                                                              .categories).tolist() == [3]
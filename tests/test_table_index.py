@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from table_index import BitmapIndex, KeyIndex, RoaringBitmap
+
+
+# the single pass union gives the same rows as or-ing the bitmaps one at a time, for sparse and dense containers
+def test_bitmap_union_matches_folded_union():
+    rng = np.random.default_rng(0)
+    values = np.where(rng.random(300000) < 0.5, 7.0, rng.integers(0, 300, 300000).astype(np.float64))
+    values[rng.random(300000) < 0.01] = np.nan
+    index = BitmapIndex.build(values, 4096)
+
+    for key_positions in ([], [0], [3, 7], np.arange(0, len(index.keys), 3), np.arange(len(index.keys))):
+        folded = RoaringBitmap()
+        for i in key_positions:
+            folded = folded | index.bitmap(i)
+        np.testing.assert_array_equal(index.union(key_positions).positions(), folded.positions())
+        assert index.key_rows()[np.asarray(key_positions, dtype=np.int64)].sum() == len(folded)
+
+
+# single lookups, membership and vectorized lookups agree, for grouped and scattered keys
+def test_key_index_lookups():
+    keys = np.array(['b', 'b', 'a', None, 'c', 'a'], dtype=object)
+    for values in (keys, pd.Categorical(keys), np.array(['a', 'a', 'b', 'c', 'c', 'c'], dtype=object)):
+        index = KeyIndex(values)
+        present = sorted(set(pd.Series(np.asarray(values, dtype=object)).dropna()))
+        assert len(index) == len(present)
+        for key in present:
+            assert key in index
+            np.testing.assert_array_equal(index.lookup(key), np.flatnonzero(np.asarray(values, dtype=object) == key))
+        for key in ('z', None, 5.0, float('nan'), ['a']):
+            assert key not in index
+            assert index.range(key) == (0, 0)
+        positions, counts = index.lookup_many(present + ['z'])
+        np.testing.assert_array_equal(positions, np.concatenate([index.lookup(key) for key in present]))
+        np.testing.assert_array_equal(counts, [len(index.lookup(key)) for key in present] + [0])